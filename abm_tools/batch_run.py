@@ -0,0 +1,224 @@
+"""
+Headless parameter sweeps of the Foraging Ants models.
+
+Every combination of the swept parameters and seeds is run in a process pool. As soon as a run
+finishes, its time series (food_collected and number of ants per mode) are written to
+<output>/runs/<run_id>.npz, one column per array, together with the parameters of the run.
+The run_id is a hash of the parameters, the number of steps and the collection period, so
+relaunching an interrupted sweep with the same arguments only runs the configurations that
+are not on disk yet.
+
+Usage:
+    python -m abm_tools.batch_run --output sweeps/study --model foraging_V2 \\
+        --initial-ants 30 100 --range-of-communication 2 5 --ants-needed 3 5 \\
+        --speed 1 --seeds 0 1 2 3 --steps 1000 --workers 8
+
+Results are loaded back with load_results(output).
+
+With --cache, the models are created once per configuration and seed and kept in a
+warm-start cache (see abm_tools.warmstart): relaunching the sweep with other --steps or
+--collect-every values, or adding seeds to it, loads the initialized models from the cache.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from abm_tools.warmstart import warm_model
+
+# Columns of the time series of one run
+COLUMNS = ("step", "food_collected", "explore", "return_to_colony", "go_to_food")
+
+
+def sweep_configurations(parameters, seeds):
+    """All the combinations of the swept parameters, for each seed.
+
+    Args:
+        parameters: dict of model parameter -> list of values
+        seeds: list of seeds
+
+    Returns:
+        list of dicts of model keyword arguments (including the seed)
+    """
+    names = sorted(parameters)
+    return [
+        {**dict(zip(names, values)), "seed": seed}
+        for values in itertools.product(*(parameters[name] for name in names))
+        for seed in seeds
+    ]
+
+
+def run_id(model_name, config, steps, collect_every=1):
+    """Stable identifier of a run, used to skip runs that are already on disk."""
+    key = json.dumps([model_name, config, steps, collect_every], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def collect_row(model):
+    """Values of COLUMNS for the current state of a model."""
+    modes = model.mode_counts()
+    return (
+        model.steps,
+        model.food_collected,
+        modes["explore"],
+        modes["return_to_colony"],
+        modes["go_to_food"],
+    )
+
+
+def run_single(model_name, config, steps, collect_every=1, cache_dir=None):
+    """Run one model configuration and return its time series as a dict of columns.
+
+    With a cache_dir, the initialized model is loaded from the warm-start cache if it is there.
+    """
+    model = warm_model(model_name, config, cache_dir)
+
+    rows = [collect_row(model)]
+    for _ in range(steps):
+        model.step()
+        if model.steps % collect_every == 0:
+            rows.append(collect_row(model))
+
+    table = np.array(rows, dtype=np.int64).reshape(-1, len(COLUMNS))
+    return {name: table[:, i] for i, name in enumerate(COLUMNS)}
+
+
+def _run_job(job):
+    """Worker entry point (must be picklable)."""
+    model_name, config, steps, collect_every, cache_dir = job
+    return config, run_single(model_name, config, steps, collect_every, cache_dir)
+
+
+def _write_run(path, model_name, config, steps, collect_every, columns):
+    """Write one run atomically, a partial file would otherwise be taken as done on resume."""
+    tmp_path = path + ".tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        config=np.array(
+            json.dumps({"model": model_name, "steps": steps, "collect_every": collect_every, **config})
+        ),
+        **columns,
+    )
+    os.replace(tmp_path, path)
+
+
+def run_sweep(
+    output,
+    parameters,
+    seeds,
+    steps,
+    model_name="foraging_V2",
+    fixed_parameters=None,
+    collect_every=1,
+    workers=None,
+    cache_dir=None,
+):
+    """Run a parameter sweep in a process pool, skipping the runs already in output.
+
+    Args:
+        output: directory of the results
+        parameters: dict of swept model parameter -> list of values
+        seeds: list of seeds, every configuration is run once per seed
+        steps: number of steps per run
+        model_name: "foraging_V1" or "foraging_V2"
+        fixed_parameters: model parameters shared by all the runs (e.g. engine, width)
+        collect_every: collect the time series every n steps
+        workers: number of worker processes (default: number of CPUs)
+        cache_dir: directory of the warm-start cache of the initialized models (default: no cache)
+
+    Returns:
+        number of runs executed (runs found on disk excluded)
+    """
+    runs_dir = os.path.join(output, "runs")
+    os.makedirs(runs_dir, exist_ok=True)
+
+    configs = sweep_configurations(parameters, seeds)
+    jobs = {}
+    for config in configs:
+        config = {**(fixed_parameters or {}), **config}
+        path = os.path.join(runs_dir, run_id(model_name, config, steps, collect_every) + ".npz")
+        if not os.path.exists(path):
+            jobs[path] = (model_name, config, steps, collect_every, cache_dir)
+
+    print(f"{len(jobs)} runs to do, {len(configs) - len(jobs)} already in {output}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_run_job, job): path for path, job in jobs.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            config, columns = future.result()
+            _write_run(futures[future], model_name, config, steps, collect_every, columns)
+            print(f"[{done}/{len(jobs)}] {config}")
+
+    return len(jobs)
+
+
+def load_results(output):
+    """Load all the runs of a sweep as one long pandas DataFrame (one row per run and collected step)."""
+    import pandas as pd
+
+    runs_dir = os.path.join(output, "runs")
+    frames = []
+    for file_name in sorted(os.listdir(runs_dir)):
+        if not file_name.endswith(".npz") or file_name.endswith(".tmp.npz"):
+            continue
+        with np.load(os.path.join(runs_dir, file_name)) as data:
+            config = json.loads(str(data["config"]))
+            frame = pd.DataFrame({name: data[name] for name in data.files if name != "config"})
+        frame.insert(0, "run_id", file_name[: -len(".npz")])
+        for i, (name, value) in enumerate(config.items(), start=1):
+            frame.insert(i, name, value)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, help="directory of the results")
+    parser.add_argument("--model", default="foraging_V2", choices=["foraging_V1", "foraging_V2"])
+    parser.add_argument("--engine", default="agents", choices=["agents", "vectorized"])
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--collect-every", type=int, default=1)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache", help="directory of the warm-start cache of the initialized models")
+    parser.add_argument("--initial-ants", type=int, nargs="+", default=[30])
+    parser.add_argument("--range-of-communication", type=float, nargs="+", default=[10])
+    parser.add_argument("--ants-needed", type=int, nargs="+", default=[5])
+    parser.add_argument("--speed", type=float, nargs="+", default=[1])
+    parser.add_argument("--initial-food", type=int, nargs="+", default=[10])
+    parser.add_argument("--width", type=int, nargs="+", default=[100])
+    parser.add_argument("--height", type=int, nargs="+", default=[100])
+    args = parser.parse_args()
+
+    parameters = {
+        name: getattr(args, name)
+        for name in (
+            "initial_ants",
+            "range_of_communication",
+            "ants_needed",
+            "speed",
+            "initial_food",
+            "width",
+            "height",
+        )
+    }
+    run_sweep(
+        args.output,
+        parameters,
+        args.seeds,
+        args.steps,
+        model_name=args.model,
+        fixed_parameters={"engine": args.engine},
+        collect_every=args.collect_every,
+        workers=args.workers,
+        cache_dir=args.cache,
+    )
+
+
+if __name__ == "__main__":
+    main()
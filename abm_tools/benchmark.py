@@ -0,0 +1,313 @@
+"""
+Benchmark suite of the Foraging Ants models.
+
+Every case (model, engine, number of ants, food density) is run headless at a fixed seed in
+its own Python process, so that the peak RSS reported is the one of the case alone. A case
+reports:
+
+- init_seconds: time to create the model
+- steps_per_sec: steps per second over the timed steps (after the warmup steps)
+- peak_rss_mb: peak resident memory of the process (peak_rss_worker_mb: of the largest worker
+  process of the tiled engine)
+- phases: seconds per step spent in check_for_food, communicate, move and Food.step
+  (with the vectorized engine, in the corresponding batched methods of VectorizedColony),
+  "other" being the rest of the step; not measured for the tiled engine, which steps in workers
+
+The space grows with the colony so that the density of ants stays the one of the default
+model (100 ants on 100 x 100), and the food density is given in food sources per 100 x 100.
+
+Usage:
+    python -m abm_tools.benchmark --output bench.json
+    python -m abm_tools.benchmark --ants 1000 10000 --engines vectorized --output bench.json \\
+        --compare baseline.json
+
+With --compare, the steps/sec of each case are compared to the same case of a previous
+result file, and the command exits with status 1 if one of them regressed by more than
+--tolerance.
+"""
+
+import argparse
+import datetime
+import functools
+import json
+import math
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from abm_tools.models import ROOT, load_model_module
+
+# Ants per unit of area of the default model (100 ants on 100 x 100)
+ANT_DENSITY = 100 / (100 * 100)
+# Area of reference of the food densities
+FOOD_DENSITY_AREA = 100 * 100
+
+PHASES = ("check_for_food", "communicate", "move", "food_step")
+
+
+def case_key(case):
+    """Identifier of a case, used to match cases between two result files."""
+    key = "{model}/{engine}/ants={initial_ants}/food_density={food_density}".format(**case)
+    if case["engine"] == "tiled":
+        key += "/tiles={}x{}".format(*case["tiles"])
+    return key
+
+
+def build_cases(models, engines, ants, food_densities, steps, warmup, seed, phases=True, tiles=(2, 2)):
+    """All the combinations of models, engines, colony sizes and food densities."""
+    return [
+        {
+            "model": model,
+            "engine": engine,
+            "initial_ants": n_ants,
+            "food_density": food_density,
+            "steps": steps,
+            "warmup": warmup,
+            "seed": seed,
+            "phases": phases,
+            "tiles": list(tiles),
+        }
+        for model in models
+        for engine in engines
+        for n_ants in ants
+        for food_density in food_densities
+    ]
+
+
+def model_parameters(case):
+    """Keyword arguments of the model of a case."""
+    side = max(100, math.ceil(math.sqrt(case["initial_ants"] / ANT_DENSITY)))
+    parameters = {
+        "initial_ants": case["initial_ants"],
+        "initial_food": max(1, round(case["food_density"] * side * side / FOOD_DENSITY_AREA)),
+        "width": side,
+        "height": side,
+        "engine": case["engine"],
+        "seed": case["seed"],
+    }
+    if case["engine"] == "tiled":
+        parameters["tiles"] = tuple(case["tiles"])
+    return parameters
+
+
+def _phase_methods(module, engine):
+    """(class, method name) measured for each phase."""
+    if engine == "vectorized":
+        from abm_tools.vectorized import VectorizedColony
+
+        return {
+            "check_for_food": (VectorizedColony, "_check_for_food"),
+            "communicate": (VectorizedColony, "_communicate"),
+            "move": (VectorizedColony, "_move"),
+            "food_step": (VectorizedColony, "_collect_food"),
+        }
+    return {
+        "check_for_food": (module.ForagingAnt, "check_for_food"),
+        "communicate": (module.ForagingAnt, "communicate"),
+        "move": (module.ForagingAnt, "move"),
+        "food_step": (module.Food, "step"),
+    }
+
+
+def _instrument(methods, timings):
+    """Wrap the methods so that their time adds up in timings[phase] (only done in the process of a case)."""
+
+    def timed(phase, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                timings[phase] += time.perf_counter() - start
+
+        return wrapper
+
+    for phase, (cls, name) in methods.items():
+        setattr(cls, name, timed(phase, getattr(cls, name)))
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """Peak resident memory of the current process (or of its largest finished child process), in MB."""
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(case):
+    """Run one case in the current process and return its measures."""
+    module = load_model_module(case["model"])
+    timings = dict.fromkeys(PHASES, 0.0)
+    # the phases of the tiled engine run in its worker processes
+    phases = case["phases"] and case["engine"] != "tiled"
+    if phases:
+        _instrument(_phase_methods(module, case["engine"]), timings)
+
+    start = time.perf_counter()
+    model = module.ForagingAntsModel(**model_parameters(case))
+    init_seconds = time.perf_counter() - start
+
+    for _ in range(case["warmup"]):
+        model.step()
+    timings.update(dict.fromkeys(PHASES, 0.0))
+
+    start = time.perf_counter()
+    for _ in range(case["steps"]):
+        model.step()
+    seconds = time.perf_counter() - start
+    model.close()
+
+    result = {
+        "case": case,
+        "parameters": model_parameters(case),
+        "init_seconds": init_seconds,
+        "seconds": seconds,
+        "steps_per_sec": case["steps"] / seconds if seconds > 0 else math.inf,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_worker_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "food_collected": model.food_collected,
+    }
+    if phases:
+        per_step = {phase: timings[phase] / case["steps"] for phase in PHASES}
+        per_step["other"] = max(0.0, seconds / case["steps"] - sum(per_step.values()))
+        result["phases"] = per_step
+    return result
+
+
+def run_case_subprocess(case, timeout=None):
+    """Run one case in a fresh Python process (so that its peak RSS is its own)."""
+    try:
+        completed = subprocess.run(
+            [sys.executable, "-m", "abm_tools.benchmark", "--run-case", json.dumps(case)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return {"case": case, "error": f"timeout after {timeout}s"}
+
+    if completed.returncode != 0:
+        return {"case": case, "error": completed.stderr.strip().splitlines()[-1:] or "failed"}
+    # the models may print, the result is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def environment():
+    """Description of the machine and versions, stored with the results."""
+    import mesa
+    import numpy
+    import scipy
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "mesa": mesa.__version__,
+        "numpy": numpy.__version__,
+        "scipy": scipy.__version__,
+    }
+
+
+def run_benchmark(cases, timeout=None, output=None):
+    """Run all the cases one after the other, writing the results after each case."""
+    report = {"environment": environment(), "results": []}
+    for i, case in enumerate(cases, start=1):
+        result = run_case_subprocess(case, timeout)
+        report["results"].append(result)
+        print(f"[{i}/{len(cases)}] {format_result(result)}", flush=True)
+        if output:
+            with open(output, "w") as f:
+                json.dump(report, f, indent=2)
+    return report
+
+
+def format_result(result):
+    key = case_key(result["case"])
+    if "error" in result:
+        return f"{key}: ERROR {result['error']}"
+    line = f"{key}: {result['steps_per_sec']:.2f} steps/s, {result['peak_rss_mb']:.0f} MB, init {result['init_seconds']:.2f}s"
+    if "phases" in result:
+        line += " | " + ", ".join(f"{phase} {1000 * t:.2f}ms" for phase, t in result["phases"].items())
+    return line
+
+
+def compare(report, baseline, tolerance=0.1):
+    """Compare the steps/sec of the cases found in both reports.
+
+    Returns:
+        list of (case key, baseline steps/sec, steps/sec, ratio, regressed)
+    """
+    reference = {
+        case_key(result["case"]): result for result in baseline["results"] if "error" not in result
+    }
+    rows = []
+    for result in report["results"]:
+        key = case_key(result["case"])
+        if "error" in result or key not in reference:
+            continue
+        before, after = reference[key]["steps_per_sec"], result["steps_per_sec"]
+        ratio = after / before
+        rows.append((key, before, after, ratio, ratio < 1 - tolerance))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="JSON file of the results")
+    parser.add_argument("--models", nargs="+", default=["foraging_V1", "foraging_V2"], choices=["foraging_V1", "foraging_V2"])
+    parser.add_argument("--engines", nargs="+", default=["agents", "vectorized"], choices=["agents", "vectorized", "tiled"])
+    parser.add_argument("--ants", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--food-densities", type=float, nargs="+", default=[1, 10], help="food sources per 100 x 100")
+    parser.add_argument("--steps", type=int, default=20, help="timed steps per case")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed steps before the timed ones")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tiles", type=int, nargs=2, default=[2, 2], help="tiles of the tiled engine")
+    parser.add_argument("--no-phases", action="store_true", help="do not time the phases (no instrumentation overhead)")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds allowed per case")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown tolerated by --compare")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return
+
+    cases = build_cases(
+        args.models,
+        args.engines,
+        args.ants,
+        args.food_densities,
+        args.steps,
+        args.warmup,
+        args.seed,
+        phases=not args.no_phases,
+        tiles=args.tiles,
+    )
+    report = run_benchmark(cases, timeout=args.timeout, output=args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(report, baseline, args.tolerance)
+        print(f"\nComparison with {args.compare} (tolerance {args.tolerance:.0%}):")
+        for key, before, after, ratio, regressed in rows:
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{key}: {before:.2f} -> {after:.2f} steps/s ({ratio:.2f}x){flag}")
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
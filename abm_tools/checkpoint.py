@@ -0,0 +1,345 @@
+"""
+Checkpoints of the Foraging Ants models.
+
+The state of a model is written as a NumPy archive (.npz) of flat arrays, one row per ant,
+food source or memory entry, instead of pickled Python objects:
+
+- the model parameters and counters (food_collected, steps) and the RNG states, as JSON
+- the ants: unique_id, position, direction, speed, mode, target (NaN when none), trail, angle
+- their memory entries (memory_V1 or memory_V2), or the food memory arrays of the vectorized engine
+- the food sources: unique_id, position, ants_needed
+- the scheduled legs of the ants travelling to their target, if any (see abm_tools.legs)
+- the pheromone field, if any
+- the number of rows and chunks of the collected data, which is flushed first, so that a run
+  restored with the same data_directory continues the same series
+
+A model is restored by creating an empty model with the same parameters, then the agents in
+the same order and with the same unique_id, and the RNG states last, so that the restored
+run continues exactly like the original one.
+
+The ants of the vectorized engine are saved straight from their arrays, which makes a
+checkpoint of 100k ants a few plain array copies. With the agents engine the memories are
+read entry by entry.
+"""
+
+import itertools
+import json
+
+import numpy as np
+from mesa.agent import Agent
+
+from abm_tools.vectorized import MODES, VectorizedColony
+
+FORMAT_VERSION = 1
+
+# Model attributes restored as they are (indirect parameters and counters)
+ATTRIBUTES = (
+    "colony_position",
+    "colony_radius",
+    "ant_search_radius",
+    "food_collection_radius",
+    "food_min_distance",
+    "pheromone_deposit",
+    "pheromone_trail_decay",
+    "pheromone_attraction",
+    "food_collected",
+    "steps",
+    "running",
+)
+
+PHEROMONE_ATTRIBUTES = ("evaporation", "diffusion", "detection_threshold")
+
+
+def _next_unique_id(model):
+    """unique_id of the next agent created in the model (without consuming it)."""
+    next_id = next(Agent._ids[model])
+    Agent._ids[model] = itertools.count(next_id)
+    return next_id
+
+
+def _positions(agents):
+    return np.array([agent.position for agent in agents], dtype=float).reshape(-1, 2)
+
+
+def _memory_kind(ants):
+    if not ants:
+        return None
+    return "V2" if hasattr(ants[0].memory, "short_term") else "V1"
+
+
+def _memory_capacity(memory):
+    return memory.short_term.capacity if hasattr(memory, "short_term") else memory.capacity
+
+
+def _memory_rows(ants, kind):
+    """Memory entries of the ants as columns (owner row, store, type, step, content, external id, number)."""
+    rows = []
+    if kind == "V1":
+        for owner, ant in enumerate(ants):
+            for (_, number), entry in ant.memory.memory_storage.items():
+                rows.append(
+                    (owner, 0, entry["entry_type"], entry["entry_step"], entry["entry_content"],
+                     entry.get("external_agent_id", -1), number)
+                )
+    elif kind == "V2":
+        for owner, ant in enumerate(ants):
+            stores = ((0, ant.memory.short_term.entries), (1, ant.memory.long_term.entries.values()))
+            for store, entries in stores:
+                for entry in entries:
+                    if set(entry.entry_metadata) - {"external_id"}:
+                        raise ValueError(f"Cannot checkpoint the memory metadata {entry.entry_metadata}")
+                    rows.append(
+                        (owner, store, entry.entry_type, entry.entry_step, entry.entry_content,
+                         entry.entry_metadata.get("external_id", -1), -1)
+                    )
+    return rows
+
+
+def _memory_arrays(ants, kind):
+    rows = _memory_rows(ants, kind)
+    entry_types = sorted({row[2] for row in rows})
+    type_codes = {entry_type: code for code, entry_type in enumerate(entry_types)}
+    try:
+        contents = np.array([row[4] for row in rows], dtype=float).reshape(len(rows), -1) if rows else np.empty((0, 0))
+    except ValueError as error:
+        raise ValueError("Only memory contents that are numeric arrays of one shape can be checkpointed") from error
+
+    arrays = {
+        "memory_owner": np.array([row[0] for row in rows], dtype=np.int64),
+        "memory_store": np.array([row[1] for row in rows], dtype=np.int8),
+        "memory_type": np.array([type_codes[row[2]] for row in rows], dtype=np.int32),
+        "memory_step": np.array([row[3] for row in rows], dtype=np.int64),
+        "memory_content": contents,
+        "memory_external_id": np.array([row[5] for row in rows], dtype=np.int64),
+        "memory_number": np.array([row[6] for row in rows], dtype=np.int64),
+    }
+    if kind == "V1":
+        arrays["memory_next_number"] = np.array([ant.memory.next_entry_number() for ant in ants], dtype=np.int64)
+    return arrays, entry_types
+
+
+def save_checkpoint(model, path, ant_class, food_class):
+    """Write the state of a ForagingAntsModel in a NumPy archive.
+
+    Args:
+        model: the model
+        path: file name of the archive (.npz)
+        ant_class, food_class: the agent classes of the model
+    """
+    if model.engine == "tiled":
+        raise ValueError("Checkpoints of the tiled engine are not supported")
+
+    ants = list(model.agents_by_type.get(ant_class, []))
+    foods = list(model.agents_by_type.get(food_class, []))
+    colony = model.colony_state
+
+    random_version, random_internal, random_gauss = model.random.getstate()
+    meta = {
+        "format": FORMAT_VERSION,
+        "parameters": {
+            "width": model.width,
+            "height": model.height,
+            "range_of_communication": model.range_of_communication,
+            "ants_needed": model.ants_needed,
+            "food_respawn": model.food_respawn,
+            "engine": model.engine,
+            "pheromones": model.pheromones is not None,
+            "scheduled_legs": model.legs is not None,
+            "communication_skin": model.neighbor_graph.skin,
+        },
+        "attributes": {name: getattr(model, name) for name in ATTRIBUTES},
+        "initial_ants": model.initial_ants,
+        "initial_food": model.initial_food,
+        "next_unique_id": _next_unique_id(model),
+        "random_version": random_version,
+        "random_gauss": random_gauss,
+        "numpy_rng": model.rng.bit_generator.state,
+        "memory": None,
+        "entry_types": [],
+    }
+
+    # the rows collected up to the checkpoint are on disk, the restored run appends to them
+    collector = model.datacollector
+    collector.flush()
+    meta["collector"] = {"n_chunks": collector.n_chunks, "n_collected": collector.n_collected}
+
+    arrays = {
+        "random_state": np.array(random_internal, dtype=np.uint32),
+        "ant_id": np.array([ant.unique_id for ant in ants], dtype=np.int64),
+        "ant_memory_capacity": np.array([_memory_capacity(ant.memory) for ant in ants], dtype=np.int64),
+        "ant_range_of_communication": np.array([ant.range_of_communication for ant in ants], dtype=float),
+        "food_id": np.array([food.unique_id for food in foods], dtype=np.int64),
+        "food_position": _positions(foods),
+        "food_ants_needed": np.array([food.ants_needed for food in foods], dtype=np.int64),
+    }
+
+    if colony is not None:
+        arrays.update(
+            ant_position=colony.position,
+            ant_direction=colony.direction,
+            ant_speed=colony.speed,
+            ant_mode=colony.mode,
+            ant_target=colony.target,
+            ant_trail=colony.trail,
+            ant_angle=colony.angle,
+            ant_food_memory=colony.food_memory,
+            ant_has_memory=colony.has_memory,
+        )
+    else:
+        mode_codes = {mode: code for code, mode in enumerate(MODES)}
+        arrays.update(
+            ant_position=_positions(ants),
+            ant_direction=np.array([ant.direction for ant in ants], dtype=float).reshape(-1, 2),
+            ant_speed=np.array([ant.speed for ant in ants], dtype=float),
+            ant_mode=np.array([mode_codes[ant.mode] for ant in ants], dtype=np.int8),
+            ant_target=np.array(
+                [(np.nan, np.nan) if ant.target is None else ant.target for ant in ants], dtype=float
+            ).reshape(-1, 2),
+            ant_trail=np.array([ant.trail for ant in ants], dtype=float),
+            ant_angle=np.array([ant.angle for ant in ants], dtype=float),
+        )
+        meta["memory"] = _memory_kind(ants)
+        memory_arrays, meta["entry_types"] = _memory_arrays(ants, meta["memory"])
+        arrays.update(memory_arrays)
+        if model.legs is not None:
+            arrays.update({f"leg_{name}": value for name, value in model.legs.state(ants).items()})
+
+    if model.pheromones is not None:
+        arrays["pheromone_grid"] = model.pheromones.grid
+        meta["pheromones"] = {name: getattr(model.pheromones, name) for name in PHEROMONE_ATTRIBUTES}
+
+    np.savez(path, meta=np.array(json.dumps(meta)), **arrays)
+
+
+def _restore_memories(model, ants, data, meta):
+    """Put the memory entries of the archive back in the memories of the ants."""
+    if not ants or meta["memory"] is None:
+        return
+    entry_types = meta["entry_types"]
+    owners = data["memory_owner"]
+    # entries are stored ant by ant, in memory order
+    bounds = np.searchsorted(owners, np.arange(len(ants) + 1))
+    stores, types, steps = data["memory_store"], data["memory_type"], data["memory_step"]
+    contents, external_ids, numbers = data["memory_content"], data["memory_external_id"], data["memory_number"]
+
+    if meta["memory"] == "V1":
+        next_numbers = data["memory_next_number"]
+        for row, ant in enumerate(ants):
+            entries = []
+            for i in range(bounds[row], bounds[row + 1]):
+                entry = {
+                    "entry_content": contents[i].copy(),
+                    "entry_type": entry_types[types[i]],
+                    "entry_step": int(steps[i]),
+                }
+                if external_ids[i] >= 0:
+                    entry["external_agent_id"] = int(external_ids[i])
+                entries.append(((ant.unique_id, int(numbers[i])), entry))
+            ant.memory.agent_id = ant.unique_id
+            ant.memory.restore(entries, int(next_numbers[row]))
+        return
+
+    for row, ant in enumerate(ants):
+        ant.memory.short_term.clear()
+        ant.memory.long_term.clear()
+        for i in range(bounds[row], bounds[row + 1]):
+            metadata = {"external_id": int(external_ids[i])} if external_ids[i] >= 0 else {}
+            store = ant.memory.long_term if stores[i] else ant.memory.short_term
+            entry = store.add(model, contents[i].copy(), entry_types[types[i]], metadata)
+            entry.entry_step = int(steps[i])
+
+
+def load_checkpoint(model_class, path, ant_class, food_class, **parameters):
+    """Create a ForagingAntsModel in the state saved by save_checkpoint.
+
+    Args:
+        model_class: the ForagingAntsModel class the checkpoint was written from
+        path: file name of the archive
+        ant_class, food_class: the agent classes of the model
+        parameters: other keyword arguments of the model constructor (e.g. data_directory)
+
+    Returns:
+        the restored model
+    """
+    with np.load(path) as archive:
+        data = {name: archive[name] for name in archive.files}
+    meta = json.loads(str(data["meta"]))
+    if meta["format"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported checkpoint format {meta['format']}")
+
+    # an empty model, the agents of the checkpoint are added below
+    model = model_class(initial_ants=0, initial_food=0, **{**meta["parameters"], **parameters})
+    model.initial_ants = meta["initial_ants"]
+    model.initial_food = meta["initial_food"]
+    for name, value in meta["attributes"].items():
+        setattr(model, name, tuple(value) if isinstance(value, list) else value)
+
+    ant_ids = data["ant_id"]
+    n_ants = len(ant_ids)
+    # room for all the agents in the positions of the space, which otherwise grow 20% at a time
+    model.space._agent_positions = np.empty((n_ants + len(data["food_id"]), 2))
+
+    mode_names = np.array(MODES, dtype=object)[data["ant_mode"]]
+    ants = list(
+        ant_class.create_agents(
+            model,
+            n_ants,
+            model.space,
+            initial_position=data["ant_position"],
+            direction=[direction.copy() for direction in data["ant_direction"]],
+            speed=data["ant_speed"].tolist(),
+            range_of_communication=data["ant_range_of_communication"].tolist(),
+            memory_capacity=data["ant_memory_capacity"].tolist(),
+        )
+    )
+    for row, ant in enumerate(ants):
+        ant.unique_id = int(ant_ids[row])
+        ant.mode = mode_names[row]
+        target = data["ant_target"][row]
+        ant.target = None if np.isnan(target[0]) else target.copy()
+        ant.trail = float(data["ant_trail"][row])
+        ant.angle = float(data["ant_angle"][row])
+    _restore_memories(model, ants, data, meta)
+    if model.legs is not None and "leg_ant" in data:
+        # before the food sources, which do not count the ants on a leg
+        model.legs.restore(ants, {name[4:]: value for name, value in data.items() if name.startswith("leg_")})
+
+    foods = list(
+        food_class.create_agents(
+            model,
+            len(data["food_id"]),
+            model.space,
+            position=data["food_position"],
+            ants_needed=data["food_ants_needed"].tolist(),
+        )
+    )
+    for food, unique_id in zip(foods, data["food_id"].tolist()):
+        food.unique_id = unique_id
+    Agent._ids[model] = itertools.count(meta["next_unique_id"])
+
+    if model.engine == "vectorized":
+        colony = VectorizedColony(model, ants)
+        for name in ("position", "direction", "speed", "mode", "target", "trail", "angle", "food_memory", "has_memory"):
+            setattr(colony, name, data[f"ant_{name}"].copy())
+        model.colony_state = colony
+
+    if model.pheromones is not None:
+        model.pheromones.grid = data["pheromone_grid"].copy()
+        for name, value in meta["pheromones"].items():
+            setattr(model.pheromones, name, value)
+
+    # start collecting from the restored step, without the row of the empty model (the chunks
+    # written after the checkpoint by the original run are dropped)
+    model.datacollector.resume(**meta.get("collector", {}))
+
+    # same for the trajectory, recorded from the restored step
+    if model.trajectory is not None:
+        model.trajectory.clear()
+        model.trajectory.collect(model)
+
+    # the RNG states last, creating the agents may have drawn numbers
+    model.random.setstate(
+        (meta["random_version"], tuple(data["random_state"].tolist()), meta["random_gauss"])
+    )
+    model.rng.bit_generator.state = meta["numpy_rng"]
+    return model
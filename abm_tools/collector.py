@@ -0,0 +1,151 @@
+"""
+Columnar data collector with bounded memory.
+
+Mesa's DataCollector appends a Python dict per step, which grows without limit over long runs.
+ColumnarCollector writes each collected row into a preallocated NumPy buffer of chunk_size rows:
+
+- with a directory, the buffer is flushed to <directory>/chunk_<n>.npz (one array per column)
+  every time it is full, so a million-step run keeps at most chunk_size rows in memory; the
+  last rows are only written by flush(), e.g. when the run ends
+- without a directory, the buffer is a ring: only the last chunk_size rows are kept
+
+get_model_vars_dataframe() mimics the DataCollector method of the same name, so the collector
+can be used by the plot components of the Mesa visualization.
+"""
+
+import glob
+import os
+
+import numpy as np
+
+
+class ColumnarCollector:
+    """Collect one row of numbers per step into fixed-size column buffers.
+
+    Attributes:
+        columns (tuple): names of the columns
+        chunk_size (int): rows kept in memory
+        directory (str): where the chunks are flushed (None for a ring buffer)
+        n_collected (int): number of rows collected since the start
+        n_chunks (int): number of chunks in the directory, including those of the run continued
+    """
+
+    def __init__(self, columns, reporter, chunk_size=10_000, directory=None, dtype=np.int64):
+        """Create an empty collector.
+
+        Args:
+            columns: names of the columns
+            reporter: function model -> sequence of values, in the order of the columns
+            chunk_size: rows kept in memory before a flush (or in the ring buffer)
+            directory: directory of the chunks, created if needed (None to keep only the last rows);
+                the new chunks are numbered after those already in it, see resume()
+            dtype: dtype of the buffer
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.columns = tuple(columns)
+        self.reporter = reporter
+        self.chunk_size = chunk_size
+        self.directory = directory
+        self.n_collected = 0
+
+        self._buffer = np.empty((chunk_size, len(self.columns)), dtype=dtype)
+        self._n = 0  # rows in the buffer (next row to write)
+        self._wrapped = False  # ring buffer: the oldest rows were overwritten
+        self.n_chunks = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            # never overwrite the chunks already written (e.g. by the run a checkpoint continues)
+            self.n_chunks = max((chunk_number(path) + 1 for path in chunk_paths(directory)), default=0)
+        self._first_chunk = self.n_chunks
+
+    def __len__(self):
+        return self.n_collected
+
+    def resume(self, n_chunks=None, n_collected=0):
+        """Continue the series of the directory after its first n_chunks chunks (e.g. from a checkpoint).
+
+        The rows collected so far by this collector and the chunks numbered from n_chunks on
+        are dropped.
+
+        Args:
+            n_chunks: number of chunks of the series to keep (default: those written before this collector)
+            n_collected: number of rows of the series continued
+        """
+        n_chunks = self._first_chunk if n_chunks is None else n_chunks
+        if self.directory is not None:
+            for path in chunk_paths(self.directory):
+                if chunk_number(path) >= n_chunks:
+                    os.remove(path)
+        self.n_chunks = self._first_chunk = n_chunks
+        self.n_collected = n_collected
+        self._n = 0
+        self._wrapped = False
+
+    def collect(self, model):
+        """Record the current state of the model."""
+        self._buffer[self._n] = self.reporter(model)
+        self._n += 1
+        self.n_collected += 1
+
+        if self._n == self.chunk_size:
+            if self.directory is not None:
+                self.flush()
+            else:
+                self._n = 0
+                self._wrapped = True
+
+    def flush(self):
+        """Write the rows of the buffer to a new chunk file (no-op for a ring buffer)."""
+        if self.directory is None or self._n == 0:
+            return
+        path = os.path.join(self.directory, f"chunk_{self.n_chunks:06d}.npz")
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **{name: self._buffer[: self._n, i] for i, name in enumerate(self.columns)})
+        os.replace(tmp_path, path)
+        self.n_chunks += 1
+        self._n = 0
+
+    def _buffered_rows(self):
+        if self._wrapped:
+            return np.concatenate([self._buffer[self._n :], self._buffer[: self._n]])
+        return self._buffer[: self._n]
+
+    def get_columns(self):
+        """All the rows available (on disk and in memory) as a dict of column arrays."""
+        rows = self._buffered_rows()
+        columns = {name: rows[:, i].copy() for i, name in enumerate(self.columns)}
+        if self.directory is None:
+            return columns
+
+        on_disk = load_chunks(self.directory, self.columns)
+        return {name: np.concatenate([on_disk[name], columns[name]]) for name in self.columns}
+
+    def get_model_vars_dataframe(self):
+        """The collected rows as a pandas DataFrame (as DataCollector.get_model_vars_dataframe)."""
+        import pandas as pd
+
+        return pd.DataFrame(self.get_columns())
+
+
+def chunk_paths(directory):
+    """Chunk files of a directory, in collection order."""
+    return sorted(glob.glob(os.path.join(directory, "chunk_[0-9]*[0-9].npz")))
+
+
+def chunk_number(path):
+    """Number of a chunk file, from its name."""
+    return int(os.path.basename(path)[len("chunk_") : -len(".npz")])
+
+
+def load_chunks(directory, columns=None):
+    """Concatenate the chunks flushed in a directory into a dict of column arrays."""
+    parts = {}
+    for path in chunk_paths(directory):
+        with np.load(path) as chunk:
+            for name in columns or chunk.files:
+                parts.setdefault(name, []).append(chunk[name])
+    return {
+        name: np.concatenate(parts[name]) if name in parts else np.empty(0, dtype=np.int64)
+        for name in (columns or parts)
+    }
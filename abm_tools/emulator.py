@@ -0,0 +1,341 @@
+"""
+Gaussian-process emulator of the outcomes of the Foraging Ants models, trained on sweep results.
+
+Each question like "how much food is collected with N ants and a range of communication R?"
+costs a simulation (several, to average over seeds). The emulator learns the mean outcome
+of the runs of a sweep (see abm_tools.batch_run) as a smooth function of some of its
+parameters, and answers new parameter values with a prediction and its standard deviation,
+without running the model.
+
+The emulator is a Gaussian process with a squared exponential kernel, one length scale per
+parameter (inputs are scaled to [0, 1] over the range of the sweep), and a noise term for the
+variability between seeds. The runs of a configuration are averaged before the fit, the noise
+of their mean decreasing with the number of seeds. The hyperparameters maximize the marginal
+likelihood (L-BFGS-B from a few random starts).
+
+suggest() picks the next configurations to simulate among candidates: those where the
+prediction is the least certain, one after the other, each pick counting as observed for the
+next ones so that a batch does not pile up in the same place.
+
+Usage:
+    python -m abm_tools.emulator --sweep sweeps/study --inputs initial_ants range_of_communication \\
+        --query initial_ants=80 range_of_communication=4 --suggest 5 --save emulator.npz
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+from scipy.optimize import minimize
+
+from abm_tools.batch_run import COLUMNS
+
+# Bounds of the log hyperparameters (length scales on inputs scaled to [0, 1], standardized outputs)
+LOG_LENGTH_BOUNDS = (np.log(1e-2), np.log(1e2))
+LOG_SIGNAL_BOUNDS = (np.log(1e-2), np.log(1e2))
+LOG_NOISE_BOUNDS = (np.log(1e-4), np.log(1e1))
+JITTER = 1e-8
+
+
+def load_outcomes(output, inputs, metric="food_collected", step=None):
+    """Parameters and outcome of the runs of a sweep.
+
+    Args:
+        output: directory of the sweep
+        inputs: names of the parameters used as inputs
+        metric: column of the time series (see batch_run.COLUMNS)
+        step: step at which the metric is read (default: the last collected step of each run),
+            runs that did not collect this step are skipped
+
+    Returns:
+        X (runs, inputs), y (runs,)
+    """
+    if metric not in COLUMNS[1:]:
+        raise ValueError(f"metric must be one of {COLUMNS[1:]}")
+    runs_dir = os.path.join(output, "runs")
+    X, y = [], []
+    for file_name in sorted(os.listdir(runs_dir)):
+        if not file_name.endswith(".npz") or file_name.endswith(".tmp.npz"):
+            continue
+        with np.load(os.path.join(runs_dir, file_name)) as data:
+            config = json.loads(str(data["config"]))
+            steps, values = data["step"], data[metric]
+        if step is None:
+            value = values[-1]
+        else:
+            found = np.flatnonzero(steps == step)
+            if len(found) == 0:
+                continue
+            value = values[found[0]]
+        X.append([config[name] for name in inputs])
+        y.append(value)
+    if not X:
+        raise ValueError(f"No run found in {runs_dir}")
+    return np.array(X, dtype=float), np.array(y, dtype=float)
+
+
+def candidate_grid(lower, upper, points_per_axis=20):
+    """(points_per_axis ** d, d) regular grid over the box [lower, upper]."""
+    axes = [np.linspace(low, high, points_per_axis) for low, high in zip(lower, upper)]
+    return np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, len(axes))
+
+
+class GaussianProcessEmulator:
+    """Gaussian process regression of the mean outcome of a model over some of its parameters.
+
+    Attributes:
+        inputs (tuple): names of the input parameters
+        lower, upper (np.ndarray): range of the inputs, scaled to [0, 1]
+        length_scales (np.ndarray): length scale of each input, in scaled units
+        signal_std (float): prior standard deviation of the standardized outcome
+        noise_std (float): standard deviation of the standardized outcome of one run
+    """
+
+    def __init__(self, inputs):
+        self.inputs = tuple(inputs)
+        self.lower = self.upper = None
+        self.length_scales = None
+        self.signal_std = self.noise_std = None
+
+        # training set: configurations (scaled), their mean outcome and number of runs
+        self._X = self._y = self._counts = None
+        self._y_mean, self._y_std = 0.0, 1.0
+        self._cholesky = self._alpha = None
+
+    def _scale(self, X):
+        X = np.asarray(X, dtype=float).reshape(-1, len(self.inputs))
+        return (X - self.lower) / (self.upper - self.lower)
+
+    def _kernel(self, A, B, length_scales, signal_std):
+        d = (A[:, None, :] - B[None, :, :]) / length_scales
+        return signal_std**2 * np.exp(-0.5 * np.einsum("ijk,ijk->ij", d, d))
+
+    def _negative_log_likelihood(self, theta, X, y, counts):
+        """Negative log marginal likelihood and its gradient, for the log hyperparameters theta."""
+        d = X.shape[1]
+        length_scales, signal_std, noise_std = np.exp(theta[:d]), np.exp(theta[d]), np.exp(theta[d + 1])
+        K_signal = self._kernel(X, X, length_scales, signal_std)
+        noise = noise_std**2 / counts
+        K = K_signal + np.diag(noise + JITTER)
+        try:
+            factor = cho_factor(K, lower=True)
+        except np.linalg.LinAlgError:
+            return np.inf, np.zeros_like(theta)
+        alpha = cho_solve(factor, y)
+        nll = 0.5 * y @ alpha + np.log(np.diag(factor[0])).sum() + 0.5 * len(y) * np.log(2 * np.pi)
+
+        # d nll / d theta = -1/2 tr((alpha alpha^T - K^-1) dK/dtheta)
+        inner = np.outer(alpha, alpha) - cho_solve(factor, np.eye(len(y)))
+        gradient = np.empty_like(theta)
+        for k in range(d):
+            squared = (X[:, None, k] - X[None, :, k]) ** 2 / length_scales[k] ** 2
+            gradient[k] = -0.5 * np.sum(inner * K_signal * squared)
+        gradient[d] = -0.5 * np.sum(inner * 2 * K_signal)
+        gradient[d + 1] = -0.5 * np.sum(np.diag(inner) * 2 * noise)
+        return nll, gradient
+
+    def fit(self, X, y, restarts=5, seed=0):
+        """Fit the emulator to runs.
+
+        Args:
+            X: (runs, inputs) parameters of the runs
+            y: (runs,) outcome of the runs
+            restarts: random starts of the likelihood maximization
+            seed: seed of the random starts
+
+        Returns:
+            self
+        """
+        X = np.asarray(X, dtype=float).reshape(-1, len(self.inputs))
+        y = np.asarray(y, dtype=float)
+        self.lower, self.upper = X.min(axis=0), X.max(axis=0)
+        # an input with a single value in the training set does not matter
+        self.upper = np.where(self.upper > self.lower, self.upper, self.lower + 1.0)
+
+        # one row per configuration, with the mean of its runs
+        configurations, inverse, counts = np.unique(self._scale(X), axis=0, return_inverse=True, return_counts=True)
+        inverse = inverse.reshape(-1)
+        sums = np.bincount(inverse, weights=y, minlength=len(configurations))
+        self._y_mean = float(y.mean())
+        self._y_std = float(y.std()) or 1.0
+        self._X = configurations
+        self._y = (sums / counts - self._y_mean) / self._y_std
+        self._counts = counts.astype(float)
+
+        d = len(self.inputs)
+        bounds = [LOG_LENGTH_BOUNDS] * d + [LOG_SIGNAL_BOUNDS, LOG_NOISE_BOUNDS]
+        rng = np.random.default_rng(seed)
+        starts = [np.array([np.log(0.3)] * d + [0.0, np.log(0.3)])]
+        starts += [np.array([rng.uniform(low, high) for low, high in bounds]) for _ in range(restarts - 1)]
+
+        best = None
+        for start in starts:
+            result = minimize(
+                self._negative_log_likelihood,
+                start,
+                args=(self._X, self._y, self._counts),
+                jac=True,
+                method="L-BFGS-B",
+                bounds=bounds,
+            )
+            if np.isfinite(result.fun) and (best is None or result.fun < best.fun):
+                best = result
+        if best is None:
+            raise RuntimeError("The likelihood could not be evaluated at any start")
+
+        self._set_hyperparameters(best.x)
+        return self
+
+    def _set_hyperparameters(self, theta):
+        d = len(self.inputs)
+        self.length_scales = np.exp(theta[:d])
+        self.signal_std = float(np.exp(theta[d]))
+        self.noise_std = float(np.exp(theta[d + 1]))
+        K = self._kernel(self._X, self._X, self.length_scales, self.signal_std)
+        K[np.diag_indices_from(K)] += self.noise_std**2 / self._counts + JITTER
+        self._cholesky = np.linalg.cholesky(K)
+        self._alpha = cho_solve((self._cholesky, True), self._y)
+
+    def _posterior(self, Xs, X, cholesky):
+        """Standardized mean (with the fitted training set) and variance of the mean outcome at Xs."""
+        K_star = self._kernel(Xs, X, self.length_scales, self.signal_std)
+        v = solve_triangular(cholesky, K_star.T, lower=True)
+        variance = np.maximum(self.signal_std**2 - np.einsum("ij,ij->j", v, v), 0.0)
+        return K_star, variance
+
+    def predict(self, X, return_std=True, include_noise=False):
+        """Predicted mean outcome at parameter values.
+
+        Args:
+            X: (queries, inputs) or (inputs,) parameter values
+            return_std: also return the standard deviation of the prediction
+            include_noise: standard deviation of the outcome of one run (with the variability
+                between seeds), instead of the one of the mean outcome
+
+        Returns:
+            mean (queries,), and std (queries,) if return_std
+        """
+        if self._alpha is None:
+            raise RuntimeError("The emulator is not fitted")
+        K_star, variance = self._posterior(self._scale(X), self._X, self._cholesky)
+        mean = self._y_mean + self._y_std * (K_star @ self._alpha)
+        if not return_std:
+            return mean
+        if include_noise:
+            variance = variance + self.noise_std**2
+        return mean, self._y_std * np.sqrt(variance)
+
+    def suggest(self, candidates, n=1):
+        """Candidates where the prediction is the least certain, to simulate next.
+
+        The candidates are picked one at a time. Each pick is added to the training set
+        (the variance does not depend on the outcome, which is not needed), so that the next
+        picks go where the uncertainty is still high.
+
+        Args:
+            candidates: (candidates, inputs) parameter values to choose from
+            n: number of configurations to pick
+
+        Returns:
+            (n, inputs) parameter values, and their standard deviation when picked
+        """
+        if self._alpha is None:
+            raise RuntimeError("The emulator is not fitted")
+        candidates = np.asarray(candidates, dtype=float).reshape(-1, len(self.inputs))
+        scaled = self._scale(candidates)
+        X, counts = self._X, self._counts
+        picked, stds = [], []
+        for _ in range(min(n, len(candidates))):
+            K = self._kernel(X, X, self.length_scales, self.signal_std)
+            K[np.diag_indices_from(K)] += self.noise_std**2 / counts + JITTER
+            _, variance = self._posterior(scaled, X, np.linalg.cholesky(K))
+            variance[picked] = -np.inf
+            best = int(np.argmax(variance))
+            picked.append(best)
+            stds.append(self._y_std * np.sqrt(variance[best]))
+            X = np.vstack([X, scaled[best]])
+            counts = np.append(counts, 1.0)
+        return candidates[picked], np.array(stds)
+
+    def save(self, path):
+        """Write the fitted emulator to a .npz file."""
+        np.savez(
+            path,
+            inputs=np.array(self.inputs),
+            lower=self.lower,
+            upper=self.upper,
+            theta=np.concatenate([np.log(self.length_scales), np.log([self.signal_std, self.noise_std])]),
+            X=self._X,
+            y=self._y,
+            counts=self._counts,
+            y_scaling=np.array([self._y_mean, self._y_std]),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Read an emulator written by save()."""
+        with np.load(path) as data:
+            emulator = cls(data["inputs"].tolist())
+            emulator.lower, emulator.upper = data["lower"], data["upper"]
+            emulator._X, emulator._y, emulator._counts = data["X"], data["y"], data["counts"]
+            emulator._y_mean, emulator._y_std = data["y_scaling"].tolist()
+            emulator._set_hyperparameters(data["theta"])
+        return emulator
+
+
+def _parse_query(items, inputs):
+    values = dict(item.split("=", 1) for item in items)
+    missing = set(inputs) - set(values)
+    if missing:
+        raise ValueError(f"Missing values for {sorted(missing)} in the query")
+    return np.array([[float(values[name]) for name in inputs]])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sweep", help="directory of the sweep to train on")
+    parser.add_argument("--load", help="npz file of an emulator saved with --save, instead of training")
+    parser.add_argument("--inputs", nargs="+", help="swept parameters used as inputs")
+    parser.add_argument("--metric", default="food_collected", choices=COLUMNS[1:])
+    parser.add_argument("--step", type=int, default=None, help="step of the metric (default: last step of each run)")
+    parser.add_argument("--restarts", type=int, default=5)
+    parser.add_argument("--query", nargs="+", default=[], help="parameter values to predict, as name=value")
+    parser.add_argument("--suggest", type=int, default=0, help="number of configurations to simulate next")
+    parser.add_argument("--grid", type=int, default=20, help="candidates per input for --suggest, over the sweep range")
+    parser.add_argument("--save", help="npz file where the emulator is saved")
+    args = parser.parse_args()
+
+    if args.load:
+        emulator = GaussianProcessEmulator.load(args.load)
+    elif args.sweep and args.inputs:
+        X, y = load_outcomes(args.sweep, args.inputs, args.metric, args.step)
+        emulator = GaussianProcessEmulator(args.inputs).fit(X, y, restarts=args.restarts)
+        print(f"Fitted on {len(y)} runs ({len(emulator._X)} configurations)")
+    else:
+        parser.error("--sweep and --inputs, or --load, are required")
+
+    scales = ", ".join(
+        f"{name} {scale * (high - low):.3g}"
+        for name, scale, low, high in zip(emulator.inputs, emulator.length_scales, emulator.lower, emulator.upper)
+    )
+    print(f"Length scales: {scales}; noise std between runs {emulator.noise_std * emulator._y_std:.3g}")
+
+    if args.query:
+        mean, std = emulator.predict(_parse_query(args.query, emulator.inputs))
+        print(f"Prediction: {mean[0]:.4g} +/- {std[0]:.3g}")
+
+    if args.suggest:
+        candidates = candidate_grid(emulator.lower, emulator.upper, args.grid)
+        picked, stds = emulator.suggest(candidates, args.suggest)
+        print("Next configurations to simulate:")
+        for values, std in zip(picked, stds):
+            print("  " + " ".join(f"{name}={value:.4g}" for name, value in zip(emulator.inputs, values)) + f" (std {std:.3g})")
+
+    if args.save:
+        emulator.save(args.save)
+
+
+if __name__ == "__main__":
+    main()
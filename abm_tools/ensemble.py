@@ -0,0 +1,219 @@
+"""
+Ensembles of replicates of a Foraging Ants configuration, with adaptive stopping.
+
+Instead of running a fixed number of seeds, replicates are added in batches run in a process
+pool, until the confidence interval of the mean of the target metric is narrower than a
+tolerance (or max_replicates is reached). The target is either the final value of the metric
+or its whole curve, in which case the widest interval over the collected steps must be under
+the tolerance.
+
+The ensemble is summarized by the mean curve with its confidence interval and quantile curves.
+
+Usage:
+    python -m abm_tools.ensemble --output ensemble.npz --initial-ants 100 --steps 1000 \\
+        --metric food_collected --tolerance 0.5 --workers 8
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import stats
+
+from abm_tools.batch_run import COLUMNS, _run_job
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def confidence_half_width(values, confidence=0.95):
+    """Half width of the Student t confidence interval of the mean, along the first axis."""
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    if n < 2:
+        return np.full(values.shape[1:], np.inf)
+    t = stats.t.ppf((1 + confidence) / 2, n - 1)
+    return t * values.std(axis=0, ddof=1) / np.sqrt(n)
+
+
+def summarize(curves, steps, confidence=0.95, quantiles=QUANTILES):
+    """Mean, confidence interval and quantiles of the curves of the replicates.
+
+    Args:
+        curves: (replicates, collected steps) values of the metric
+        steps: (collected steps,) step of each column
+
+    Returns:
+        dict of arrays over the collected steps
+    """
+    curves = np.asarray(curves, dtype=float)
+    mean = curves.mean(axis=0)
+    half_width = confidence_half_width(curves, confidence)
+    summary = {
+        "step": np.asarray(steps),
+        "mean": mean,
+        "ci_low": mean - half_width,
+        "ci_high": mean + half_width,
+    }
+    for q, values in zip(quantiles, np.quantile(curves, quantiles, axis=0)):
+        summary[f"q{round(100 * q):02d}"] = values
+    return summary
+
+
+def run_ensemble(
+    config,
+    steps,
+    model_name="foraging_V2",
+    metric="food_collected",
+    target="final",
+    tolerance=1.0,
+    relative=False,
+    confidence=0.95,
+    min_replicates=5,
+    max_replicates=200,
+    batch_size=None,
+    workers=None,
+    first_seed=0,
+    collect_every=1,
+    cache_dir=None,
+    verbose=True,
+):
+    """Run replicates of one configuration until the mean of the metric is known within tolerance.
+
+    Args:
+        config: model keyword arguments (without the seed)
+        steps: number of steps per replicate
+        model_name: "foraging_V1" or "foraging_V2"
+        metric: column of the time series used as target (see batch_run.COLUMNS)
+        target: "final" for the value at the last step, "curve" for the whole curve
+        tolerance: largest accepted half width of the confidence interval
+        relative: if True, the tolerance is a fraction of the (absolute) mean
+        confidence: confidence level of the interval
+        min_replicates: replicates run before the stopping rule is checked
+        max_replicates: replicates run at most
+        batch_size: replicates added at a time (default: number of workers)
+        workers: number of worker processes (default: number of CPUs)
+        first_seed: seed of the first replicate, the next ones use the following seeds
+        collect_every: collect the time series every n steps
+        cache_dir: directory of the warm-start cache of the initialized models (default: no cache,
+            see abm_tools.warmstart), useful when an ensemble is run again with other steps
+
+    Returns:
+        dict with the summary curves of the metric (see summarize), the curves of the
+        replicates, their seeds, the final half width and whether the tolerance was reached
+    """
+    if metric not in COLUMNS[1:]:
+        raise ValueError(f"metric must be one of {COLUMNS[1:]}")
+    if target not in ("final", "curve"):
+        raise ValueError("target must be 'final' or 'curve'")
+    if not 1 <= min_replicates <= max_replicates:
+        raise ValueError("replicates must satisfy 1 <= min_replicates <= max_replicates")
+
+    workers = workers or os.cpu_count() or 1
+    batch_size = batch_size or workers
+    curves, seeds, step_column = [], [], None
+    converged = False
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while len(curves) < max_replicates:
+            # the first batch goes straight to min_replicates
+            size = max(batch_size, min_replicates - len(curves))
+            start = first_seed + len(seeds)
+            batch_seeds = range(start, start + min(size, max_replicates - len(curves)))
+            jobs = [(model_name, {**config, "seed": seed}, steps, collect_every, cache_dir) for seed in batch_seeds]
+            # map keeps the seed order, so the result does not depend on the number of workers
+            for _, columns in executor.map(_run_job, jobs):
+                curves.append(columns[metric])
+                step_column = columns["step"]
+            seeds.extend(batch_seeds)
+
+            values = np.array(curves, dtype=float)
+            if target == "final":
+                values = values[:, -1:]
+            half_widths = confidence_half_width(values, confidence)
+            limits = tolerance * np.abs(values.mean(axis=0)) if relative else tolerance
+            converged = len(curves) >= min_replicates and bool(np.all(half_widths <= limits))
+            if verbose:
+                print(f"{len(curves)} replicates, CI half width {np.max(half_widths):.4g}")
+            if converged:
+                break
+
+    result = summarize(curves, step_column, confidence)
+    result.update(
+        curves=np.array(curves),
+        seeds=np.array(seeds),
+        half_width=float(np.max(half_widths)),
+        converged=converged,
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="npz file of the summary curves")
+    parser.add_argument("--model", default="foraging_V2", choices=["foraging_V1", "foraging_V2"])
+    parser.add_argument("--engine", default="agents", choices=["agents", "vectorized"])
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--collect-every", type=int, default=1)
+    parser.add_argument("--metric", default="food_collected", choices=COLUMNS[1:])
+    parser.add_argument("--target", default="final", choices=["final", "curve"])
+    parser.add_argument("--tolerance", type=float, default=1.0, help="largest half width of the confidence interval")
+    parser.add_argument("--relative", action="store_true", help="tolerance relative to the mean")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--min-replicates", type=int, default=5)
+    parser.add_argument("--max-replicates", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--cache", help="directory of the warm-start cache of the initialized models")
+    parser.add_argument("--initial-ants", type=int, default=30)
+    parser.add_argument("--range-of-communication", type=float, default=10)
+    parser.add_argument("--ants-needed", type=int, default=5)
+    parser.add_argument("--speed", type=float, default=1)
+    parser.add_argument("--initial-food", type=int, default=10)
+    parser.add_argument("--width", type=int, default=100)
+    parser.add_argument("--height", type=int, default=100)
+    args = parser.parse_args()
+
+    config = {
+        name: getattr(args, name)
+        for name in (
+            "initial_ants",
+            "range_of_communication",
+            "ants_needed",
+            "speed",
+            "initial_food",
+            "width",
+            "height",
+            "engine",
+        )
+    }
+    result = run_ensemble(
+        config,
+        args.steps,
+        model_name=args.model,
+        metric=args.metric,
+        target=args.target,
+        tolerance=args.tolerance,
+        relative=args.relative,
+        confidence=args.confidence,
+        min_replicates=args.min_replicates,
+        max_replicates=args.max_replicates,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        first_seed=args.first_seed,
+        collect_every=args.collect_every,
+        cache_dir=args.cache,
+    )
+    status = "reached" if result["converged"] else "NOT reached"
+    print(
+        f"{args.metric} at step {result['step'][-1]}: {result['mean'][-1]:.4g} "
+        f"[{result['ci_low'][-1]:.4g}, {result['ci_high'][-1]:.4g}] "
+        f"with {len(result['seeds'])} replicates, tolerance {status}"
+    )
+    if args.output:
+        np.savez(args.output, **result)
+
+
+if __name__ == "__main__":
+    main()
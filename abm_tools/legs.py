@@ -0,0 +1,254 @@
+"""
+Event-scheduled straight legs of the ants travelling to a fixed target.
+
+An ant returning to the colony or going to a remembered food source moves in a straight line
+at constant speed, so where it will be at any later step is known when the leg starts. With
+ForagingAntsModel(scheduled_legs=True), such an ant is not moved step by step: TravelLegs keeps
+where and when its leg started, computes the step of its arrival, and puts the arrival on a
+Mesa DEVS event list. At the arrival step, the event gives the ant back its usual move, whose
+last stretch reaches the target and changes the mode of the ant.
+
+In between, nothing is updated per ant:
+
+- the positions of the ants on a leg are interpolated, all at once, only when something reads
+  them (the neighbor graph, the position of an ant, e.g. to render it)
+- the food sources count the ants on a leg around them with one KD-tree query per step
+- the pheromone trail of the ants on their way back is laid in one batch per step
+
+The ants on a leg still communicate in their step. The differences with the step-by-step moves
+are in the order of the updates within a step: an ant on a leg is counted around food and lays
+its trail as if it had moved at the start of the step, and arrives after all the agents stepped.
+"""
+
+import numpy as np
+from mesa.experimental.devs.eventlist import EventList, SimulationEvent
+
+from abm_tools.spatial import inclusive, periodic_tree
+
+
+class TravelLegs:
+    """Straight legs of the ants of a model, as arrays, and the event list of their arrivals.
+
+    The leg of an ant covers its moves of a full `speed` towards its target: a leg that starts
+    at `start` (the step the ant was at origin) makes `n_moves` moves, and the arrival event is
+    due at step start + n_moves + 1, when the remaining distance is at most `speed`.
+
+    Attributes:
+        events (EventList): arrival events, run by step() once the agents stepped
+        ants (list): the ants on a leg, row order
+    """
+
+    def __init__(self, model):
+        """Create an empty set of legs.
+
+        Args:
+            model: ForagingAntsModel of the ants
+        """
+        self.model = model
+        self.space = model.space
+        self.origin = np.asarray(self.space.dimensions[:, 0], dtype=float)
+        self.size = np.asarray(self.space.size, dtype=float)
+        self.events = EventList()
+
+        self.ants = []
+        self._rows = {}  # ant -> row
+        self._start_position = np.empty((0, 2))
+        self._direction = np.empty((0, 2))
+        self._speed = np.empty(0)
+        self._start = np.empty(0, dtype=np.int64)
+        self._n_moves = np.empty(0, dtype=np.int64)
+        self._trail = np.empty(0)  # trail of the ants returning to the colony, 0 otherwise
+
+        self._synced_step = None
+        self._occupancy = {}  # food -> number of ants on a leg around it
+        self._occupancy_step = None
+
+    def __len__(self):
+        return len(self.ants)
+
+    def __contains__(self, ant):
+        return ant in self._rows
+
+    def _grow(self):
+        capacity = max(16, 2 * len(self._speed))
+        for name in ("_start_position", "_direction", "_speed", "_start", "_n_moves", "_trail"):
+            array = getattr(self, name)
+            grown = np.zeros((capacity, *array.shape[1:]), dtype=array.dtype)
+            grown[: len(array)] = array
+            setattr(self, name, grown)
+
+    def start(self, ant):
+        """Put an ant travelling to its target on a leg, if it is more than one move away from it.
+
+        The leg includes the move of the current step.
+
+        Returns:
+            True if the ant is on a leg (its move is done by the legs), False otherwise
+        """
+        position = np.asarray(ant.position, dtype=float)
+        vector = np.asarray(ant.target, dtype=float) - position
+        distance = np.linalg.norm(vector)
+        if distance <= ant.speed:
+            return False
+
+        row = self._add(
+            ant,
+            position,
+            vector / distance,
+            ant.speed,
+            self.model.steps - 1,
+            # number of moves made while the remaining distance is more than speed
+            max(1, int(np.ceil(distance / ant.speed - 1))),
+            ant.trail if ant.mode == "return_to_colony" else 0.0,
+        )
+        ant.direction = self._direction[row].copy()
+        ant.angle = np.degrees(np.arctan2(ant.direction[1], ant.direction[0]))
+
+        current = self._start_position[row] + self._direction[row] * self._speed[row]
+        if self._synced_step == self.model.steps:
+            self.space.agent_positions[self.space._agent_to_index[ant]] = current
+        if self._occupancy_step == self.model.steps:
+            radius = self.model.food_collection_radius
+            for food in self.model.food_index.foods_in_radius(current, radius):
+                self._occupancy[food] = self._occupancy.get(food, 0) + 1
+        return True
+
+    def _add(self, ant, start_position, direction, speed, start, n_moves, trail):
+        row = len(self.ants)
+        if row == len(self._speed):
+            self._grow()
+        self.ants.append(ant)
+        self._rows[ant] = row
+        self._start_position[row] = start_position
+        self._direction[row] = direction
+        self._speed[row] = speed
+        self._start[row] = start
+        self._n_moves[row] = n_moves
+        self._trail[row] = trail
+
+        # the food sources count the ants on a leg themselves
+        for food in ant.food_zones:
+            food.occupancy -= 1
+        ant.food_zones = ()
+        ant.leg_event = SimulationEvent(int(start + n_moves + 1), ant.finish_leg)
+        self.events.add_event(ant.leg_event)
+        return row
+
+    def state(self, ants):
+        """Arrays of the legs, in the order of their arrival events (see abm_tools.checkpoint).
+
+        Args:
+            ants: the ants of the model, the legs refer to their index in this list
+        """
+        rows = sorted(self._rows.values(), key=lambda row: self.ants[row].leg_event.unique_id)
+        index = {ant: i for i, ant in enumerate(ants)}
+        return {
+            "ant": np.array([index[self.ants[row]] for row in rows], dtype=np.int64),
+            "start_position": self._start_position[rows].reshape(-1, 2),
+            "direction": self._direction[rows].reshape(-1, 2),
+            "speed": self._speed[rows],
+            "start": self._start[rows],
+            "n_moves": self._n_moves[rows],
+            "trail": self._trail[rows],
+        }
+
+    def restore(self, ants, state):
+        """Put the ants back on the legs given by state() (before the food sources are created)."""
+        for i, ant in enumerate(state["ant"].tolist()):
+            self._add(
+                ants[ant],
+                state["start_position"][i],
+                state["direction"][i],
+                state["speed"][i],
+                state["start"][i],
+                state["n_moves"][i],
+                state["trail"][i],
+            )
+
+    def finish(self, ant):
+        """Take an ant off its leg, at the position of its last full move.
+
+        Returns:
+            the position of the ant
+        """
+        row = self._rows.pop(ant)
+        position = self._start_position[row] + self._direction[row] * (self._speed[row] * self._n_moves[row])
+        trail = self._trail[row] * self.model.pheromone_trail_decay ** self._n_moves[row]
+
+        # the last row takes the place of the removed one
+        last = len(self.ants) - 1
+        if row != last:
+            moved = self.ants[last]
+            self.ants[row] = moved
+            self._rows[moved] = row
+            for name in ("_start_position", "_direction", "_speed", "_start", "_n_moves", "_trail"):
+                array = getattr(self, name)
+                array[row] = array[last]
+        self.ants.pop()
+
+        if ant.mode == "return_to_colony":
+            ant.trail = trail
+        return position
+
+    def _moves_done(self, step):
+        n = len(self.ants)
+        return np.clip(step - self._start[:n], 0, self._n_moves[:n])
+
+    def positions(self, step=None):
+        """(n, 2) positions of the ants on a leg at the end of a step (default: the current one)."""
+        step = self.model.steps if step is None else step
+        n = len(self.ants)
+        moves = self._moves_done(step)
+        return self._start_position[:n] + self._direction[:n] * (self._speed[:n] * moves)[:, None]
+
+    def sync(self):
+        """Write the current positions of the ants on a leg in the space (once per step)."""
+        if self._synced_step == self.model.steps or not self.ants:
+            return
+        index = self.space._agent_to_index
+        rows = np.fromiter((index[ant] for ant in self.ants), dtype=np.intp, count=len(self.ants))
+        self.space.agent_positions[rows] = self.positions()
+        self._synced_step = self.model.steps
+
+    def occupancy(self, food):
+        """Number of ants on a leg within food_collection_radius of a food source."""
+        if self._occupancy_step != self.model.steps:
+            self._count_around_food()
+        return self._occupancy.get(food, 0)
+
+    def _count_around_food(self):
+        food_index = self.model.food_index
+        slots = food_index.slots()
+        self._occupancy = {}
+        self._occupancy_step = self.model.steps
+        if not self.ants or len(slots) == 0:
+            return
+        counts = periodic_tree(self.positions(), self.origin, self.size).query_ball_point(
+            food_index.positions[slots] - self.origin,
+            inclusive(self.model.food_collection_radius),
+            return_length=True,
+        )
+        self._occupancy = {food_index.foods[slot]: int(count) for slot, count in zip(slots, counts) if count}
+
+    def _lay_trails(self):
+        """Deposits of the moves of this step of the ants returning to the colony."""
+        n = len(self.ants)
+        step = self.model.steps
+        # the deposit of a move is laid at the position before the move
+        move = step - 1 - self._start[:n]
+        laying = np.flatnonzero((self._trail[:n] > 0) & (move >= 0) & (move < self._n_moves[:n]))
+        if len(laying) == 0:
+            return
+        amounts = (
+            self.model.pheromone_deposit
+            * self._trail[laying]
+            * self.model.pheromone_trail_decay ** move[laying]
+        )
+        self.model.pheromones.deposit_batch(self.positions(step - 1)[laying], amounts)
+
+    def step(self):
+        """Lay the trails of the step, then run the arrival events due at the current step."""
+        if self.model.pheromones is not None:
+            self._lay_trails()
+        while not self.events.is_empty() and self.events.peak_ahead()[0].time <= self.model.steps:
+            self.events.pop_event().execute()
@@ -0,0 +1,62 @@
+"""
+Headless loading of the models of the repository.
+
+The models are written to be run from their own directory (`solara run app.py`) and import
+their agents with `from agents import ...`, which makes them clash with each other when used
+from another place. load_model() sets up the import paths and returns the model class.
+"""
+
+import importlib
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (directory, uses top-level sibling imports)
+MODELS = {
+    "foraging_V1": ("foraging_ants_V1", True),
+    "foraging_V2": ("foraging_ants_V2", False),
+    "virus_antibody": ("virus_antibody", True),
+}
+
+
+def _add_to_path(*directories):
+    for directory in directories:
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+
+
+def _import_model_module(directory, sibling_imports):
+    """Import <directory>.model, making `agents` and `model` resolve to this directory if needed."""
+    if not sibling_imports:
+        return importlib.import_module(f"{directory}.model")
+
+    path = os.path.join(ROOT, directory)
+    for name in ("agents", "model"):
+        module = sys.modules.get(name)
+        if module is not None and os.path.dirname(getattr(module, "__file__", "") or "") != path:
+            del sys.modules[name]
+
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module(f"{directory}.model")
+    finally:
+        sys.path.remove(path)
+
+
+def load_model_module(name):
+    """Return the model module of a model of the repository ("foraging_V1", "foraging_V2" or "virus_antibody")."""
+    if name not in MODELS:
+        raise ValueError(f"Unknown model {name!r}, choose from {sorted(MODELS)}")
+
+    # the memory module lives in experimentations/ and is imported as `memory_module`
+    _add_to_path(ROOT, os.path.join(ROOT, "experimentations"))
+    return _import_model_module(*MODELS[name])
+
+
+def load_model(name):
+    """Return the model class of a model of the repository."""
+    module = load_model_module(name)
+    if name.startswith("foraging"):
+        return module.ForagingAntsModel
+    return module.VirusAntibodyModel
@@ -0,0 +1,145 @@
+"""
+Pheromone field over a continuous space.
+
+A NumPy grid of pheromone concentration covering the space. Ants deposit pheromone in the cell
+they are in, and the whole field is updated once per step with one vectorized stencil
+(diffusion to the 4 neighboring cells, then evaporation). Reading or writing the field is O(1)
+per ant, so communicating through it costs O(grid) per step whatever the density of ants,
+instead of the O(neighbors) messages of the pairwise communication.
+"""
+
+import numpy as np
+
+
+class PheromoneField:
+    """Grid of pheromone concentration with evaporation and diffusion.
+
+    Attributes:
+        grid (np.ndarray): (nx, ny) concentrations, grid[i, j] covers the cell i along x and j along y
+        cell_size (np.ndarray): size of a cell along x and y
+        evaporation (float): fraction of pheromone lost at each step
+        diffusion (float): fraction of the difference with each neighboring cell exchanged at each step
+    """
+
+    def __init__(self, space, resolution=1.0, evaporation=0.05, diffusion=0.1, detection_threshold=1e-3):
+        """Create an empty field covering the space.
+
+        Args:
+            space: the ContinuousSpace covered by the field (wraps around if it is a torus)
+            resolution: approximate size of a cell
+            evaporation: fraction of pheromone lost at each step, in [0, 1]
+            diffusion: diffusion rate, in [0, 0.25] for the explicit stencil to be stable
+            detection_threshold: gradients weaker than this are not followed (see direction_at)
+        """
+        if not 0 <= evaporation <= 1:
+            raise ValueError("evaporation must be in [0, 1]")
+        if not 0 <= diffusion <= 0.25:
+            raise ValueError("diffusion must be in [0, 0.25]")
+
+        self.torus = space.torus
+        self.origin = np.asarray(space.dimensions[:, 0], dtype=float)
+        size = np.asarray(space.size, dtype=float)
+        self.shape = tuple(int(n) for n in np.maximum(np.ceil(size / resolution), 1))
+        self.cell_size = size / self.shape
+        self.evaporation = evaporation
+        self.diffusion = diffusion
+        self.detection_threshold = detection_threshold
+        self.grid = np.zeros(self.shape)
+
+    def cells_of(self, positions):
+        """Grid indices (ix, iy) of an (n, 2) array of positions."""
+        cells = np.floor((np.asarray(positions, dtype=float).reshape(-1, 2) - self.origin) / self.cell_size)
+        cells = cells.astype(np.intp)
+        if self.torus:
+            return cells[:, 0] % self.shape[0], cells[:, 1] % self.shape[1]
+        return (
+            np.clip(cells[:, 0], 0, self.shape[0] - 1),
+            np.clip(cells[:, 1], 0, self.shape[1] - 1),
+        )
+
+    def _cell_of(self, position):
+        """Grid indices of a single position, with plain Python arithmetic (per-agent calls)."""
+        ix = int((position[0] - self.origin[0]) // self.cell_size[0])
+        iy = int((position[1] - self.origin[1]) // self.cell_size[1])
+        if self.torus:
+            return ix % self.shape[0], iy % self.shape[1]
+        return min(max(ix, 0), self.shape[0] - 1), min(max(iy, 0), self.shape[1] - 1)
+
+    def deposit(self, position, amount=1.0):
+        """Add pheromone in the cell of a position."""
+        self.grid[self._cell_of(position)] += amount
+
+    def deposit_batch(self, positions, amounts=1.0):
+        """Add pheromone in the cells of many positions (several deposits in a cell add up)."""
+        ix, iy = self.cells_of(positions)
+        np.add.at(self.grid, (ix, iy), amounts)
+
+    def _neighbor(self, i, shift, axis):
+        """Index of the neighboring cell, wrapped on a torus and clamped otherwise."""
+        n = self.shape[axis]
+        return (i + shift) % n if self.torus else min(max(i + shift, 0), n - 1)
+
+    def gradient_at(self, position):
+        """Central difference gradient of the concentration at a position, as a (2,) array."""
+        ix, iy = self._cell_of(position)
+        grid = self.grid
+        gx = (grid[self._neighbor(ix, 1, 0), iy] - grid[self._neighbor(ix, -1, 0), iy]) / (2 * self.cell_size[0])
+        gy = (grid[ix, self._neighbor(iy, 1, 1)] - grid[ix, self._neighbor(iy, -1, 1)]) / (2 * self.cell_size[1])
+        return np.array((gx, gy))
+
+    def gradient_batch(self, positions):
+        """Central difference gradient of the concentration at many positions, as an (n, 2) array."""
+        ix, iy = self.cells_of(positions)
+        if self.torus:
+            up_x, down_x = (ix + 1) % self.shape[0], (ix - 1) % self.shape[0]
+            up_y, down_y = (iy + 1) % self.shape[1], (iy - 1) % self.shape[1]
+        else:
+            up_x, down_x = np.minimum(ix + 1, self.shape[0] - 1), np.maximum(ix - 1, 0)
+            up_y, down_y = np.minimum(iy + 1, self.shape[1] - 1), np.maximum(iy - 1, 0)
+
+        gradient = np.empty((len(ix), 2))
+        gradient[:, 0] = (self.grid[up_x, iy] - self.grid[down_x, iy]) / (2 * self.cell_size[0])
+        gradient[:, 1] = (self.grid[ix, up_y] - self.grid[ix, down_y]) / (2 * self.cell_size[1])
+        return gradient
+
+    def direction_at(self, position):
+        """Unit vector up the gradient at a position, zero if the gradient is below the detection threshold."""
+        gradient = self.gradient_at(position)
+        norm = np.hypot(gradient[0], gradient[1])
+        if norm < self.detection_threshold:
+            return np.zeros(2)
+        return gradient / norm
+
+    def direction_batch(self, positions):
+        """direction_at for an (n, 2) array of positions."""
+        gradient = self.gradient_batch(positions)
+        norm = np.hypot(gradient[:, 0], gradient[:, 1])
+        detected = norm >= self.detection_threshold
+        gradient[~detected] = 0.0
+        gradient[detected] /= norm[detected, np.newaxis]
+        return gradient
+
+    def step(self):
+        """Diffuse then evaporate the pheromone, one vectorized stencil over the whole grid."""
+        grid = self.grid
+        if self.diffusion > 0:
+            if self.torus:
+                neighbors = (
+                    np.roll(grid, 1, axis=0)
+                    + np.roll(grid, -1, axis=0)
+                    + np.roll(grid, 1, axis=1)
+                    + np.roll(grid, -1, axis=1)
+                )
+            else:
+                # reflecting borders: the missing neighbor has the same concentration
+                padded = np.pad(grid, 1, mode="edge")
+                neighbors = (
+                    padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+                )
+            grid = grid + self.diffusion * (neighbors - 4 * grid)
+
+        self.grid = grid * (1 - self.evaporation)
+
+    def total(self):
+        """Total amount of pheromone on the field."""
+        return float(self.grid.sum())
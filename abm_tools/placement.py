@@ -0,0 +1,289 @@
+"""
+Poisson-disk placement of points in a continuous space.
+
+Placing n points at least min_distance apart by checking every candidate against every
+accepted point is quadratic, and never ends if the space is too crowded. The sampler of this
+module uses the background grid of Bridson's algorithm: cells are small enough to hold at most
+one point, so a candidate is only checked against the points of the few cells around it.
+Candidates are handled in batches, cell groups far enough apart being processed together so
+that the whole batch is checked with a handful of vectorized operations.
+
+The points are first placed by random dart throwing (the same distribution as placing them one
+by one uniformly at random). When the space gets crowded, the remaining free space is filled by
+growing Bridson's active list around the accepted points (again from all of them, as long as
+a run still adds points), then by random candidates over the whole space. If even that cannot
+place n points, a ValueError is raised instead of looping forever.
+"""
+
+import math
+
+import numpy as np
+
+from abm_tools.spatial import wrap_positions
+
+
+class PoissonDiskSampler:
+    """Incremental Poisson-disk set of points on a (torus) rectangle, with excluded discs.
+
+    Attributes:
+        points (np.ndarray): (m, 2) accepted points, in acceptance order
+    """
+
+    def __init__(self, dimensions, min_distance, torus=True, exclude=()):
+        """Create an empty set of points.
+
+        Args:
+            dimensions: [[x_min, x_max], [y_min, y_max]] of the space
+            min_distance: minimal distance between two points
+            torus: whether distances wrap around the borders
+            exclude: list of (center, radius) discs where no point can be placed
+        """
+        dimensions = np.asarray(dimensions, dtype=float)
+        self.origin = dimensions[:, 0]
+        self.size = dimensions[:, 1] - dimensions[:, 0]
+        self.min_distance = float(min_distance)
+        self.torus = torus
+        self.exclude = [(np.asarray(center, dtype=float), float(radius)) for center, radius in exclude]
+
+        self._setup_grid()
+        self._points = np.empty((64, 2))
+        self._n = 0
+
+    def _setup_grid(self):
+        """Cells of side <= min_distance / sqrt(2), and cell groups whose cells are >= min_distance apart."""
+        r = max(self.min_distance, np.finfo(float).tiny)
+        shape = np.maximum(np.ceil(self.size * math.sqrt(2) / r), 1).astype(int)
+        # cap the grid for tiny distances: a cell holds at most one point, so at most 4096 * 4096
+        # points can then be placed, even if more would fit at min_distance
+        shape = np.minimum(shape, 4096)
+
+        for _ in range(16):
+            cell = self.size / shape
+            reach = max(1, int(math.ceil(r / cell.min())))
+            stride = reach + 1
+            if not self.torus:
+                break
+            # on a torus, cells of a group must also be far apart across the borders
+            rounded = np.maximum(stride, -(-shape // stride) * stride)
+            if (rounded == shape).all():
+                break
+            shape = rounded
+
+        self.shape = tuple(int(n) for n in shape)
+        self.cell = self.size / shape
+        self.reach = reach
+        self.stride = stride
+        # points of a cell (a cell holds at most one point when cell <= min_distance / sqrt(2))
+        self._owner = np.full(self.shape, -1, dtype=np.intp)
+        offsets = range(-reach, reach + 1)
+        self._offsets = [(dx, dy) for dx in offsets for dy in offsets]
+
+    @property
+    def points(self):
+        return self._points[: self._n]
+
+    def __len__(self):
+        return self._n
+
+    def _cells(self, candidates):
+        cells = np.floor((candidates - self.origin) / self.cell).astype(np.intp)
+        return np.minimum(np.maximum(cells, 0), np.array(self.shape) - 1)
+
+    def _delta(self, a, b):
+        delta = np.abs(a - b)
+        if self.torus:
+            delta = np.minimum(delta, self.size - delta)
+        return delta
+
+    def _allowed(self, candidates):
+        """Candidates outside of the excluded discs."""
+        allowed = np.ones(len(candidates), dtype=bool)
+        for center, radius in self.exclude:
+            delta = self._delta(candidates, center)
+            allowed &= delta[:, 0] ** 2 + delta[:, 1] ** 2 > radius**2
+        return allowed
+
+    def _far_enough(self, candidates, cells):
+        """Candidates farther than min_distance from all the accepted points."""
+        ok = np.ones(len(candidates), dtype=bool)
+        for dx, dy in self._offsets:
+            nx, ny = cells[:, 0] + dx, cells[:, 1] + dy
+            if self.torus:
+                nx, ny = nx % self.shape[0], ny % self.shape[1]
+                inside = np.ones(len(candidates), dtype=bool)
+            else:
+                inside = (nx >= 0) & (nx < self.shape[0]) & (ny >= 0) & (ny < self.shape[1])
+                nx, ny = np.where(inside, nx, 0), np.where(inside, ny, 0)
+
+            owner = self._owner[nx, ny]
+            occupied = inside & (owner >= 0)
+            if not occupied.any():
+                continue
+            delta = self._delta(candidates[occupied], self._points[owner[occupied]])
+            ok[occupied] &= delta[:, 0] ** 2 + delta[:, 1] ** 2 >= self.min_distance**2
+        return ok
+
+    def _append(self, new_points):
+        n = self._n + len(new_points)
+        if n > len(self._points):
+            grown = np.empty((max(n, 2 * len(self._points)), 2))
+            grown[: self._n] = self.points
+            self._points = grown
+        self._points[self._n : n] = new_points
+        self._n = n
+
+    def insert(self, candidates):
+        """Accept the candidates that respect the exclusion and spacing rules.
+
+        Args:
+            candidates: (m, 2) array of points inside the space
+
+        Returns:
+            (m,) boolean mask of the accepted candidates
+        """
+        candidates = np.asarray(candidates, dtype=float).reshape(-1, 2)
+        accepted = np.zeros(len(candidates), dtype=bool)
+        cells = self._cells(candidates)
+        allowed = self._allowed(candidates)
+        group = (cells[:, 0] % self.stride) * self.stride + cells[:, 1] % self.stride
+
+        # cells of the same group are at least min_distance apart, so the candidates of
+        # a group cannot conflict with each other, only with the points already accepted
+        for g in range(self.stride * self.stride):
+            idx = np.flatnonzero((group == g) & allowed)
+            if idx.size == 0:
+                continue
+            # at most one candidate per cell, and only in empty cells
+            _, first = np.unique(cells[idx, 0] * self.shape[1] + cells[idx, 1], return_index=True)
+            idx = idx[np.sort(first)]
+            idx = idx[self._owner[cells[idx, 0], cells[idx, 1]] < 0]
+            idx = idx[self._far_enough(candidates[idx], cells[idx])]
+
+            self._owner[cells[idx, 0], cells[idx, 1]] = np.arange(self._n, self._n + idx.size)
+            self._append(candidates[idx])
+            accepted[idx] = True
+        return accepted
+
+    def _uniform(self, rng, m):
+        return self.origin + rng.random((m, 2)) * self.size
+
+    def _annulus(self, rng, centers, k):
+        """k candidates around each center, uniformly in the annulus [min_distance, 2 min_distance].
+
+        Returns:
+            (candidates, index of the center of each candidate)
+        """
+        parents = np.repeat(np.arange(len(centers)), k)
+        radius = self.min_distance * np.sqrt(1 + 3 * rng.random(len(parents)))
+        angle = rng.uniform(0, 2 * np.pi, len(parents))
+        candidates = centers[parents] + np.column_stack((radius * np.cos(angle), radius * np.sin(angle)))
+        if self.torus:
+            return wrap_positions(candidates, self.origin, self.size), parents
+        inside = ((candidates >= self.origin) & (candidates < self.origin + self.size)).all(axis=1)
+        return candidates[inside], parents[inside]
+
+    def sample(self, rng, n, batch_size=None, min_acceptance=0.05, k=30, max_rejected=100_000):
+        """Add points until there are n of them.
+
+        Args:
+            rng: numpy Generator
+            n: number of points wanted
+            batch_size: number of random candidates per batch (default: twice the points missing)
+            min_acceptance: below this acceptance rate of random candidates, switch to filling the free space
+            k: number of candidates drawn around each active point while filling
+            max_rejected: once the fill is over, random candidates over the whole space are still
+                tried, until this many in a row are rejected
+
+        Returns:
+            (n, 2) array of points
+
+        Raises:
+            ValueError if n points cannot fit in the space
+        """
+        # random dart throwing, while it is efficient
+        while self._n < n:
+            missing = n - self._n
+            before = self._n
+            candidates = self._uniform(rng, batch_size or max(2 * missing, 64))
+            self.insert(candidates)
+            self._keep_at_most(rng, n, before)
+            if self._n - before < min_acceptance * len(candidates):
+                break
+
+        # crowded space: grow around the accepted points until the free space is filled
+        if self._n == 0 and n > 0:
+            self.insert(self._uniform(rng, 1000))
+            self._keep_at_most(rng, n, 0)
+        # the fill gives up on a point after k unlucky candidates, so it starts again from all
+        # the points as long as it still finds room
+        while self._n < n:
+            before = self._n
+            self._fill(rng, n, k)
+            if self._n == before:
+                break
+
+        # last resort: random candidates over the whole space, for the gaps out of reach of the fill
+        rejected = 0
+        while self._n < n and rejected < max_rejected:
+            before = self._n
+            candidates = self._uniform(rng, min(4096, max_rejected))
+            self.insert(candidates)
+            self._keep_at_most(rng, n, before)
+            rejected = 0 if self._n > before else rejected + len(candidates)
+
+        if self._n < n:
+            raise ValueError(
+                f"Only {self._n} of the {n} points fit in the space with min_distance={self.min_distance}"
+            )
+        return self.points.copy()
+
+    def _fill(self, rng, n, k):
+        """One run of Bridson's active list, starting from all the accepted points."""
+        active = np.arange(self._n)
+        while self._n < n and active.size:
+            before = self._n
+            candidates, parents = self._annulus(rng, self._points[active], k)
+            accepted = self.insert(candidates)
+            self._keep_at_most(rng, n, before)
+            # like Bridson, an active point whose k candidates were all rejected is done
+            productive = np.zeros(active.size, dtype=bool)
+            productive[parents[accepted]] = True
+            active = np.concatenate([active[productive], np.arange(before, self._n)])
+
+    def _keep_at_most(self, rng, n, before):
+        """Undo a random part of the last insertion if it went past n points."""
+        extra = self._n - n
+        if extra <= 0:
+            return
+        new = np.arange(before, self._n)
+        # the points are kept in acceptance order, only drop among the new ones
+        keep = np.sort(rng.choice(new, size=new.size - extra, replace=False))
+        dropped = np.setdiff1d(new, keep)
+        cells = self._cells(self._points[dropped])
+        self._owner[cells[:, 0], cells[:, 1]] = -1
+        kept_points = self._points[keep].copy()
+        self._n = before
+        cells = self._cells(kept_points)
+        self._owner[cells[:, 0], cells[:, 1]] = np.arange(before, before + len(kept_points))
+        self._append(kept_points)
+
+
+def poisson_disk_sample(rng, dimensions, n, min_distance, torus=True, exclude=()):
+    """n random points at least min_distance apart, outside of the excluded discs.
+
+    Args:
+        rng: numpy Generator
+        dimensions: [[x_min, x_max], [y_min, y_max]] of the space
+        n: number of points
+        min_distance: minimal distance between two points
+        torus: whether distances wrap around the borders
+        exclude: list of (center, radius) discs where no point can be placed
+
+    Returns:
+        (n, 2) array of points
+
+    Raises:
+        ValueError if n points cannot fit in the space
+    """
+    sampler = PoissonDiskSampler(dimensions, min_distance, torus=torus, exclude=exclude)
+    return sampler.sample(rng, n)
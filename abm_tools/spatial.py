@@ -0,0 +1,657 @@
+"""
+Spatial indexes for the continuous space models.
+
+ContinuousSpace.get_agents_in_radius computes the distance to every agent of the space,
+which makes each lookup O(N). The indexes of this module are built once and queried for
+many points at a time, with the torus wrap-around handled by periodic KD-trees.
+
+- KDForest: dynamic point set, with logarithmic insertions and deletions instead of rebuilds
+- FoodIndex: KDForest over the food sources, updated as they are collected and respawned
+- NeighborGraph: neighbor pairs of all the agents, computed once per step as a CSR adjacency,
+  optionally from a Verlet list of candidate pairs kept over several steps
+- NearestIndex: nearest agent of a set to many agents, from one batched k-nearest query per step
+"""
+
+import heapq
+import math
+from operator import attrgetter
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def wrap_positions(positions, origin, size):
+    """Bring positions back in [origin, origin + size) on a torus."""
+    relative = np.mod(np.asarray(positions, dtype=float) - origin, size)
+    # np.mod can round tiny negative values up to size itself
+    relative[relative >= size] = 0.0
+    return origin + relative
+
+
+def periodic_tree(positions, origin, size, **kwargs):
+    """KD-tree over positions with the toroidal topology of the space."""
+    return cKDTree(wrap_positions(positions, origin, size) - origin, boxsize=size, **kwargs)
+
+
+def inclusive(radius):
+    """Smallest float above radius, so that KD-tree bounds include points at exactly radius
+    (get_agents_in_radius uses distance <= radius)."""
+    return math.nextafter(float(radius), math.inf)
+
+
+class KDForest:
+    """Dynamic set of points under (torus) distance, with logarithmic-time insertions and deletions.
+
+    Bentley-Saxe logarithmic method: the points are spread over static KD-trees ("levels") of at
+    most buffer_size * 2**k points. New points go to a small buffer tree; when the buffer is full,
+    it is merged with the levels 0..k-1 into the first empty level k, like the carry of a binary
+    counter, so each point takes part in O(log n) rebuilds. Deleted points are only marked, and a
+    level is rebuilt without them once more than half of its points are deleted.
+
+    Every query goes through every level, and a single-point query costs a few microseconds
+    per tree whatever its size, so the buffer is large enough (256 points, rebuilt in tens of
+    microseconds) to keep the number of levels low.
+
+    Points are identified by integer slots chosen by the caller. A slot freed by a deletion can be
+    reused right away: the stale entry left in its former tree is ignored, as the slot is no
+    longer recorded in that level.
+    """
+
+    def __init__(self, origin, size, torus=True, buffer_size=256):
+        """Create an empty forest.
+
+        Args:
+            origin: (2,) lower corner of the space
+            size: (2,) size of the space
+            torus: whether distances wrap around the space
+            buffer_size: points inserted before the buffer is merged into the levels
+        """
+        self.origin = np.asarray(origin, dtype=float)
+        self.size = np.asarray(size, dtype=float)
+        self.torus = torus
+        self.buffer_size = buffer_size
+
+        self._points = np.empty((0, 2))  # slot -> prepared coordinates
+        self._alive = np.zeros(0, dtype=bool)
+        self._level_of = np.zeros(0, dtype=np.intp)  # slot -> level, -1 for the buffer
+        self._levels = []  # level -> (tree, slots) or None
+        self._dead = []  # level -> number of deleted slots still in its tree
+        self._buffer = []
+        self._buffer_tree = None
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def _prepare(self, points):
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.torus:
+            return wrap_positions(points, self.origin, self.size) - self.origin
+        return points
+
+    def _prepare_point(self, point):
+        """_prepare for a single point, with plain floats (much cheaper for one point)."""
+        x, y = float(point[0]), float(point[1])
+        if not self.torus:
+            return x, y
+        (x0, y0), (width, height) = self.origin.tolist(), self.size.tolist()
+        x, y = (x - x0) % width, (y - y0) % height
+        # % can round tiny negative values up to the size itself
+        return (0.0 if x >= width else x), (0.0 if y >= height else y)
+
+    def _valid(self, slots, k):
+        """Entries of the tree of level k that are still points of the forest."""
+        return self._alive[slots] & (self._level_of[slots] == k)
+
+    def _build(self, slots):
+        slots = np.asarray(slots, dtype=np.intp)
+        if self.torus:
+            return cKDTree(self._points[slots], boxsize=self.size), slots
+        return cKDTree(self._points[slots]), slots
+
+    def _reserve(self, slot):
+        if slot < len(self._points):
+            return
+        capacity = max(slot + 1, 2 * len(self._points), 16)
+        points = np.full((capacity, 2), np.nan)
+        points[: len(self._points)] = self._points
+        alive = np.zeros(capacity, dtype=bool)
+        alive[: len(self._alive)] = self._alive
+        level_of = np.full(capacity, -1, dtype=np.intp)
+        level_of[: len(self._level_of)] = self._level_of
+        self._points, self._alive, self._level_of = points, alive, level_of
+
+    def insert(self, slot, point):
+        """Add a point in a free slot."""
+        self._reserve(slot)
+        if self._alive[slot]:
+            raise ValueError(f"slot {slot} is already used")
+        self._points[slot] = self._prepare(point)[0]
+        self._alive[slot] = True
+        self._level_of[slot] = -1
+        self._buffer.append(slot)
+        self._buffer_tree = None
+        self._n += 1
+
+        if len(self._buffer) >= self.buffer_size:
+            self._flush_buffer()
+
+    def _flush_buffer(self):
+        carry = [np.asarray(self._buffer, dtype=np.intp)]
+        self._buffer = []
+        self._buffer_tree = None
+        k = 0
+        while k < len(self._levels) and self._levels[k] is not None:
+            _, slots = self._levels[k]
+            carry.append(slots[self._valid(slots, k)])
+            self._levels[k] = None
+            self._dead[k] = 0
+            k += 1
+        if k == len(self._levels):
+            self._levels.append(None)
+            self._dead.append(0)
+        slots = np.concatenate(carry)
+        self._levels[k] = self._build(slots)
+        self._level_of[slots] = k
+
+    def delete(self, slot):
+        """Remove the point of a slot, the slot can be reused."""
+        if slot >= len(self._alive) or not self._alive[slot]:
+            raise KeyError(slot)
+        self._alive[slot] = False
+        self._points[slot] = np.nan
+        self._n -= 1
+
+        k = self._level_of[slot]
+        if k < 0:
+            self._buffer.remove(slot)
+            self._buffer_tree = None
+            return
+        self._dead[k] += 1
+        _, slots = self._levels[k]
+        if 2 * self._dead[k] > len(slots):
+            alive = slots[self._valid(slots, k)]
+            self._levels[k] = self._build(alive) if len(alive) else None
+            self._dead[k] = 0
+
+    def _trees(self):
+        """(tree, slots, level, has deleted points) of the buffer (level -1) and of every level."""
+        if self._buffer and self._buffer_tree is None:
+            self._buffer_tree = self._build(self._buffer)
+        trees = [(*self._buffer_tree, -1, False)] if self._buffer else []
+        for k, (level, dead) in enumerate(zip(self._levels, self._dead)):
+            if level is not None:
+                trees.append((*level, k, dead > 0))
+        return trees
+
+    def _distance(self, points, slots):
+        delta = np.abs(points - self._points[slots])
+        if self.torus:
+            delta = np.minimum(delta, self.size - delta)
+        return np.hypot(delta[:, 0], delta[:, 1])
+
+    def nearest(self, points, radius):
+        """Slot of the nearest point within radius (inclusive) of each point, -1 if there is none."""
+        points = self._prepare(points)
+        best = np.full(len(points), -1, dtype=np.intp)
+        best_distance = np.full(len(points), np.inf)
+        bound = inclusive(radius)
+
+        for tree, slots, k, has_dead in self._trees():
+            distance, idx = tree.query(points, distance_upper_bound=bound)
+            hit = np.flatnonzero(idx < len(slots))
+            found = slots[idx[hit]]
+            if has_dead:
+                # the nearest point of this tree is deleted: look at all the points in range
+                for i in np.flatnonzero(~self._valid(found, k)):
+                    candidates = slots[tree.query_ball_point(points[hit[i]], bound)]
+                    candidates = candidates[self._valid(candidates, k)]
+                    if len(candidates) == 0:
+                        distance[hit[i]] = np.inf
+                        continue
+                    d = self._distance(points[hit[i]], candidates)
+                    found[i] = candidates[np.argmin(d)]
+                    distance[hit[i]] = d.min()
+            closer = distance[hit] < best_distance[hit]
+            best[hit[closer]] = found[closer]
+            best_distance[hit[closer]] = distance[hit[closer]]
+        return best
+
+    def ball(self, point, radius):
+        """Slots of the points within radius (inclusive) of a single point, as a list in increasing order.
+
+        Called after every move of an agent, so it does as little as possible per level: most
+        levels have no point in range, and only the levels with deleted points are filtered.
+        """
+        point = self._prepare_point(point)
+        bound = inclusive(radius)
+        found = []
+        for tree, slots, k, has_dead in self._trees():
+            idx = tree.query_ball_point(point, bound)
+            if not idx:
+                continue
+            in_range = slots[idx]
+            if has_dead:
+                in_range = in_range[self._valid(in_range, k)]
+            found.extend(in_range.tolist())
+        if len(found) > 1:
+            found.sort()
+        return found
+
+    def count(self, points, radius):
+        """Number of points within radius (inclusive) of each point."""
+        points = self._prepare(points)
+        counts = np.zeros(len(points), dtype=int)
+        for tree, slots, k, has_dead in self._trees():
+            if not has_dead:
+                counts += tree.query_ball_point(points, inclusive(radius), return_length=True)
+                continue
+            for i, found in enumerate(tree.query_ball_point(points, inclusive(radius))):
+                counts[i] += np.count_nonzero(self._valid(slots[found], k))
+        return counts
+
+
+class FoodIndex:
+    """Food-only spatial index of a ForagingAntsModel.
+
+    Food sources never move, and are only added (at creation or respawn) and removed (when
+    collected): each food gets a slot in a KDForest, updated in logarithmic time, freed slots
+    being reused by the next foods.
+
+    Attributes:
+        foods (list): the indexed Food agents by slot, None for a free slot
+        positions (np.ndarray): (slots, 2) positions of the foods by slot, NaN for a free slot
+        version (int): incremented each time a food is added or removed
+    """
+
+    def __init__(self, space):
+        """Create an empty index.
+
+        Args:
+            space: the ContinuousSpace the food is in (torus or not)
+        """
+        self.space = space
+        self.origin = np.asarray(space.dimensions[:, 0], dtype=float)
+        self.size = np.asarray(space.size, dtype=float)
+
+        self._forest = KDForest(self.origin, self.size, torus=space.torus)
+        self._slots = {}  # food -> slot
+        self._free = []  # heap of the free slots
+        self.foods = []
+        self.positions = np.empty((0, 2))
+        self.version = 0
+
+        # per-step batch of results, see prepare_step
+        self._in_reach = {}
+        self._in_reach_foods = []
+        self._in_reach_radius = None
+        self._in_reach_step = None
+
+    def __len__(self):
+        return len(self._slots)
+
+    def add(self, food, position=None):
+        """Index a new food source."""
+        position = food.position if position is None else position
+        if self._free:
+            slot = heapq.heappop(self._free)
+        else:
+            slot = len(self.foods)
+            self.foods.append(None)
+            if slot == len(self.positions):
+                positions = np.full((max(16, 2 * slot), 2), np.nan)
+                positions[:slot] = self.positions
+                self.positions = positions
+
+        self.foods[slot] = food
+        self.positions[slot] = position
+        self._slots[food] = slot
+        self._forest.insert(slot, position)
+        self.version += 1
+
+    def remove(self, food):
+        """Stop indexing a food source (it is collected)."""
+        slot = self._slots.pop(food, None)
+        if slot is None:
+            return
+        self.foods[slot] = None
+        self.positions[slot] = np.nan
+        self._forest.delete(slot)
+        heapq.heappush(self._free, slot)
+        self.version += 1
+
+    def slots(self):
+        """Slots of the indexed foods, in increasing order."""
+        return np.array(sorted(self._slots.values()), dtype=np.intp)
+
+    def query_batch(self, points, radius):
+        """Nearest food within radius of each point.
+
+        Args:
+            points: (m, 2) array of positions
+            radius: search radius
+
+        Returns:
+            (m,) array of slots in self.foods / self.positions, -1 where there is no food in range
+        """
+        return self._forest.nearest(points, radius)
+
+    def query(self, point, radius):
+        """Nearest food within radius of a point, or None."""
+        slot = self.query_batch(point, radius)[0]
+        return self.foods[slot] if slot >= 0 else None
+
+    def foods_in_radius(self, point, radius):
+        """Foods within radius of a single point, as a tuple in slot order."""
+        return tuple(self.foods[slot] for slot in self._forest.ball(point, radius))
+
+    def count_in_radius(self, points, radius):
+        """Number of foods within radius of each point."""
+        return self._forest.count(points, radius)
+
+    def position_of(self, food):
+        """Copy of the (indexed) position of a food source."""
+        return self.positions[self._slots[food]].copy()
+
+    def prepare_step(self, radius, step):
+        """Look up the food in reach of every agent of the space in one batched query.
+
+        The results are read back with in_reach(agent, radius) during the same step.
+
+        Args:
+            radius: search radius
+            step: the current model step, the batch is only valid during this step
+        """
+        idx = self.query_batch(self.space.agent_positions, radius)
+        self._in_reach = dict(zip(self.space.active_agents, idx.tolist()))
+        # the slots of the foods collected during the step can be reused by new ones
+        self._in_reach_foods = list(self.foods)
+        self._in_reach_radius = radius
+        self._in_reach_step = step
+
+    def moved(self, agent):
+        """Drop the batched result of an agent that moved since prepare_step (it is queried again)."""
+        self._in_reach.pop(agent, None)
+
+    def in_reach(self, agent, radius):
+        """Food within radius of the agent, using the batch of prepare_step when it is valid."""
+        if (
+            radius == self._in_reach_radius
+            and agent.model.steps == self._in_reach_step
+            and agent in self._in_reach
+        ):
+            idx = self._in_reach[agent]
+            if idx < 0:
+                return None
+            food = self._in_reach_foods[idx]
+            if food in self._slots:
+                return food
+
+        # not in the batch, or the food seen at the start of the step was collected since
+        return self.query(agent.position, radius)
+
+
+class NeighborGraph:
+    """Neighbor graph of the agents of a space under (torus) distance, shared by all agents for one step.
+
+    All the pairs of agents closer than radius are computed with a single KD-tree query, and
+    stored as a symmetric CSR adjacency: the neighbors of row i are indices[indptr[i]:indptr[i + 1]].
+    The graph is built lazily, at the first lookup after invalidate() (called once per step by the model),
+    so a step where nobody looks for neighbors costs nothing.
+
+    With a skin (Verlet neighbor list), the KD-tree query looks for the pairs closer than
+    radius + skin, and the following builds only keep those of the candidate pairs that are closer
+    than radius, until two agents may have moved by more than skin in total since the query
+    (the two largest displacements add up to more than skin). Agents added to the space in
+    between are paired with a brute-force distance computation, removed ones are dropped.
+
+    Attributes:
+        radius (float): the neighborhood radius
+        skin (float): margin of the candidate pairs (0: a KD-tree query at every build)
+        agents (list): the agents of the graph, row order
+        indptr (np.ndarray): CSR row pointers
+        indices (np.ndarray): CSR column indices (rows of the neighbors)
+        n_queries (int): number of KD-tree queries made so far
+    """
+
+    def __init__(self, space, radius, before_build=None, skin=0.0):
+        """Create an empty graph.
+
+        Args:
+            space: the ContinuousSpace of the agents
+            radius: agents closer than radius (inclusive) are neighbors
+            before_build: function called before each build, e.g. to bring up to date the
+                positions that are only updated when they are read
+            skin: margin of the candidate pairs kept between builds (e.g. a few times the
+                distance an agent moves per step)
+        """
+        if skin < 0:
+            raise ValueError("skin must be positive")
+        self.space = space
+        self.radius = radius
+        self.skin = skin
+        self.before_build = before_build
+        self.origin = np.asarray(space.dimensions[:, 0], dtype=float)
+        self.size = np.asarray(space.size, dtype=float)
+
+        self.agents = []
+        self.indptr = np.zeros(1, dtype=np.intp)
+        self.indices = np.empty(0, dtype=np.intp)
+        self._rows = {}
+        self._types = None  # type code of each row, computed at the first neighbors_of_type
+        self._type_codes = {}
+        self._stale = True
+        self.n_queries = 0
+
+        # Verlet list: pairs of rows within radius + skin, and the positions they were computed at
+        self._candidates = None
+        self._reference = None
+        self._ids = None  # id() of the agents of the rows of the candidates
+
+    def invalidate(self):
+        """Mark the graph as outdated, it is rebuilt at the next lookup."""
+        self._stale = True
+
+    def build(self):
+        """Compute the neighbor pairs of all the agents of the space at their current positions."""
+        if self.before_build is not None:
+            self.before_build()
+        agents = list(self.space.active_agents)
+        positions = self.space.agent_positions
+
+        if self.skin == 0:
+            pairs = self._query_pairs(positions, self.radius)
+        else:
+            if self._candidates is None or not self._follow(agents, positions):
+                self._candidates = self._query_pairs(positions, self.radius + self.skin)
+                self._reference = positions.copy()
+                self._ids = np.fromiter(map(id, agents), dtype=np.uintp, count=len(agents))
+            distances = self._squared_distances(positions[self._candidates[:, 0]], positions[self._candidates[:, 1]])
+            pairs = self._candidates[distances <= inclusive(self.radius) ** 2]
+
+        self.agents = agents
+        self._rows = dict(zip(map(attrgetter("unique_id"), self.agents), range(len(self.agents))))
+        self._types = None
+        self._set_pairs(pairs, len(self.agents))
+        self._stale = False
+
+    def _set_pairs(self, pairs, n):
+        """Store undirected pairs (m, 2) as a symmetric CSR adjacency over n rows."""
+        rows = np.concatenate([pairs[:, 0], pairs[:, 1]])
+        cols = np.concatenate([pairs[:, 1], pairs[:, 0]])
+        order = np.argsort(rows, kind="stable")
+        self.indices = cols[order]
+        self.indptr = np.zeros(n + 1, dtype=np.intp)
+        np.cumsum(np.bincount(rows, minlength=n), out=self.indptr[1:])
+
+    def _query_pairs(self, positions, radius):
+        """All the pairs of rows closer than radius (inclusive), with one KD-tree query."""
+        self.n_queries += 1
+        if self.space.torus:
+            tree = periodic_tree(positions, self.origin, self.size)
+        else:
+            tree = cKDTree(positions)
+        return tree.query_pairs(inclusive(radius), output_type="ndarray")
+
+    def _squared_distances(self, a, b):
+        """Squared shortest (torus) distances between the rows of a and b, compared like the KD-tree does."""
+        delta = np.abs(a - b)
+        if self.space.torus:
+            delta = np.minimum(delta, self.size - delta)
+        return (delta**2).sum(axis=-1)
+
+    def _follow(self, agents, positions):
+        """Bring the candidate pairs to the current agents of the space.
+
+        Returns:
+            False if the candidates can no longer be trusted and the KD-tree query is needed
+        """
+        # the previous agents are still referenced by self.agents, so their ids are not reused
+        ids = np.fromiter(map(id, agents), dtype=np.uintp, count=len(agents))
+        if not np.array_equal(ids, self._ids):
+            order = np.argsort(self._ids)
+            found = np.minimum(np.searchsorted(self._ids[order], ids), len(order) - 1)
+            kept = self._ids[order[found]] == ids
+            added = np.flatnonzero(~kept)
+            # past a few new agents, the query is cheaper than the brute-force pairing
+            if len(added) > 8 + len(agents) // 100:
+                return False
+
+            new_rows = np.full(len(self._ids), -1, dtype=np.intp)
+            new_rows[order[found[kept]]] = np.flatnonzero(kept)
+            pairs = new_rows[self._candidates]
+            pairs = pairs[(pairs >= 0).all(axis=1)]
+            reference = positions.copy()
+            reference[kept] = self._reference[order[found[kept]]]
+
+            new_pairs = []
+            for row in added:
+                close = np.flatnonzero(
+                    self._squared_distances(positions, positions[row]) <= inclusive(self.radius + self.skin) ** 2
+                )
+                # pairs of two added agents are found from the first one only
+                close = close[(close != row) & ~(np.isin(close, added) & (close < row))]
+                new_pairs.append(np.column_stack([np.full(len(close), row), close]))
+            self._candidates = np.concatenate([pairs, *new_pairs]).astype(np.intp, copy=False)
+            self._reference = reference
+            self._ids = ids
+
+        moved = np.sqrt(self._squared_distances(positions, self._reference))
+        if len(moved) < 2:
+            return True
+        largest = np.partition(moved, len(moved) - 2)[-2:]
+        return largest.sum() <= self.skin
+
+    def neighbor_rows(self, unique_id):
+        """Rows of the neighbors of an agent (empty if the agent is not in the graph)."""
+        if self._stale:
+            self.build()
+        row = self._rows.get(unique_id)
+        if row is None:
+            return self.indices[:0]
+        return self.indices[self.indptr[row] : self.indptr[row + 1]]
+
+    def neighbors(self, unique_id):
+        """Agents within radius of the agent with this unique_id (the agent itself excluded)."""
+        return [self.agents[row] for row in self.neighbor_rows(unique_id)]
+
+    def neighbors_of_type(self, unique_id, agent_type):
+        """Neighbors of one type of an agent, in the order of the space (like get_agents_in_radius).
+
+        The agents removed from the space since the graph was built are left out.
+        """
+        rows = self.neighbor_rows(unique_id)
+        if self._types is None:
+            # type of each row, as a small integer
+            self._types = np.fromiter(
+                (self._type_codes.setdefault(type(agent), len(self._type_codes)) for agent in self.agents),
+                dtype=np.intp,
+                count=len(self.agents),
+            )
+        rows = np.sort(rows[self._types[rows] == self._type_codes.get(agent_type, -1)])
+        return [agent for agent in map(self.agents.__getitem__, rows) if agent.space is not None]
+
+
+class NearestIndex:
+    """Nearest agent of a set (e.g. the viruses) to each agent of another, in one query per step.
+
+    prepare_step() builds a KD-tree over the positions of the targets and looks up the k nearest
+    targets within radius of all the querying agents at once. nearest() then returns the closest
+    of them still in the space: when the k targets found were all removed during the step (or
+    the agent was not in the batch), the agent is queried again, with twice as many neighbors.
+    Targets are found at their position at the start of the step.
+    """
+
+    def __init__(self, space, radius, k=4):
+        """Create an empty index.
+
+        Args:
+            space: the ContinuousSpace of the agents
+            radius: search radius
+            k: number of nearest targets looked up per agent in the batch
+        """
+        self.space = space
+        self.radius = radius
+        self.k = k
+        self.origin = np.asarray(space.dimensions[:, 0], dtype=float)
+        self.size = np.asarray(space.size, dtype=float)
+        self.targets = []
+        self._tree = None
+        self._candidates = {}  # querying agent -> rows of its nearest targets, closest first
+
+    def _positions(self, agents):
+        index = self.space._agent_to_index
+        rows = np.fromiter((index[agent] for agent in agents), dtype=np.intp, count=len(agents))
+        return self.space.agent_positions[rows]
+
+    def _query(self, points, k):
+        """Rows of the k nearest targets within radius of each point (n rows, -1 past the last)."""
+        if self.space.torus:
+            points = wrap_positions(points, self.origin, self.size) - self.origin
+        _, rows = self._tree.query(points, k=list(range(1, k + 1)), distance_upper_bound=inclusive(self.radius))
+        rows[rows == len(self.targets)] = -1
+        return rows
+
+    def prepare_step(self, targets, queries):
+        """Index the targets and look up the nearest ones of all the querying agents.
+
+        Args:
+            targets: agents of the space to find
+            queries: agents of the space looking for their nearest target during the step
+        """
+        self.targets = list(targets)
+        self._candidates = {}
+        self._tree = None
+        if not self.targets:
+            return
+        positions = self._positions(self.targets)
+        if self.space.torus:
+            self._tree = periodic_tree(positions, self.origin, self.size)
+        else:
+            self._tree = cKDTree(positions - self.origin)
+
+        queries = list(queries)
+        if queries:
+            rows = self._query(self._positions(queries), self.k)
+            self._candidates = dict(zip(queries, rows))
+
+    def nearest(self, agent):
+        """Closest target within radius of the agent, still in the space (None if there is none)."""
+        if self._tree is None:
+            return None
+        k = self.k
+        rows = self._candidates.pop(agent, None)
+        if rows is None:
+            rows = self._query(np.asarray(agent.position, dtype=float)[None], k)[0]
+        while True:
+            for row in rows.tolist():
+                if row < 0:
+                    # all the targets within radius were looked at
+                    return None
+                target = self.targets[row]
+                if target.space is not None:
+                    return target
+            if k >= len(self.targets):
+                return None
+            k = min(2 * k, len(self.targets))
+            rows = self._query(np.asarray(agent.position, dtype=float)[None], k)[0]
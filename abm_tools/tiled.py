@@ -0,0 +1,475 @@
+"""
+Domain-decomposed, multi-process engine for very large Foraging Ants maps.
+
+The torus is cut into a grid of tiles, each one stepped by its own worker process. The ant
+state lives in NumPy arrays in shared memory (same layout as abm_tools.vectorized), in two
+copies: at each step the workers read the state of step t from one copy and write the state of
+step t + 1 of the ants they own in the other, so no worker ever reads a row being written.
+
+At each step a worker:
+- takes the ants of its tile (the parent sorts the ants by tile between steps, which is how ants
+  crossing a border migrate from one worker to the other)
+- reads the halo: the ants of the neighboring tiles within range_of_communication of its tile,
+  which can tell food locations to its own ants
+- runs the batched update of VectorizedColony on its ants, with a random generator seeded from
+  (seed, step, tile)
+- counts its ants around each food source
+
+The parent then adds up the counts to collect the food, lays the pheromone deposits and diffuses
+the field. The result only depends on the seed and on the tile layout, not on the order in which
+the workers finish. There are no ForagingAnt agents with this engine: the ants only exist as
+array rows.
+
+When several ants can tell a food location to an exploring ant, the one with the smallest index
+wins (the vectorized engine keeps an arbitrary one), so that the halo does not change the outcome.
+"""
+
+import multiprocessing
+import weakref
+from multiprocessing import shared_memory
+from operator import attrgetter
+from types import SimpleNamespace
+
+import numpy as np
+
+from abm_tools.pheromones import PheromoneField
+from abm_tools.spatial import inclusive, periodic_tree, wrap_positions
+from abm_tools.vectorized import EXPLORE, MODES, RETURN_TO_COLONY, VectorizedColony
+
+# Per-ant state written at every step, double-buffered: (shape of a row, dtype)
+BUFFERED = {
+    "position": ((2,), np.float64),
+    "direction": ((2,), np.float64),
+    "mode": ((), np.int8),
+    "target": ((2,), np.float64),
+    "food_memory": ((2,), np.float64),
+    "has_memory": ((), np.bool_),
+    "trail": ((), np.float64),
+    "angle": ((), np.float64),
+}
+
+
+class SharedArrays:
+    """NumPy arrays backed by named shared memory blocks, attached by name in the workers."""
+
+    def __init__(self, specs, names=None):
+        """Create the blocks (names=None) or attach to existing ones.
+
+        Args:
+            specs: dict array name -> (shape, dtype)
+            names: dict array name -> shared memory block name, to attach to existing blocks
+        """
+        self.specs = specs
+        self.owner = names is None
+        self._blocks = {}
+        self.arrays = {}
+        for name, (shape, dtype) in specs.items():
+            if self.owner:
+                size = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+                block = shared_memory.SharedMemory(create=True, size=size)
+            else:
+                block = shared_memory.SharedMemory(name=names[name])
+            self._blocks[name] = block
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    @property
+    def names(self):
+        return {name: block.name for name, block in self._blocks.items()}
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def close(self):
+        """Release the arrays, and free the blocks if they were created here."""
+        self.arrays.clear()
+        for block in self._blocks.values():
+            block.close()
+            if self.owner:
+                block.unlink()
+        self._blocks.clear()
+
+
+class TileLayout:
+    """Regular grid of tiles over a torus."""
+
+    def __init__(self, origin, size, tiles):
+        self.origin = np.asarray(origin, dtype=float)
+        self.size = np.asarray(size, dtype=float)
+        self.tiles = tuple(int(n) for n in tiles)
+        if len(self.tiles) != 2 or min(self.tiles) < 1:
+            raise ValueError("tiles must be a pair of positive integers")
+        self.tile_size = self.size / self.tiles
+        self.n_tiles = self.tiles[0] * self.tiles[1]
+
+    def tile_of(self, positions):
+        """Tile index (ix * tiles_y + iy) of each position."""
+        cells = np.floor((positions - self.origin) / self.tile_size).astype(np.intp)
+        ix = np.clip(cells[:, 0], 0, self.tiles[0] - 1)
+        iy = np.clip(cells[:, 1], 0, self.tiles[1] - 1)
+        return ix * self.tiles[1] + iy
+
+    def neighbor_tiles(self, tile):
+        """The other tiles touching a tile (across the borders of the torus too)."""
+        ix, iy = divmod(tile, self.tiles[1])
+        neighbors = {
+            ((ix + dx) % self.tiles[0]) * self.tiles[1] + (iy + dy) % self.tiles[1]
+            for dx in (-1, 0, 1)
+            for dy in (-1, 0, 1)
+        }
+        neighbors.discard(tile)
+        return sorted(neighbors)
+
+    def distance_to_tile(self, positions, tile):
+        """Torus distance from each position to the rectangle of a tile."""
+        ix, iy = divmod(tile, self.tiles[1])
+        center = self.origin + (np.array((ix, iy)) + 0.5) * self.tile_size
+        delta = np.abs(positions - center) % self.size
+        delta = np.minimum(delta, self.size - delta)
+        outside = np.maximum(delta - self.tile_size / 2, 0.0)
+        return np.hypot(outside[:, 0], outside[:, 1])
+
+
+class StaticFoodIndex:
+    """The part of FoodIndex read by VectorizedColony, over an array of food positions."""
+
+    def __init__(self, origin, size):
+        self.origin = origin
+        self.size = size
+        self.positions = np.empty((0, 2))
+        self._tree = None
+
+    def set_positions(self, positions):
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self._tree = periodic_tree(self.positions, self.origin, self.size) if len(self.positions) else None
+
+    def query_batch(self, points, radius):
+        """Index of the nearest food within radius of each point, -1 if none."""
+        if self._tree is None:
+            return np.full(len(points), -1, dtype=np.intp)
+        points = wrap_positions(points, self.origin, self.size) - self.origin
+        _, idx = self._tree.query(points, distance_upper_bound=inclusive(radius))
+        idx[idx == len(self.positions)] = -1
+        return idx
+
+
+class _SharedPheromones(PheromoneField):
+    """Read-only view of the pheromone grid of the parent, in shared memory.
+
+    The deposits of the ants are laid by the parent once all the tiles are stepped.
+    """
+
+    def __init__(self, grid, origin, cell_size, detection_threshold):
+        # no PheromoneField.__init__: the grid is not allocated here
+        self.torus = True
+        self.grid = grid
+        self.shape = grid.shape
+        self.origin = origin
+        self.cell_size = cell_size
+        self.detection_threshold = detection_threshold
+
+    def deposit_batch(self, positions, amounts=1.0):
+        pass
+
+
+class TileColony(VectorizedColony):
+    """The ants of one tile, stepped by a worker process with the batched update of VectorizedColony."""
+
+    def __init__(self, settings, shared, tile):
+        # no VectorizedColony.__init__: the state is loaded from shared memory at every step
+        self.settings = settings
+        self.shared = shared
+        self.tile = tile
+        self.layout = TileLayout(settings.origin, settings.size, settings.tiles)
+        self.halo_tiles = self.layout.neighbor_tiles(tile)
+        self.origin = settings.origin
+        self.size = settings.size
+        self.colony_position = settings.colony_position
+        self.food_index = StaticFoodIndex(self.origin, self.size)
+
+        pheromones = None
+        if settings.pheromones is not None:
+            pheromones = _SharedPheromones(shared["pheromone_grid"], **settings.pheromones)
+        # what VectorizedColony reads from the model
+        self.model = SimpleNamespace(**vars(settings.model), pheromones=pheromones)
+
+    def step(self, step, parity):
+        """Advance the ants of the tile of one step.
+
+        Args:
+            step: the model step, seeds the random generator of the tile
+            parity: the copy of the state to read, the other one is written
+
+        Returns:
+            number of ants of the tile around each food source, after the move
+        """
+        offsets = self.shared["offsets"]
+        self.own = self.shared["order"][offsets[self.tile] : offsets[self.tile + 1]]
+        self.current = {name: self.shared[f"{name}{parity}"] for name in BUFFERED}
+        for name in BUFFERED:
+            setattr(self, name, self.current[name][self.own])
+        self.speed = self.shared["speed"][self.own]
+        self.rng = np.random.default_rng([self.settings.seed, step, self.tile])
+
+        travelling = self.mode != EXPLORE
+        self._check_for_food()
+        if self.model.pheromones is None:
+            self._communicate(travelling)
+        self._move()
+
+        following = 1 - parity
+        for name in BUFFERED:
+            self.shared[f"{name}{following}"][self.own] = getattr(self, name)
+        self.shared["deposit"][self.own] = self.deposit
+        return self._count_around_food()
+
+    def _halo_senders(self):
+        """Indices of the ants of the neighboring tiles that can tell a food location to the ants of the tile."""
+        order, offsets = self.shared["order"], self.shared["offsets"]
+        candidates = np.concatenate(
+            [order[offsets[tile] : offsets[tile + 1]] for tile in self.halo_tiles] or [np.empty(0, dtype=np.intp)]
+        )
+        candidates = candidates[(self.current["mode"][candidates] != EXPLORE) & self.current["has_memory"][candidates]]
+        near = self.layout.distance_to_tile(self.current["position"][candidates], self.tile)
+        return candidates[near <= self.model.range_of_communication]
+
+    def _communicate(self, travelling):
+        """Ants that were travelling at the start of the step, in the tile or its halo, tell exploring ants where food is."""
+        receivers = np.flatnonzero(self.mode == EXPLORE)
+        own_senders = np.flatnonzero(travelling & self.has_memory)
+        halo = self._halo_senders()
+        if receivers.size == 0 or own_senders.size + halo.size == 0:
+            return
+
+        sender_ids = np.concatenate([self.own[own_senders], halo])
+        sender_positions = np.concatenate([self.position[own_senders], self.current["position"][halo]])
+        sender_memories = np.concatenate([self.food_memory[own_senders], self.current["food_memory"][halo]])
+
+        pairs = self._tree(sender_positions).sparse_distance_matrix(
+            self._tree(self.position[receivers]),
+            inclusive(self.model.range_of_communication),
+            output_type="ndarray",
+        )
+        if pairs.size == 0:
+            return
+
+        # for each receiver, the sender with the smallest index
+        order = np.lexsort((sender_ids[pairs["i"]], pairs["j"]))
+        receiver = pairs["j"][order]
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = receiver[1:] != receiver[:-1]
+        chosen = order[first]
+
+        to = receivers[pairs["j"][chosen]]
+        self.food_memory[to] = sender_memories[pairs["i"][chosen]]
+        self.has_memory[to] = True
+
+    def _move(self):
+        # the deposits VectorizedColony._move lays, laid by the parent
+        self.deposit = np.zeros(len(self.mode))
+        if self.model.pheromones is not None:
+            returning = self.mode == RETURN_TO_COLONY
+            self.deposit[returning] = self.model.pheromone_deposit * self.trail[returning]
+        super()._move()
+
+    def _count_around_food(self):
+        foods = self.food_index.positions
+        if len(foods) == 0 or len(self.position) == 0:
+            return np.zeros(len(foods), dtype=np.int64)
+        return np.asarray(
+            self._tree(self.position).query_ball_point(
+                foods - self.origin,
+                inclusive(self.model.food_collection_radius),
+                return_length=True,
+            ),
+            dtype=np.int64,
+        )
+
+
+def _worker_main(connection, specs, names, settings, tile):
+    """Loop of a worker process: step its tile on request until told to stop."""
+    shared = SharedArrays(specs, names)
+    colony = TileColony(settings, shared, tile)
+    try:
+        while True:
+            message = connection.recv()
+            if message[0] == "close":
+                break
+            _, step, parity, food_positions = message
+            if food_positions is not None:
+                colony.food_index.set_positions(food_positions)
+            connection.send(colony.step(step, parity))
+    finally:
+        del colony
+        shared.close()
+        connection.close()
+
+
+def _shutdown(connections, processes, shared):
+    for connection in connections:
+        try:
+            connection.send(("close",))
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    shared.close()
+
+
+class TiledColony:
+    """Shared-memory state of all the ants of a ForagingAntsModel, stepped tile by tile by worker processes.
+
+    Attributes:
+        layout (TileLayout): the tiles, one worker each
+        position, direction, mode, target, food_memory, has_memory, trail, angle (np.ndarray):
+            the current state of the ants (views of shared memory, see abm_tools.vectorized)
+    """
+
+    def __init__(self, model, positions, directions, speed, tiles=(2, 2)):
+        """Create the shared state and start one worker per tile.
+
+        Args:
+            model: ForagingAntsModel the colony belongs to (food is read from model.food_index)
+            positions: (n, 2) initial positions of the ants
+            directions: (n, 2) initial directions
+            speed: speed of the ants (scalar or (n,))
+            tiles: number of tiles along x and y
+        """
+        self.model = model
+        space = model.space
+        if not space.torus:
+            raise ValueError("The tiled engine needs a torus space")
+        self.origin = np.asarray(space.dimensions[:, 0], dtype=float)
+        self.size = np.asarray(space.size, dtype=float)
+        self.layout = TileLayout(self.origin, self.size, tiles)
+        if (self.layout.tile_size < model.range_of_communication).any():
+            raise ValueError("Tiles must be larger than range_of_communication")
+
+        n = len(positions)
+        specs = {
+            f"{name}{parity}": ((n, *shape), dtype)
+            for parity in (0, 1)
+            for name, (shape, dtype) in BUFFERED.items()
+        }
+        specs.update(
+            speed=((n,), np.float64),
+            deposit=((n,), np.float64),
+            order=((n,), np.intp),
+            offsets=((self.layout.n_tiles + 1,), np.intp),
+        )
+        pheromones = None
+        if model.pheromones is not None:
+            specs["pheromone_grid"] = (model.pheromones.shape, np.float64)
+            pheromones = {
+                "origin": model.pheromones.origin,
+                "cell_size": model.pheromones.cell_size,
+                "detection_threshold": model.pheromones.detection_threshold,
+            }
+        self.shared = SharedArrays(specs)
+
+        self.parity = 0
+        self.shared["position0"][:] = wrap_positions(positions, self.origin, self.size)
+        self.shared["direction0"][:] = directions
+        self.shared["mode0"][:] = EXPLORE
+        self.shared["target0"][:] = np.nan
+        self.shared["food_memory0"][:] = np.nan
+        self.shared["has_memory0"][:] = False
+        self.shared["trail0"][:] = 0.0
+        self.shared["angle0"][:] = 0.0
+        self.shared["speed"][:] = speed
+        self._assign_tiles()
+
+        settings = SimpleNamespace(
+            origin=self.origin,
+            size=self.size,
+            tiles=self.layout.tiles,
+            colony_position=np.asarray(model.colony_position, dtype=float),
+            seed=int(model.rng.integers(2**63)),
+            pheromones=pheromones,
+            model=SimpleNamespace(
+                ant_search_radius=model.ant_search_radius,
+                range_of_communication=model.range_of_communication,
+                food_collection_radius=model.food_collection_radius,
+                pheromone_attraction=model.pheromone_attraction,
+                pheromone_deposit=model.pheromone_deposit,
+                pheromone_trail_decay=model.pheromone_trail_decay,
+            ),
+        )
+
+        context = multiprocessing.get_context()
+        self._connections, self._processes = [], []
+        for tile in range(self.layout.n_tiles):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_worker_main,
+                args=(worker_connection, specs, self.shared.names, settings, tile),
+                daemon=True,
+            )
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+        self._sent_version = None
+        self._finalizer = weakref.finalize(self, _shutdown, self._connections, self._processes, self.shared)
+
+    def __getattr__(self, name):
+        # current state of the ants: position, mode, ...
+        if name in BUFFERED:
+            return self.shared[f"{name}{self.parity}"]
+        raise AttributeError(name)
+
+    def _assign_tiles(self):
+        """Sort the ants by tile, for the workers to find their ants (and the ants crossing a border to migrate)."""
+        tile = self.layout.tile_of(self.shared[f"position{self.parity}"])
+        # small integer keys are radix sorted
+        key = tile.astype(np.int16) if self.layout.n_tiles < 2**15 else tile
+        order = np.argsort(key, kind="stable")
+        self.shared["order"][:] = order
+        self.shared["offsets"][:] = np.searchsorted(tile[order], np.arange(self.layout.n_tiles + 1))
+
+    def step(self):
+        """Advance all the ants of one step."""
+        food_index = self.model.food_index
+        slots = food_index.slots()
+        food_positions = None
+        if food_index.version != self._sent_version:
+            food_positions = food_index.positions[slots]
+            self._sent_version = food_index.version
+
+        pheromones = self.model.pheromones
+        if pheromones is not None:
+            np.copyto(self.shared["pheromone_grid"], pheromones.grid)
+
+        for connection in self._connections:
+            connection.send(("step", self.model.steps, self.parity, food_positions))
+        # added up in tile order, whatever order the workers finish in
+        counts = sum(connection.recv() for connection in self._connections)
+
+        if pheromones is not None:
+            deposit = self.shared["deposit"]
+            laying = np.flatnonzero(deposit > 0)
+            pheromones.deposit_batch(self.shared[f"position{self.parity}"][laying], deposit[laying])
+
+        if len(slots):
+            foods = [food_index.foods[slot] for slot in slots]
+            ants_needed = np.array([food.ants_needed for food in foods])
+            # in creation order, so that the respawned foods do not depend on the slots
+            collected = sorted((foods[i] for i in np.flatnonzero(counts >= ants_needed)), key=attrgetter("unique_id"))
+            for food in collected:
+                self.model.collect_food(food)
+
+        self.parity = 1 - self.parity
+        self._assign_tiles()
+
+    def mode_counts(self) -> dict:
+        """Number of ants in each mode."""
+        counts = np.bincount(self.mode, minlength=len(MODES))
+        return {mode: int(count) for mode, count in zip(MODES, counts)}
+
+    def sync_agents(self):
+        """No ant agents with the tiled engine, the state is only in the arrays."""
+
+    def close(self):
+        """Stop the workers and free the shared memory (also done when the colony is garbage collected)."""
+        self._finalizer()
@@ -0,0 +1,302 @@
+"""
+Trajectory recording of the agents of a run, and offline replay for the visualizations.
+
+The Solara apps re-simulate a run to display it, so the display is only as fast as the model.
+TrajectoryRecorder stores, every few steps, the position, type, state and heading of every
+agent, so that a heavy run can be recorded on a cluster and inspected later with ReplayModel,
+which plays the recording in the app (and jumps to any recorded step) without the model.
+
+A recording is a directory:
+
+- meta.json: the type and state names, the space, the recording period, the steps per chunk
+- index.bin: one fixed-size record per recorded step (step, chunk, first row, number of agents),
+  read memory-mapped, so finding a step does not depend on the length of the run
+- chunk_<n>.npz: the agents of steps_per_chunk consecutive recorded steps, compressed, one
+  array per field, the rows of a step following the rows of the previous one
+
+The index only lists the steps of the chunks already written, so a recording can be read
+while the run goes on.
+"""
+
+import json
+import os
+
+import numpy as np
+from mesa import Model
+from mesa.experimental.continuous_space import ContinuousSpace, ContinuousSpaceAgent
+
+from abm_tools.collector import ColumnarCollector
+
+# field -> (dtype, shape of the value of one agent)
+FIELDS = {
+    "position": (np.float32, (2,)),
+    "type": (np.uint8, ()),
+    "state": (np.uint8, ()),
+    "angle": (np.float32, ()),
+}
+
+INDEX_RECORD = np.dtype([("step", np.int64), ("chunk", np.int64), ("start", np.int64), ("count", np.int64)])
+
+
+def _chunk_path(directory, chunk):
+    return os.path.join(directory, f"chunk_{chunk:06d}.npz")
+
+
+class TrajectoryRecorder:
+    """Append the agents of a model to a recording directory, every `every` steps.
+
+    Attributes:
+        directory (str): the recording directory
+        types (tuple): names of the agent types, the type field holds indices in it
+        states (tuple): names of the agent states, the state field holds indices in it
+        every (int): recording period, in steps
+        n_recorded (int): number of steps recorded since the start
+    """
+
+    def __init__(self, directory, reporter, types, states, space, every=1, steps_per_chunk=100, metadata=None):
+        """Create an empty recording (the files of a previous recording in the directory are removed).
+
+        Args:
+            directory: directory of the recording, created if needed
+            reporter: function model -> dict of per-agent arrays, with a key per field of FIELDS
+                (angle can be left out)
+            types: names of the agent types
+            states: names of the agent states
+            space: the ContinuousSpace of the model, its dimensions are stored for the replay
+            every: record the steps multiple of every
+            steps_per_chunk: recorded steps per compressed chunk
+            metadata: dict stored in meta.json (e.g. model parameters)
+        """
+        if every < 1 or steps_per_chunk < 1:
+            raise ValueError("every and steps_per_chunk must be at least 1")
+        self.directory = directory
+        self.reporter = reporter
+        self.types = tuple(types)
+        self.states = tuple(states)
+        self.every = every
+        self.steps_per_chunk = steps_per_chunk
+
+        self._pending = []  # (step, {field: array}) not yet written
+        self._n_chunks = 0
+        self.n_recorded = 0
+        os.makedirs(directory, exist_ok=True)
+        self.clear()
+
+        meta = {
+            "types": self.types,
+            "states": self.states,
+            "dimensions": np.asarray(space.dimensions, dtype=float).tolist(),
+            "torus": bool(space.torus),
+            "every": every,
+            "steps_per_chunk": steps_per_chunk,
+            "metadata": metadata or {},
+        }
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def clear(self):
+        """Drop all the recorded steps (e.g. to record a restored run from its restored step)."""
+        for name in os.listdir(self.directory):
+            if name.startswith("chunk_"):
+                os.remove(os.path.join(self.directory, name))
+        open(os.path.join(self.directory, "index.bin"), "wb").close()
+        self._pending = []
+        self._n_chunks = 0
+        self.n_recorded = 0
+
+    def collect(self, model):
+        """Record the agents of the model if the current step is a multiple of every."""
+        if model.steps % self.every:
+            return
+
+        values = self.reporter(model)
+        n = len(values["type"])
+        frame = {}
+        for name, (dtype, shape) in FIELDS.items():
+            value = values.get(name)
+            if value is None:
+                value = np.full((n, *shape), np.nan)
+            frame[name] = np.asarray(value, dtype=dtype).reshape(n, *shape)
+        self._pending.append((model.steps, frame))
+        self.n_recorded += 1
+
+        if len(self._pending) == self.steps_per_chunk:
+            self.flush()
+
+    def flush(self):
+        """Write the pending steps in a new chunk, then add them to the index."""
+        if not self._pending:
+            return
+        path = _chunk_path(self.directory, self._n_chunks)
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(
+            tmp_path, **{name: np.concatenate([frame[name] for _, frame in self._pending]) for name in FIELDS}
+        )
+        os.replace(tmp_path, path)
+
+        records = np.zeros(len(self._pending), dtype=INDEX_RECORD)
+        records["step"] = [step for step, _ in self._pending]
+        records["chunk"] = self._n_chunks
+        records["count"] = [len(frame["type"]) for _, frame in self._pending]
+        records["start"] = np.cumsum(records["count"]) - records["count"]
+        with open(os.path.join(self.directory, "index.bin"), "ab") as f:
+            f.write(records.tobytes())
+
+        self._n_chunks += 1
+        self._pending = []
+
+    def close(self):
+        """Write the last steps (the recording stays readable without it, up to the last full chunk)."""
+        self.flush()
+
+
+class TrajectoryReader:
+    """Random access to the recorded steps of a recording directory.
+
+    Attributes:
+        types (tuple): names of the agent types
+        states (tuple): names of the agent states
+        dimensions (np.ndarray): (2, 2) bounds of the recorded space
+        torus (bool): whether the recorded space is a torus
+        every (int): recording period, in steps
+        metadata (dict): the metadata given to the recorder
+    """
+
+    def __init__(self, directory):
+        """Open a recording directory (it can still be written by a running recorder)."""
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.types = tuple(meta["types"])
+        self.states = tuple(meta["states"])
+        self.dimensions = np.asarray(meta["dimensions"], dtype=float)
+        self.torus = meta["torus"]
+        self.every = meta["every"]
+        self.metadata = meta["metadata"]
+
+        self._index = np.empty(0, dtype=INDEX_RECORD)
+        self._chunk = None  # (chunk number, {field: array}) of the last chunk read
+        self.refresh()
+
+    def refresh(self):
+        """Map the index again, to see the steps written since (when the run is still going)."""
+        path = os.path.join(self.directory, "index.bin")
+        n = os.path.getsize(path) // INDEX_RECORD.itemsize
+        self._index = np.memmap(path, dtype=INDEX_RECORD, mode="r", shape=(n,)) if n else np.empty(0, dtype=INDEX_RECORD)
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def steps(self):
+        """Recorded steps, in order."""
+        return self._index["step"]
+
+    def index_of_step(self, step):
+        """Index in the recording of a recorded step (steps are recorded every `every` steps)."""
+        if len(self._index) == 0:
+            raise IndexError("the recording is empty")
+        i = (step - int(self._index[0]["step"])) // self.every
+        if not 0 <= i < len(self._index) or self._index[i]["step"] != step:
+            raise KeyError(f"step {step} is not recorded")
+        return i
+
+    def _load_chunk(self, chunk):
+        if self._chunk is None or self._chunk[0] != chunk:
+            with np.load(_chunk_path(self.directory, chunk)) as data:
+                self._chunk = chunk, {name: data[name] for name in FIELDS}
+        return self._chunk[1]
+
+    def frame(self, i):
+        """The agents of the i-th recorded step, as a dict of arrays (one row per agent)."""
+        record = self._index[i]
+        data = self._load_chunk(int(record["chunk"]))
+        rows = slice(int(record["start"]), int(record["start"] + record["count"]))
+        return {name: data[name][rows] for name in FIELDS}
+
+    def frame_at(self, step):
+        """The agents of a recorded step."""
+        return self.frame(self.index_of_step(step))
+
+
+class ReplayAgent(ContinuousSpaceAgent):
+    """Stand-in of a recorded agent, with its type, state and heading as names.
+
+    Attributes:
+        kind (str): the recorded type
+        state (str): the recorded state
+        angle (float): the recorded heading, in degrees
+    """
+
+    def __init__(self, space, model):
+        super().__init__(space, model)
+        self.kind = None
+        self.state = None
+        self.angle = 0.0
+
+
+class ReplayModel(Model):
+    """Model playing a recording: each step shows the next recorded step, without simulating.
+
+    It can be given to SolaraViz in place of the recorded model: the agents are ReplayAgent and
+    the datacollector holds the number of agents of each type at the steps shown so far.
+    """
+
+    def __init__(self, directory, start_step=None, seed=None):
+        """Open a recording.
+
+        Args:
+            directory: the recording directory
+            start_step: recorded step shown first (default: the first one)
+            seed: unused, accepted so that the apps can pass it
+        """
+        super().__init__(seed=seed)
+        self.recording = TrajectoryReader(directory)
+        self.space = ContinuousSpace(self.recording.dimensions.tolist(), torus=self.recording.torus, random=self.random)
+        self.datacollector = ColumnarCollector(("step", *self.recording.types), lambda model: model.report())
+
+        self._pool = []
+        if len(self.recording) == 0:
+            self.running = False
+            return
+        self.frame_index = 0 if start_step is None else self.recording.index_of_step(start_step)
+        self.show(self.frame_index)
+
+    @property
+    def recorded_step(self):
+        """Step of the run shown at the moment."""
+        return int(self.recording.steps[self.frame_index])
+
+    def report(self):
+        """Recorded step and number of agents of each type, collected at each step shown."""
+        counts = np.bincount([self.recording.types.index(agent.kind) for agent in self._pool], minlength=len(self.recording.types))
+        return (self.recorded_step, *counts.tolist())
+
+    def show(self, i):
+        """Place the agents as they were at the i-th recorded step."""
+        frame = self.recording.frame(i)
+        n = len(frame["type"])
+        while len(self._pool) < n:
+            self._pool.append(ReplayAgent(self.space, self))
+        while len(self._pool) > n:
+            self._pool.pop().remove()
+
+        for agent, position, kind, state, angle in zip(
+            self._pool, frame["position"].astype(float), frame["type"], frame["state"], frame["angle"].tolist()
+        ):
+            agent.position = position
+            agent.kind = self.recording.types[kind]
+            agent.state = self.recording.states[state]
+            agent.angle = angle
+        self.frame_index = i
+        self.datacollector.collect(self)
+
+    def step(self):
+        """Show the next recorded step (the replay stops at the last one)."""
+        if self.frame_index + 1 >= len(self.recording):
+            # the run may still be recording
+            self.recording.refresh()
+        if self.frame_index + 1 >= len(self.recording):
+            self.running = False
+            return
+        self.show(self.frame_index + 1)
@@ -0,0 +1,254 @@
+"""
+Array-backed engine for the Foraging Ants model.
+
+Instead of calling ForagingAnt.step() once per agent, the ant state (positions,
+directions, modes, targets and food memory) lives in contiguous NumPy arrays
+(struct-of-arrays) and the whole colony is advanced with one batched update per step.
+
+The ForagingAnt and Food agents still exist so that the model keeps the same agent
+view: ant positions are written back to the space at every step, and the other
+attributes can be copied back on demand with VectorizedColony.sync_agents().
+
+Differences with the agent-by-agent engine:
+- all ants are updated synchronously (no shuffled sequential activation)
+- the food memory of an ant is reduced to the most recent food location it knows
+"""
+
+from operator import attrgetter
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from abm_tools.spatial import inclusive, wrap_positions
+
+# Integer codes of the ant modes, index = code
+MODES = ("explore", "return_to_colony", "go_to_food")
+EXPLORE, RETURN_TO_COLONY, GO_TO_FOOD = range(len(MODES))
+
+
+class VectorizedColony:
+    """Struct-of-arrays state of all the ants of a ForagingAntsModel.
+
+    Attributes:
+        position (np.ndarray): (n, 2) positions of the ants
+        direction (np.ndarray): (n, 2) directions of movement
+        mode (np.ndarray): (n,) mode codes (see MODES)
+        target (np.ndarray): (n, 2) current targets, NaN when the ant has none
+        food_memory (np.ndarray): (n, 2) last food location known by each ant
+        has_memory (np.ndarray): (n,) whether food_memory holds a location
+        angle (np.ndarray): (n,) heading in degrees, for visualization
+    """
+
+    def __init__(self, model, ants):
+        """Create the array state from existing agents.
+
+        Args:
+            model: ForagingAntsModel the colony belongs to, food is looked up in model.food_index
+            ants: the ForagingAnt agents, in a fixed order
+        """
+        self.model = model
+        self.space = model.space
+        self.rng = model.rng
+        self.food_index = model.food_index
+        self.ants = list(ants)
+
+        self.origin = np.asarray(self.space.dimensions[:, 0], dtype=float)
+        self.size = np.asarray(self.space.size, dtype=float)
+        self.colony_position = np.asarray(model.colony_position, dtype=float)
+
+        n = len(self.ants)
+        self.position = np.array([ant.position for ant in self.ants], dtype=float).reshape(n, 2)
+        self.direction = np.array([ant.direction for ant in self.ants], dtype=float).reshape(n, 2)
+        self.speed = np.array([ant.speed for ant in self.ants], dtype=float)
+        self.mode = np.full(n, EXPLORE, dtype=np.int8)
+        self.target = np.full((n, 2), np.nan)
+        self.food_memory = np.full((n, 2), np.nan)
+        self.has_memory = np.zeros(n, dtype=bool)
+        self.trail = np.zeros(n)
+        self.angle = np.zeros(n)
+
+        self._refresh_space_index()
+
+    def _refresh_space_index(self):
+        """Cache the rows of the ants in the space position array."""
+        self._space_index = np.array(
+            [self.space._agent_to_index[ant] for ant in self.ants], dtype=np.intp
+        )
+
+    def _tree(self, positions):
+        """Torus-aware KD-tree over a set of positions."""
+        # unbalanced trees are much faster to build and we rebuild them every step
+        return cKDTree(
+            positions - self.origin,
+            boxsize=self.size,
+            balanced_tree=False,
+            compact_nodes=False,
+        )
+
+    def step(self):
+        """Advance all the ants of one step."""
+        travelling = self.mode != EXPLORE
+        self._check_for_food()
+        if self.model.pheromones is None:
+            self._communicate(travelling)
+        self._move()
+        self._collect_food()
+        self._write_back()
+
+    def _check_for_food(self):
+        """Exploring ants detect food, or head to the food they remember."""
+        exploring = np.flatnonzero(self.mode == EXPLORE)
+        if exploring.size == 0:
+            return
+
+        food_idx = self.food_index.query_batch(
+            self.position[exploring], self.model.ant_search_radius
+        )
+        found = food_idx >= 0
+
+        finders = exploring[found]
+        self.mode[finders] = RETURN_TO_COLONY
+        self.food_memory[finders] = self.food_index.positions[food_idx[found]]
+        self.has_memory[finders] = True
+        self.target[finders] = self.colony_position
+        self.trail[finders] = 1.0
+
+        informed = exploring[~found]
+        informed = informed[self.has_memory[informed]]
+        self.mode[informed] = GO_TO_FOOD
+        self.target[informed] = self.food_memory[informed]
+
+    def _communicate(self, travelling):
+        """Ants that were travelling at the start of the step tell exploring ants where food is."""
+        senders = np.flatnonzero(travelling & self.has_memory)
+        receivers = np.flatnonzero(self.mode == EXPLORE)
+        if senders.size == 0 or receivers.size == 0:
+            return
+
+        pairs = self._tree(self.position[senders]).sparse_distance_matrix(
+            self._tree(self.position[receivers]),
+            inclusive(self.model.range_of_communication),
+            output_type="ndarray",
+        )
+        if pairs.size == 0:
+            return
+
+        to = receivers[pairs["j"]]
+        self.food_memory[to] = self.food_memory[senders[pairs["i"]]]
+        self.has_memory[to] = True
+
+    def _move(self):
+        """Move the ants based on their mode."""
+        old_position = self.position.copy()
+
+        # Random walk with some directional persistence
+        exploring = np.flatnonzero(self.mode == EXPLORE)
+        direction = self.direction[exploring] + self.rng.uniform(
+            -0.5, 0.5, size=(exploring.size, 2)
+        )
+        pheromones = self.model.pheromones
+        if pheromones is not None:
+            direction += self.model.pheromone_attraction * pheromones.direction_batch(
+                self.position[exploring]
+            )
+        norm = np.linalg.norm(direction, axis=1)
+        moving = norm > 0
+        direction[moving] /= norm[moving, np.newaxis]
+        self.direction[exploring] = direction
+        self.position[exploring] += direction * self.speed[exploring, np.newaxis]
+
+        # Straight line towards the target (colony or food)
+        travelling = np.flatnonzero(self.mode != EXPLORE)
+
+        # Returning ants lay a trail, stronger near the food
+        if pheromones is not None:
+            returning = travelling[self.mode[travelling] == RETURN_TO_COLONY]
+            pheromones.deposit_batch(
+                self.position[returning],
+                self.model.pheromone_deposit * self.trail[returning],
+            )
+            self.trail[returning] *= self.model.pheromone_trail_decay
+
+        vector_to_target = self.target[travelling] - self.position[travelling]
+        distance = np.linalg.norm(vector_to_target, axis=1)
+        far = distance > self.speed[travelling]
+
+        on_the_way = travelling[far]
+        self.direction[on_the_way] = vector_to_target[far] / distance[far, np.newaxis]
+        self.position[on_the_way] += (
+            self.direction[on_the_way] * self.speed[on_the_way, np.newaxis]
+        )
+
+        arrived = travelling[~far]
+        self.position[arrived] = self.target[arrived]
+        self._arrive(arrived, old_position[arrived], distance[~far])
+
+        self.position = wrap_positions(self.position, self.origin, self.size)
+        self.angle = np.degrees(np.arctan2(self.direction[:, 1], self.direction[:, 0]))
+
+    def _arrive(self, arrived, old_position, distance):
+        """Mode transitions of the ants that reached their target."""
+        mode = self.mode[arrived]
+
+        # At the colony: go to the remembered food, else (re)start exploring
+        at_colony = arrived[mode == RETURN_TO_COLONY]
+        remembers = self.has_memory[at_colony]
+        self.mode[at_colony[remembers]] = GO_TO_FOOD
+        self.target[at_colony[remembers]] = self.food_memory[at_colony[remembers]]
+        self.mode[at_colony[~remembers]] = EXPLORE
+        self.target[at_colony[~remembers]] = np.nan
+
+        # Near the food: if it is gone, back to exploring and forget it
+        at_food = (mode == GO_TO_FOOD) & (distance < 1.0)
+        if not at_food.any():
+            return
+        food_left = (
+            self.food_index.query_batch(
+                old_position[at_food], self.model.ant_search_radius
+            )
+            >= 0
+        )
+
+        gone = arrived[at_food][~food_left]
+        self.mode[gone] = EXPLORE
+        self.target[gone] = np.nan
+        self.has_memory[gone] = False
+        self.food_memory[gone] = np.nan
+
+    def _collect_food(self):
+        """Remove the food sources with enough ants gathered around them."""
+        slots = self.food_index.slots()
+        if len(slots) == 0:
+            return
+
+        counts = self._tree(self.position).query_ball_point(
+            self.food_index.positions[slots] - self.origin,
+            inclusive(self.model.food_collection_radius),
+            return_length=True,
+        )
+        foods = [self.food_index.foods[slot] for slot in slots]
+        ants_needed = np.array([food.ants_needed for food in foods])
+        # in creation order, so that the respawned foods do not depend on the slots
+        collected = sorted((foods[i] for i in np.flatnonzero(counts >= ants_needed)), key=attrgetter("unique_id"))
+        for food in collected:
+            # rows below a removed agent move one up in the space position array
+            row = self.space._agent_to_index[food]
+            self._space_index[self._space_index > row] -= 1
+            self.model.collect_food(food)
+
+    def _write_back(self):
+        """Write the ant positions in the space, so that neighbor queries and the visualization see them."""
+        self.space.agent_positions[self._space_index] = self.position
+
+    def mode_counts(self) -> dict:
+        """Number of ants in each mode."""
+        counts = np.bincount(self.mode, minlength=len(MODES))
+        return {mode: int(count) for mode, count in zip(MODES, counts)}
+
+    def sync_agents(self):
+        """Copy the array state back onto the ForagingAnt agents (mode, direction, target, angle)."""
+        for i, ant in enumerate(self.ants):
+            ant.mode = MODES[self.mode[i]]
+            ant.direction = self.direction[i].copy()
+            ant.target = None if np.isnan(self.target[i, 0]) else tuple(self.target[i])
+            ant.angle = float(self.angle[i])
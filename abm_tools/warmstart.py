@@ -0,0 +1,117 @@
+"""
+Warm-start cache of initialized models, for sweeps and ensembles.
+
+Creating a model (agents, food placement, spatial indexes) takes as long as many steps of a
+short run, and every run of a sweep does it again, even when runs only differ by their
+number of steps or collection period. The cache keeps the state of a model right after its
+creation, on disk, keyed by the model name, its keyword arguments (seed included) and the
+source code of the models, and the next runs with the same key load it instead.
+
+A cached model is a pickle, loaded with the garbage collector paused, which is several times
+faster than creating the agents one by one (the checkpoints of abm_tools.checkpoint rebuild
+the agents, and are meant to be read by later versions of the code, which the cache is not:
+a change of the source code changes the keys). Models writing files or starting processes
+when they are created (trajectory_directory, data_directory, the tiled engine) are not cached.
+
+Usage:
+    model = warm_model("foraging_V2", {"initial_ants": 1000, "seed": 3}, cache_dir="sweeps/cache")
+"""
+
+import functools
+import gc
+import hashlib
+import itertools
+import json
+import os
+import pickle
+
+from mesa.agent import Agent
+from mesa.experimental.continuous_space import ContinuousSpace
+
+from abm_tools.checkpoint import _next_unique_id
+from abm_tools.models import MODELS, ROOT, load_model
+
+# Source directories whose code defines the state of a created model
+SOURCE_DIRECTORIES = ("abm_tools", os.path.join("experimentations", "memory_module"))
+
+
+@functools.lru_cache(maxsize=None)
+def source_fingerprint(model_name):
+    """Hash of the source files of a model and of the tools it uses."""
+    digest = hashlib.sha1()
+    for directory in (MODELS[model_name][0], *SOURCE_DIRECTORIES):
+        path = os.path.join(ROOT, directory)
+        for file_name in sorted(os.listdir(path)):
+            if file_name.endswith(".py"):
+                digest.update(file_name.encode())
+                with open(os.path.join(path, file_name), "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+
+def cache_key(model_name, config):
+    """Identifier of the initial state of a model configuration (config includes the seed)."""
+    key = json.dumps([model_name, config, source_fingerprint(model_name)], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def cacheable(config):
+    """Whether a model created with these keyword arguments can be cached."""
+    return (
+        config.get("trajectory_directory") is None
+        and config.get("data_directory") is None
+        and config.get("engine") != "tiled"
+    )
+
+
+def save_model(model, path):
+    """Write a model to path, atomically (concurrent workers may write the same entry)."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump((_next_unique_id(model), model), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def load_model_state(path):
+    """Load a model written by save_model."""
+    enabled = gc.isenabled()
+    # the collector would otherwise walk the objects being loaded again and again
+    gc.disable()
+    try:
+        with open(path, "rb") as f:
+            next_unique_id, model = pickle.load(f)
+    finally:
+        if enabled:
+            gc.enable()
+    # the unique_id counters of Mesa are per model instance, and not pickled
+    Agent._ids[model] = itertools.count(next_unique_id)
+    # agent_positions is a view of the buffer of the space, which pickle turns into a copy
+    space = getattr(model, "space", None)
+    if isinstance(space, ContinuousSpace):
+        space.agent_positions = space._agent_positions[: space._n_agents]
+    return model
+
+
+def warm_model(model_name, config, cache_dir=None):
+    """Create a model, or load it from the cache if the same configuration was created before.
+
+    Args:
+        model_name: "foraging_V1", "foraging_V2" or "virus_antibody"
+        config: keyword arguments of the model, including the seed
+        cache_dir: directory of the cache (None: no cache)
+
+    Returns:
+        the model, in the state where its constructor leaves it
+    """
+    model_class = load_model(model_name)
+    if cache_dir is None or not cacheable(config):
+        return model_class(**config)
+
+    path = os.path.join(cache_dir, cache_key(model_name, config) + ".pickle")
+    if os.path.exists(path):
+        return load_model_state(path)
+
+    model = model_class(**config)
+    os.makedirs(cache_dir, exist_ok=True)
+    save_model(model, path)
+    return model
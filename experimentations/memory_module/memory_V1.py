@@ -7,7 +7,7 @@ of the entries, which allows for a greater flexibility. Key features:
 
 - Capacity-based memory, with a FIFO system
 - Efficient storage and retrieval of entries
-- Support for different entry_types of entries
+- Support for different entry_types of entries, with an index by entry_type
 - Possibility to send entries to other agents
 
 For now, the module contains only one main component:
@@ -50,6 +50,8 @@ class Memory:
         self._ids = itertools.count()
 
         self.memory_storage = OrderedDict()
+        # entry_type -> ids of the entries of this type (dict used as an ordered set)
+        self._ids_by_type = {}
 
     def remember(
         self, entry_content: Any, entry_type: Any, external_agent_id=None
@@ -60,6 +62,7 @@ class Memory:
         # creation of a new entry in the memory
         if entry_id not in self.memory_storage:
             self.memory_storage[entry_id] = OrderedDict()
+        self._ids_by_type.setdefault(entry_type, {})[entry_id] = None
 
         self.memory_storage[entry_id]["entry_content"] = entry_content
         self.memory_storage[entry_id]["entry_type"] = entry_type
@@ -70,7 +73,7 @@ class Memory:
 
         # if the memory is longer than the capacity, we remove the oldest entry
         if len(self.memory_storage) > self.capacity:
-            self.memory_storage.popitem(last=False)
+            self._unindex(*self.memory_storage.popitem(last=False))
 
         return entry_id
 
@@ -83,17 +86,33 @@ class Memory:
 
     def get_by_type(self, entry_type: str) -> list:
         """Returns all the ids of the entries of a specific entry_type."""
-        entry_list = [
-            entry_id
-            for entry_id, entry in self.memory_storage.items()
-            if entry["entry_type"] == entry_type
-        ]
-        return entry_list
+        return list(self._ids_by_type.get(entry_type, ()))
 
     def forget(self, entry_id):
         """Forget a specific entry."""
         if entry_id in self.memory_storage:
-            self.memory_storage.pop(entry_id)
+            self._unindex(entry_id, self.memory_storage.pop(entry_id))
+
+    def _unindex(self, entry_id, entry):
+        """Remove a forgotten entry from the index by entry_type."""
+        ids = self._ids_by_type[entry["entry_type"]]
+        del ids[entry_id]
+        if not ids:
+            del self._ids_by_type[entry["entry_type"]]
+
+    def next_entry_number(self) -> int:
+        """Number used by the id of the next entry (without consuming it)."""
+        number = next(self._ids)
+        self._ids = itertools.count(number)
+        return number
+
+    def restore(self, entries, next_entry_number: int):
+        """Replace the content of the memory by (entry_id, entry) pairs, oldest first (e.g. read from a checkpoint)."""
+        self.memory_storage = OrderedDict(entries)
+        self._ids_by_type = {}
+        for entry_id, entry in self.memory_storage.items():
+            self._ids_by_type.setdefault(entry["entry_type"], {})[entry_id] = None
+        self._ids = itertools.count(next_entry_number)
 
     def tell_to(self, entry_id, external_agent):
         """Send a precise memory to another agent by making a deep copy of the entry."""
@@ -10,8 +10,9 @@ Key Features:
 - Capacity-based short-term memory, with a FIFO system
 - Computationaly-efficient long term memory
 - Efficient storage and retrieval of entries
-- Support for different entry_types of entries
-- Possibility to send entries to other agents (communication)
+- Support for different entry_types of entries, indexed by entry_type for O(1) lookups
+- Possibility to send entries to other agents (communication), without sending an agent an entry
+  whose content it already holds, whoever it came from
 
 The module now contains four main component:
 - Memory: The operating class for managing ShortTermMemory and LongTermMemory
@@ -24,6 +25,36 @@ from collections import deque
 import copy
 from typing import Dict, List, Any, Optional, Union, Tuple
 
+import numpy as np
+
+
+def content_key(entry_content: Any):
+    """Hashable key of an entry content, equal for equal contents (numpy arrays included)."""
+    if isinstance(entry_content, np.ndarray):
+        return (entry_content.dtype.str, entry_content.shape, entry_content.tobytes())
+    if isinstance(entry_content, (list, tuple)):
+        return tuple(content_key(item) for item in entry_content)
+    return entry_content
+
+
+def _index_key(entry_type, entry_content):
+    """Key of the content index of the memories (unhashable contents are indexed by identity)."""
+    key = (entry_type, content_key(entry_content))
+    try:
+        hash(key)
+    except TypeError:
+        return (entry_type, ("id", id(entry_content)))
+    return key
+
+
+def _count(counts, key, delta):
+    """Add delta to the number of entries of a key of a content index, dropping the keys at 0."""
+    n = counts.get(key, 0) + delta
+    if n:
+        counts[key] = n
+    else:
+        counts.pop(key, None)
+
 
 class MemoryEntry:
     """Base class for all memory entries """
@@ -59,55 +90,75 @@ class MemoryEntry:
 class ShortTermMemory:
     """
     Short-term memory with limited capacity that follows recency principles.
-    Implemented as a double-ended queue with O(1) add/remove operations.
+    Implemented as a double-ended queue with O(1) add/remove operations,
+    and indexed by id and by entry_type for O(1) lookups.
     """
     def __init__(self, model, capacity: int = 10):
         self.model = model
         self.capacity = capacity
         self.entries = deque(maxlen=capacity)
+        self._by_id: Dict[int, MemoryEntry] = {}
+        # entry_type -> {id(entry): entry}, in insertion order
+        self._by_type: Dict[Any, Dict[int, MemoryEntry]] = {}
+        # (entry_type, content key) -> number of entries, see holds
+        self._by_content: Dict[Any, int] = {}
     
     def add(self, model, entry_content: str = None, entry_type : str = "general", entry_metadata: Dict = None, entry = None) -> MemoryEntry:
         """Add a new entry to short-term memory."""
 
-        if entry is not None :
-            self.entries.append(entry)
-            return entry
-
-        entry_metadata = entry_metadata or {}
-        entry = MemoryEntry(entry_step=model.step, entry_content=entry_content, entry_type=entry_type, entry_metadata=entry_metadata)
+        if entry is None :
+            entry_metadata = entry_metadata or {}
+            entry = MemoryEntry(entry_step=model.steps, entry_content=entry_content, entry_type=entry_type, entry_metadata=entry_metadata)
         
         # If at capacity, oldest entry gets automatically removed due to maxlen
+        if len(self.entries) == self.entries.maxlen:
+            if not self.entries:
+                return entry  # a memory of capacity 0 keeps nothing
+            self._unindex(self.entries[0])
         self.entries.append(entry)
+        self._index(entry)
         return entry
+
+    def _index(self, entry):
+        if id(entry) not in self._by_id:
+            _count(self._by_content, _index_key(entry.entry_type, entry.entry_content), 1)
+        self._by_id[id(entry)] = entry
+        self._by_type.setdefault(entry.entry_type, {})[id(entry)] = entry
+
+    def _unindex(self, entry):
+        if self._by_id.pop(id(entry), None) is not None:
+            _count(self._by_content, _index_key(entry.entry_type, entry.entry_content), -1)
+        entries = self._by_type.get(entry.entry_type)
+        if entries is not None:
+            entries.pop(id(entry), None)
+            if not entries:
+                del self._by_type[entry.entry_type]
     
     def get_recent(self, n: int = 10) -> List[MemoryEntry]:
         """Get n most recent entries."""
         return list(self.entries)[-n:]
     
     def get_by_id(self, entry_id) -> Optional[MemoryEntry]:
-        entry_list = [entry for entry in self.entries if id(entry) == entry_id]
-        if entry_list != []:
-            return entry_list[0]
-        else :
-            return None
+        return self._by_id.get(entry_id)
 
     def get_by_type(self, entry_type: str) -> List[MemoryEntry]:
         """Get entries from a specific entry_type."""
+        return list(self._by_type.get(entry_type, {}).values())
 
-        entry_list = [entry for entry in self.entries if entry.entry_type == entry_type]
-
-        return entry_list
+    def holds(self, entry_type: str, entry_content: Any) -> bool:
+        """Whether an entry of this type and content (compared with content_key) is in memory."""
+        return _index_key(entry_type, entry_content) in self._by_content
     
     def forget_last(self) -> bool:
         if len(self.entries)>0:
-            self.entries.pop()
+            self._unindex(self.entries.pop())
             return True
         else : 
             return False
     
     def forget_first(self) -> bool:
         if len(self.entries)>0:
-            self.entries.popleft()
+            self._unindex(self.entries.popleft())
             return True
         else : 
             return False
@@ -116,18 +167,20 @@ class ShortTermMemory:
         """Remove an entry from short-term memory."""
 
         if entry_id is not None:
-            entry_list = [entry for entry in self.entries if id(entry) == entry_id]
-            if len(entry_list) > 0:
-                entry = entry_list[0]
-        
-        elif isinstance(entry, MemoryEntry):
+            entry = self._by_id.get(entry_id)
+
+        if isinstance(entry, MemoryEntry) and id(entry) in self._by_id:
             self.entries.remove(entry)
+            self._unindex(entry)
             return True
         
         return False
 
     def clear(self):
         self.entries.clear()
+        self._by_id.clear()
+        self._by_type.clear()
+        self._by_content.clear()
     
 
 
@@ -140,21 +193,23 @@ class LongTermMemory:
     def __init__(self, model):
         self.model = model
         self.entries: Dict[int, MemoryEntry] = {}
+        # entry_type -> {id(entry): entry}, in insertion order
+        self._by_type: Dict[Any, Dict[int, MemoryEntry]] = {}
+        # (entry_type, content key) -> number of entries, see holds
+        self._by_content: Dict[Any, int] = {}
     
     def add(self, model, entry_content: str = None, entry_type : str = "general", entry_metadata: Dict = None, entry = None) -> MemoryEntry:
         """Add a new entry to long-term memory."""
 
-        if entry is not None :
-            entry_id = id(entry)
-            self.entries[entry_id] = entry
-            return entry
+        if entry is None :
+            entry_metadata = entry_metadata or {}
+            entry = MemoryEntry(entry_step=model.steps, entry_content=entry_content, entry_type=entry_type, entry_metadata=entry_metadata)
 
-        entry_metadata = entry_metadata or {}
-        entry = MemoryEntry(entry_step=model.step, entry_content=entry_content, entry_type=entry_type, entry_metadata=entry_metadata)
         entry_id = id(entry)
-
-        # If at capacity, oldest entry gets automatically removed due to maxlen
+        if entry_id not in self.entries:
+            _count(self._by_content, _index_key(entry.entry_type, entry.entry_content), 1)
         self.entries[entry_id] = entry
+        self._by_type.setdefault(entry.entry_type, {})[entry_id] = entry
         return entry
     
     def get_by_id(self, entry_id) -> Optional[MemoryEntry]:
@@ -166,10 +221,11 @@ class LongTermMemory:
     
     def get_by_type(self, entry_type: str) -> List[MemoryEntry]:
         """Get entries from a specific entry_type."""
+        return list(self._by_type.get(entry_type, {}).values())
 
-        entry_list = [entry for entry in self.entries.values() if entry.entry_type == entry_type]
-
-        return entry_list
+    def holds(self, entry_type: str, entry_content: Any) -> bool:
+        """Whether an entry of this type and content (compared with content_key) is in memory."""
+        return _index_key(entry_type, entry_content) in self._by_content
     
     def forget(self, entry_id=None, entry : MemoryEntry = None) -> bool:
         """Remove an entry from long-term memory."""
@@ -179,9 +235,19 @@ class LongTermMemory:
         if entry_id is None or entry_id not in self.entries.keys():
             return False
                 
-        del self.entries[entry_id]
+        entry = self.entries.pop(entry_id)
+        _count(self._by_content, _index_key(entry.entry_type, entry.entry_content), -1)
+        entries = self._by_type[entry.entry_type]
+        del entries[entry_id]
+        if not entries:
+            del self._by_type[entry.entry_type]
 
         return True
+
+    def clear(self):
+        self.entries.clear()
+        self._by_type.clear()
+        self._by_content.clear()
     
 
 
@@ -196,6 +262,9 @@ class Memory:
         self.agent = agent
         self.short_term = ShortTermMemory(capacity=stm_capacity, model=self.model)
         self.long_term = LongTermMemory(model=self.model)
+        # Entries sent by communicate, and those not sent because the receiver already held them
+        self.n_sent = 0
+        self.n_suppressed = 0
     
     def remember_short_term(self, 
                             model,
@@ -269,8 +338,30 @@ class Memory:
         else:
             return results
 
+    def holds(self, entry_type: str, entry_content: Any, external_id=None) -> bool:
+        """Whether an entry of this type and content (received from external_id, if given) is in memory."""
+        # content index of the stores
+        if not (self.short_term.holds(entry_type, entry_content) or self.long_term.holds(entry_type, entry_content)):
+            return False
+        if external_id is None:
+            return True
+        # the sender is only known by the entries themselves
+        key = content_key(entry_content)
+        return any(
+            entry.entry_metadata.get("external_id") == external_id and content_key(entry.entry_content) == key
+            for entry in self.short_term.get_by_type(entry_type) + self.long_term.get_by_type(entry_type)
+        )
+
     def communicate(self, entry, external_agent): #check
-        """Send a precise memory to another agent by making a deep copy of the entry."""
+        """Send a precise memory to another agent by making a deep copy of the entry.
+
+        If the other agent already holds an entry of the same type and content, whoever it came
+        from, nothing is copied (the transmission is counted in n_suppressed) and None is returned.
+        """
+        if external_agent.memory.holds(entry.entry_type, entry.entry_content):
+            self.n_suppressed += 1
+            return None
+
         entry_copy = copy.deepcopy(entry)
         entry_copy.entry_metadata["external_id"] = self.agent.unique_id
 
@@ -278,6 +369,7 @@ class Memory:
                                                                 entry_content = entry_copy.entry_content,
                                                                 entry_type = entry_copy.entry_type,
                                                                 entry_metadata = entry_copy.entry_metadata)
+        self.n_sent += 1
 
         return new_entry
     
@@ -11,6 +11,11 @@ sys.path.insert(0, os.path.abspath("../../mesa"))
 
 from mesa.visualization import Slider, SolaraViz, make_space_component
 
+from abm_tools.trajectory import ReplayAgent, ReplayModel, TrajectoryReader
+
+# Directory of a trajectory recording to replay instead of simulating (REPLAY=path solara run app.py)
+REPLAY_DIRECTORY = os.environ.get("REPLAY")
+
 # Pre-compute markers for different angles (e.g., every 10 degrees)
 MARKER_CACHE = {}
 for angle in range(0, 360, 10):
@@ -24,8 +29,16 @@ MARKER_CACHE["food"] = food_marker
 def agent_portrayal(agent):
     """Portray an agent for visualization."""
     portrayal = {}
+
+    if isinstance(agent, ReplayAgent):
+        # Agent of a recording, with its recorded type and mode
+        kind, mode = agent.kind, agent.state
+    elif isinstance(agent, ForagingAnt):
+        kind, mode = "ant", agent.mode
+    else:
+        kind, mode = "food", None
     
-    if isinstance(agent, ForagingAnt):
+    if kind == "ant":
         # Calculate the angle
         deg = agent.angle
         # Round to nearest 10 degrees
@@ -34,24 +47,24 @@ def agent_portrayal(agent):
         portrayal["marker"] = MARKER_CACHE[rounded_deg]
         portrayal["size"] = 30
         
-        if agent.mode == "explore":
+        if mode == "explore":
             # Black if exploring
             portrayal["color"] = "black"
             portrayal["layer"] = 1
             
 
-        elif agent.mode == "go_to_food" :
+        elif mode == "go_to_food" :
             # red if found food
             portrayal["color"] = "purple"
             portrayal["layer"] = 2
         
-        elif agent.mode == "return_to_colony":
+        elif mode == "return_to_colony":
             # brown if returning to colony
             portrayal["color"] = "blue"
             portrayal["layer"] = 3
 
             
-    elif isinstance(agent, Food):
+    elif kind == "food":
         portrayal["marker"] = MARKER_CACHE["food"]
         portrayal["size"] = 50
         portrayal["color"] = "green"
@@ -119,11 +132,31 @@ model_params = {
         max=10,
         step=1,
     ),
+    "food_respawn": {
+        "type": "Checkbox",
+        "value": True,
+        "label": "Respawn collected food",
+    },
 }
 
 # Create model instance for visualization
 model = ForagingAntsModel()
 
+if REPLAY_DIRECTORY:
+    # Play the recording, the slider chooses the step shown first
+    recording = TrajectoryReader(REPLAY_DIRECTORY)
+    model_params = {
+        "directory": REPLAY_DIRECTORY,
+        "start_step": Slider(
+            label="Start at step",
+            value=int(recording.steps[0]),
+            min=int(recording.steps[0]),
+            max=int(recording.steps[-1]),
+            step=recording.every,
+        ),
+    }
+    model = ReplayModel(REPLAY_DIRECTORY)
+
 
 
 # Create the visualization page
@@ -6,6 +6,7 @@ A Mesa implementation of an ant colony foraging for food.
 
 import os
 import sys
+from operator import methodcaller
 
 sys.path.insert(0, os.path.abspath("../../mesa"))
 
@@ -15,6 +16,23 @@ from mesa import Model
 from agents import ForagingAnt, Food
 from mesa.experimental.continuous_space import ContinuousSpace
 
+from abm_tools.checkpoint import load_checkpoint, save_checkpoint
+from abm_tools.collector import ColumnarCollector
+from abm_tools.legs import TravelLegs
+from abm_tools.pheromones import PheromoneField
+from abm_tools.placement import poisson_disk_sample
+from abm_tools.spatial import FoodIndex, NeighborGraph
+from abm_tools.tiled import TiledColony
+from abm_tools.trajectory import TrajectoryRecorder
+from abm_tools.vectorized import MODES, VectorizedColony
+
+# Columns of the data collected at each step
+DATA_COLUMNS = ("step", "food_collected", "explore", "return_to_colony", "go_to_food", "food_remaining")
+
+# Agent types and states of the trajectory recordings (ants are in one of the MODES)
+TRAJECTORY_TYPES = ("ant", "food")
+TRAJECTORY_STATES = (*MODES, "uncollected")
+
 class ForagingAntsModel(Model):
     """
     Foraging Ants model. 
@@ -33,6 +51,16 @@ class ForagingAntsModel(Model):
         speed=1,
         range_of_communication=10,
         ants_needed=5,
+        food_respawn=True,
+        engine="agents",
+        scheduled_legs=False,
+        communication_skin=0.0,
+        tiles=(2, 2),
+        pheromones=False,
+        data_directory=None,
+        data_chunk_size=10_000,
+        trajectory_directory=None,
+        trajectory_every=1,
         seed=None,
     ):
         """Create a new Foraging Ant model.
@@ -45,14 +73,46 @@ class ForagingAntsModel(Model):
             speed: How fast the Ants move (default: 1)
             range_of_communication: The range within which ants can communicate
             ants_needed: Number of ants needed to collect a food source
+            food_respawn: If True, a new food source is placed (with the same spacing rules as the
+                initial ones) each time one is collected, so the number of food sources stays constant
+            engine: "agents" to step every agent in Python, or "vectorized" to advance
+                all the ants with one batched NumPy update (see abm_tools.vectorized), or
+                "tiled" to split the space in tiles stepped by worker processes (see abm_tools.tiled)
+            scheduled_legs: With the agents engine, ants travelling in a straight line to their target
+                are not moved step by step: their arrival is computed when they leave and scheduled
+                as an event, and their position is interpolated when it is read (see abm_tools.legs)
+            communication_skin: With the agents engine, margin of the Verlet list of the pairs of agents
+                within range of communication: the pairs within range + skin are kept, and the KD-tree
+                query is only made again once two agents may have moved closer by more than the skin
+                (e.g. a few times speed; default: 0, a query at every step, see abm_tools.spatial)
+            tiles: Number of tiles along x and y with the tiled engine, one worker process each
+            pheromones: If True, ants communicate through a pheromone field instead of
+                pairwise messages: they lay a trail on their way back to the colony and
+                follow its gradient while exploring
+            data_directory: Directory where the collected data is flushed every data_chunk_size
+                steps (default: None, only the last data_chunk_size steps are kept in memory)
+            data_chunk_size: Number of collected steps kept in memory
+            trajectory_directory: Directory where the positions, types and modes of all the agents
+                are recorded every trajectory_every steps, to be replayed later without the model
+                (default: None, no recording, see abm_tools.trajectory)
+            trajectory_every: Recording period of the trajectory, in steps
             seed: Random seed for reproducibility (default: None)
 
         Indirect parameters (not chosen in the graphic interface for clarity reasons):
             ant_search_radius: Radius within which ants can detect food
             food_collection_radius: Radius for counting ants around food
+            food_min_distance: Minimum distance between two food sources (placed by Poisson-disk sampling)
+            pheromone_deposit: Pheromone laid per step by an ant returning from food
+            pheromone_trail_decay: Factor applied to the deposit at each step away from the food
+            pheromone_attraction: Weight of the pheromone gradient in the direction of exploring ants
 
         """
 
+        if engine not in ("agents", "vectorized", "tiled"):
+            raise ValueError("engine must be 'agents', 'vectorized' or 'tiled'")
+        if scheduled_legs and engine != "agents":
+            raise ValueError("scheduled_legs is only available with the 'agents' engine")
+
         super().__init__(seed=seed)
         
         # Model parameters
@@ -62,6 +122,8 @@ class ForagingAntsModel(Model):
         self.height = height
         self.range_of_communication = range_of_communication
         self.ants_needed = ants_needed
+        self.food_respawn = food_respawn
+        self.engine = engine
         
         # Setup colony parameters
         self.colony_position = 5,5  # Colony at the right corner
@@ -70,6 +132,12 @@ class ForagingAntsModel(Model):
         # Food collection parameters
         self.ant_search_radius = 2.0  # Radius within which ants can detect food
         self.food_collection_radius = 5.0  # Radius for counting ants around food
+        self.food_min_distance = 10.0  # Minimum distance between two food sources
+
+        # Pheromone parameters (only used with pheromones=True)
+        self.pheromone_deposit = 1.0
+        self.pheromone_trail_decay = 0.97
+        self.pheromone_attraction = 1.0
         
         # Statistics
         self.food_collected = 0
@@ -79,35 +147,51 @@ class ForagingAntsModel(Model):
             [[0, width], [0, height]],
             torus=True,
             random=self.random,
-            n_agents=initial_ants + initial_food,
+            n_agents=initial_food + (0 if engine == "tiled" else initial_ants),
+        )
+
+        # Food-only spatial index, queried instead of scanning every agent of the space
+        self.food_index = FoodIndex(self.space)
+
+        # Straight legs of the ants travelling to their target, ended by arrival events
+        self.legs = TravelLegs(self) if scheduled_legs else None
+
+        # Neighbor pairs within range of communication, computed at most once per step
+        self.neighbor_graph = NeighborGraph(
+            self.space,
+            self.range_of_communication,
+            before_build=None if self.legs is None else self.legs.sync,
+            skin=communication_skin,
         )
+
+        # Pheromone grid, diffused and evaporated once per step
+        self.pheromones = PheromoneField(self.space, resolution=1.0, evaporation=0.05, diffusion=0.1) if pheromones else None
         
         # Create and place the Ant agents
         ants_positions = self.rng.random(size=(self.initial_ants, 2)) * self.space.size
         directions = self.rng.uniform(-1, 1, size=(self.initial_ants, 2))
-        ForagingAnt.create_agents(
-            self,
-            self.initial_ants,
-            self.space,
-            initial_position=ants_positions,
-            direction=directions,
-            speed=speed,
-            range_of_communication=range_of_communication,
-        )
+        # With the tiled engine, the ants only exist as rows of the shared arrays of the workers
+        if self.engine != "tiled":
+            ForagingAnt.create_agents(
+                self,
+                self.initial_ants,
+                self.space,
+                initial_position=ants_positions,
+                direction=directions,
+                speed=speed,
+                range_of_communication=range_of_communication,
+            )
 
 
         # Create and place the Food agents - away from colony and each other
-        possible_positions = []
-
-        while len(possible_positions) < initial_food:
-            pos = self.rng.random(2) * self.space.size
-            if np.linalg.norm(pos - np.array(self.colony_position)) <= self.colony_radius * 3:
-                continue
-            if any(np.linalg.norm(pos - np.array(p)) < 10 for p in possible_positions):
-                continue
-            possible_positions.append(pos)
-        
-        food_positions = np.array(possible_positions)
+        food_positions = poisson_disk_sample(
+            self.rng,
+            self.space.dimensions,
+            initial_food,
+            self.food_min_distance,
+            torus=self.space.torus,
+            exclude=[(self.colony_position, self.colony_radius * 3)],
+        )
         Food.create_agents(
             self, 
             initial_food,
@@ -115,6 +199,41 @@ class ForagingAntsModel(Model):
             position = food_positions,
             ants_needed=ants_needed)
 
+        # Array-backed state of the ants, only used by the vectorized and tiled engines
+        self.colony_state = None
+        if self.engine == "vectorized":
+            self.colony_state = VectorizedColony(self, self.agents_by_type.get(ForagingAnt, []))
+        elif self.engine == "tiled":
+            self.colony_state = TiledColony(self, ants_positions, directions, speed, tiles)
+
+        # Per-step series in preallocated columns, flushed to disk by chunks
+        self.datacollector = ColumnarCollector(
+            DATA_COLUMNS,
+            methodcaller("report"),
+            chunk_size=data_chunk_size,
+            directory=data_directory,
+        )
+        self.datacollector.collect(self)
+
+        # Agents of every recorded step, written to disk by compressed chunks
+        self.trajectory = None
+        if trajectory_directory is not None:
+            self.trajectory = TrajectoryRecorder(
+                trajectory_directory,
+                methodcaller("trajectory_frame"),
+                TRAJECTORY_TYPES,
+                TRAJECTORY_STATES,
+                self.space,
+                every=trajectory_every,
+                metadata={
+                    "model": type(self).__name__,
+                    "engine": engine,
+                    "colony_position": self.colony_position,
+                    "colony_radius": self.colony_radius,
+                },
+            )
+            self.trajectory.collect(self)
+
 
     def calculate_ant_angles(self):
         """Calculate angles for all ant agents for visualization."""
@@ -123,7 +242,124 @@ class ForagingAntsModel(Model):
         for ant in ant_agents:
             ant.angle = np.degrees(np.arctan2(ant.direction[1], ant.direction[0]))
 
+    def mode_counts(self):
+        """Number of ants in each mode (explore, return_to_colony, go_to_food)."""
+        if self.colony_state is not None:
+            return self.colony_state.mode_counts()
+
+        counts = {"explore": 0, "return_to_colony": 0, "go_to_food": 0}
+        for ant in self.agents_by_type.get(ForagingAnt, []):
+            counts[ant.mode] += 1
+        return counts
+
+    def report(self):
+        """Values of DATA_COLUMNS for the current state of the model."""
+        modes = self.mode_counts()
+        return (
+            self.steps,
+            self.food_collected,
+            modes["explore"],
+            modes["return_to_colony"],
+            modes["go_to_food"],
+            len(self.food_index),
+        )
+
+    def collect_food(self, food):
+        """Remove a food source gathered by enough ants, and place a new one if food_respawn is set."""
+        position = self.food_index.position_of(food)
+        food.remove()
+        self.food_collected += 1
+        if self.food_respawn:
+            self.spawn_food(fallback=position)
+
+    def spawn_food(self, fallback, attempts=30):
+        """Place a new food source at a random position away from the colony and the other food sources.
+
+        Args:
+            fallback: position used if none of the random positions fits (e.g. the position of the
+                food source just collected, which respects the spacing rules)
+            attempts: number of random positions tried
+        """
+        origin = self.space.dimensions[:, 0]
+        size = np.asarray(self.space.size, dtype=float)
+        # same rules as poisson_disk_sample: strictly outside of the colony zone,
+        # and at least food_min_distance away from the other food sources
+        closer_than_min = np.nextafter(self.food_min_distance, 0)
+        position = fallback
+        for _ in range(attempts):
+            candidate = origin + self.rng.random(2) * size
+            delta = np.abs(candidate - self.colony_position)
+            if self.space.torus:
+                delta = np.minimum(delta, size - delta)
+            if np.hypot(*delta) > self.colony_radius * 3 and self.food_index.query_batch(candidate, closer_than_min)[0] < 0:
+                position = candidate
+                break
+
+        Food.create_agents(self, 1, self.space, position=[position], ants_needed=self.ants_needed)
+
+    def trajectory_frame(self):
+        """Positions, types, states and headings of the ants and food sources, as recorded in the trajectory."""
+        if self.colony_state is not None:
+            ant_positions = self.colony_state.position
+            ant_states = self.colony_state.mode
+            ant_angles = self.colony_state.angle
+        else:
+            ants = self.agents_by_type.get(ForagingAnt, [])
+            ant_positions = np.array([ant.position for ant in ants], dtype=float).reshape(-1, 2)
+            ant_states = [MODES.index(ant.mode) for ant in ants]
+            ant_angles = [ant.angle for ant in ants]
+
+        food_positions = self.food_index.positions[self.food_index.slots()]
+        n_ants, n_food = len(ant_positions), len(food_positions)
+        return {
+            "position": np.concatenate([ant_positions, food_positions]),
+            "type": np.repeat([0, 1], [n_ants, n_food]),
+            "state": np.concatenate([ant_states, np.full(n_food, len(MODES))]),
+            "angle": np.concatenate([ant_angles, np.zeros(n_food)]),
+        }
+
+    def sync_agent_view(self):
+        """Copy the state of the vectorized engine back onto the ant agents (no-op for the agents engine)."""
+        if self.colony_state is not None:
+            self.colony_state.sync_agents()
+
+    def close(self):
+        """Write the last collected rows and the end of the trajectory recording, and stop the worker
+        processes of the tiled engine."""
+        self.datacollector.flush()
+        if self.trajectory is not None:
+            self.trajectory.close()
+        if self.engine == "tiled":
+            self.colony_state.close()
+
+    def save_checkpoint(self, path):
+        """Save the state of the model (agents, memories, RNG states) in a NumPy archive, see abm_tools.checkpoint."""
+        save_checkpoint(self, path, ForagingAnt, Food)
+
+    @classmethod
+    def load_checkpoint(cls, path, **parameters):
+        """Create a model in the state saved by save_checkpoint, the run continues exactly like the saved one.
+
+        The keyword arguments (e.g. data_directory) are passed to the model constructor.
+        """
+        return load_checkpoint(cls, path, ForagingAnt, Food, **parameters)
+
     def step(self):
         """Run one step of the model."""
-        self.agents.shuffle_do("step")
-        self.calculate_ant_angles()
+        if self.colony_state is not None:
+            self.colony_state.step()
+        else:
+            # Food in reach of every ant, looked up in one batch
+            self.food_index.prepare_step(self.ant_search_radius, self.steps)
+            self.neighbor_graph.invalidate()
+            self.agents.shuffle_do("step")
+            if self.legs is not None:
+                self.legs.step()
+            self.calculate_ant_angles()
+
+        if self.pheromones is not None:
+            self.pheromones.step()
+
+        self.datacollector.collect(self)
+        if self.trajectory is not None:
+            self.trajectory.collect(self)
@@ -50,6 +50,7 @@ class ForagingAnt(ContinuousSpaceAgent):
         """
 
         super().__init__(space, model)
+        self.leg_event = None  # arrival event while on a scheduled leg (see abm_tools.legs)
         self.position = initial_position
         self.speed = speed
         self.direction = direction
@@ -60,6 +61,11 @@ class ForagingAnt(ContinuousSpaceAgent):
         # Ant state
         self.mode = "explore"  # Modes: "explore", "return_to_colony", "go_to_food"
         self.target = None
+        self.trail = 0.0  # strength of the pheromone trail laid on the way back to the colony
+
+        # Food sources whose collection radius the ant is in (their occupancy counts it)
+        self.food_zones = ()
+        self.update_food_zones()
 
 
     def step(self):
@@ -73,6 +79,7 @@ class ForagingAnt(ContinuousSpaceAgent):
                 self.mode = "return_to_colony"
                 self.memory.remember_short_term(model=self.model, entry_content=food_here, entry_type="food")
                 self.target = self.model.colony_position
+                self.trail = 1.0
             
             elif self.memory.get_by_type("food"):
                 self.mode = "go_to_food"
@@ -88,19 +95,35 @@ class ForagingAnt(ContinuousSpaceAgent):
                         self.target = latest_food
 
         else :
-            self.communicate()
+            # With a pheromone field, ants communicate through it instead of pairwise messages
+            if self.model.pheromones is None:
+                self.communicate()
         
         self.move()
     
 
+    @property
+    def position(self):
+        """Position of the ant (interpolated first if it is on a scheduled leg)."""
+        if self.leg_event is not None:
+            self.model.legs.sync()
+        return self.space.agent_positions[self.space._agent_to_index[self]]
+
+    @position.setter
+    def position(self, value):
+        ContinuousSpaceAgent.position.fset(self, value)
+
+
     def check_for_food(self):
-        """Check if there is food at the current position."""
-        food_sources = [agent for agent in self.space.get_agents_in_radius(
-            self.position, self.model.ant_search_radius)[0] 
-            if isinstance(agent, Food)]
-        
-        if food_sources != []:
-            return food_sources[0].pos
+        """Check if there is food at the current position.
+
+        Uses the food-only index of the model, queried for all the ants at the start of the step.
+        Returns a copy of the food position (or None).
+        """
+        food = self.model.food_index.in_reach(self, self.model.ant_search_radius)
+
+        if food is not None:
+            return self.model.food_index.position_of(food)
         return None
     
     
@@ -116,9 +139,9 @@ class ForagingAnt(ContinuousSpaceAgent):
         """Share food location information with nearby ants that are available (explore mode)."""
         
         if self.mode in ["return_to_colony", "go_to_food"]:
-            nearby_available_ants = [ant_agent for ant_agent in self.space.get_agents_in_radius(
-                self.position, self.range_of_communication)[0]
-                if isinstance(ant_agent, ForagingAnt) and ant_agent.unique_id != self.unique_id and ant_agent.mode == "explore"]
+            # Neighbors are read from the graph shared by all the ants for this step
+            nearby_available_ants = [ant_agent for ant_agent in self.model.neighbor_graph.neighbors(self.unique_id)
+                if isinstance(ant_agent, ForagingAnt) and ant_agent.mode == "explore"]
             
             # Share food location with nearby ants. An ant can only have one food memory at a time.
             food_memories_ids = self.memory.get_by_type("food")
@@ -134,6 +157,10 @@ class ForagingAnt(ContinuousSpaceAgent):
     def move(self):
         """Move the ant based on its current mode."""
 
+        # On a scheduled leg, the ant is moved by the model until its arrival event
+        if self.leg_event is not None:
+            return
+
         new_pos = None
         food_memories_index = self.memory.get_by_type("food")
         
@@ -141,6 +168,9 @@ class ForagingAnt(ContinuousSpaceAgent):
 
             # Random movement with some directional persistence
             self.direction = self.direction + np.array([self.random.uniform(-0.5, 0.5), self.random.uniform(-0.5, 0.5)])
+            # Follow the pheromone trails
+            if self.model.pheromones is not None:
+                self.direction = self.direction + self.model.pheromone_attraction * self.model.pheromones.direction_at(self.position)
             # Normalize direction
             norm = np.linalg.norm(self.direction)
             if norm > 0:
@@ -150,6 +180,15 @@ class ForagingAnt(ContinuousSpaceAgent):
 
 
         elif self.mode in ["return_to_colony", "go_to_food"]:
+            # Straight line to the target: with scheduled legs, the moves are done by the model up to the arrival
+            if self.model.legs is not None and self.target is not None and self.model.legs.start(self):
+                return
+
+            # Lay a trail from the food to the colony, stronger near the food
+            if self.mode == "return_to_colony" and self.model.pheromones is not None:
+                self.model.pheromones.deposit(self.position, self.model.pheromone_deposit * self.trail)
+                self.trail *= self.model.pheromone_trail_decay
+
             if self.target is not None:
                 # Move towards target (colony or food)
                 vector_to_target = np.array(self.target) - np.array(self.position)
@@ -180,11 +219,9 @@ class ForagingAnt(ContinuousSpaceAgent):
                     elif self.mode == "go_to_food" and self.near_target():
                         # If near food target, switch to exploring (which will find the food)
 
-                        nearby_food = [agent for agent in self.space.get_agents_in_radius(
-                            self.position, self.model.ant_search_radius)[0] 
-                            if isinstance(agent, Food)]
+                        nearby_food = self.model.food_index.in_reach(self, self.model.ant_search_radius)
 
-                        if not nearby_food: #back to exploring, and forget previous food memories
+                        if nearby_food is None: #back to exploring, and forget previous food memories
                             self.mode = "explore"
                             if food_memories_index:
                                     self.memory.short_term.clear()
@@ -194,16 +231,43 @@ class ForagingAnt(ContinuousSpaceAgent):
         # Move the agent
         if new_pos is not None:
             self.position = new_pos
+            self.update_food_zones()
             
             # Calculate angle for visualization
             self.angle = np.degrees(np.arctan2(self.direction[1], self.direction[0]))
 
 
+    def finish_leg(self):
+        """Arrival event of a scheduled leg: the ant is put at its last full move, then makes its last move as usual."""
+        position = self.model.legs.finish(self)
+        self.leg_event = None
+        self.position = position
+        self.model.food_index.moved(self)
+        self.update_food_zones()
+        self.move()
+
+
+    def update_food_zones(self):
+        """Update the occupancy counters of the food sources whose collection radius the ant entered or left."""
+        food_zones = self.model.food_index.foods_in_radius(self.position, self.model.food_collection_radius)
+        if food_zones == self.food_zones:
+            return
+
+        for food in self.food_zones:
+            if food not in food_zones:
+                food.occupancy -= 1
+        for food in food_zones:
+            if food not in self.food_zones:
+                food.occupancy += 1
+        self.food_zones = food_zones
+
+
 class Food(ContinuousSpaceAgent):
     """A food agent.
 
     Spawns randomly, and is collected when a precise number of ants gather
-    around it. There is always a constant number in the grid. 
+    around it. There is always a constant number in the grid (a new one
+    is placed by the model when one is collected, unless food_respawn is False).
     """
 
     def __init__(
@@ -224,18 +288,28 @@ class Food(ContinuousSpaceAgent):
         super().__init__(space, model)
         self.position = position
         self.ants_needed = ants_needed
-        self.neighbors = []
         self.space = space
         self.model = model
+        model.food_index.add(self)
 
-    def step(self):
-        """Update the list of neighbors for visualization purposes."""
-        self.neighbors = self.space.get_agents_in_radius(self.position, self.model.food_collection_radius)[0]
-        nearby_ants = [agent for agent in self.neighbors if isinstance(agent, ForagingAnt)]
-
-        if len(nearby_ants) >= self.ants_needed:
-            # If enough ants, remove the food and spawn a new one
-            self.remove()
-            self.model.food_collected +=1
+        # Number of ants within food_collection_radius, updated by the ants when they move
+        self.occupancy = 0
+        for agent in self.space.get_agents_in_radius(self.position, model.food_collection_radius)[0]:
+            # the ants on a scheduled leg are counted by the model (see Food.step)
+            if isinstance(agent, ForagingAnt) and agent.leg_event is None:
+                agent.food_zones += (self,)
+                self.occupancy += 1
 
+    def remove(self):
+        """Remove the food from the model, the space and the food index."""
+        self.model.food_index.remove(self)
+        super().remove()
 
+    def step(self):
+        """Collect the food once enough ants are gathered around it (see ForagingAnt.update_food_zones)."""
+        occupancy = self.occupancy
+        if self.model.legs is not None:
+            occupancy += self.model.legs.occupancy(self)
+        if occupancy >= self.ants_needed:
+            # If enough ants, remove the food and spawn a new one
+            self.model.collect_food(self)
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from abm_tools.collector import load_chunks
+from abm_tools.models import load_model
+
+CONFIGURATIONS = [
+    {"engine": "agents"},
+    {"engine": "agents", "pheromones": True, "scheduled_legs": True},
+    {"engine": "vectorized"},
+]
+
+
+def state(model):
+    """Counters, modes and the positions of the agents by unique_id."""
+    model.sync_agent_view()
+    return (
+        model.steps,
+        model.food_collected,
+        model.mode_counts(),
+        {agent.unique_id: tuple(agent.position) for agent in model.agents},
+    )
+
+
+@pytest.mark.parametrize("model_name", ["foraging_V1", "foraging_V2"])
+@pytest.mark.parametrize("config", CONFIGURATIONS)
+def test_restored_run_continues_like_the_original(tmp_path, model_name, config):
+    model_class = load_model(model_name)
+    data_directory = str(tmp_path / "data")
+    model = model_class(seed=5, initial_ants=100, ants_needed=2, data_directory=data_directory, data_chunk_size=7, **config)
+    for _ in range(25):
+        model.step()
+    path = str(tmp_path / "checkpoint.npz")
+    model.save_checkpoint(path)
+
+    for _ in range(25):
+        model.step()
+    model.close()
+    expected = state(model)
+    expected_data = load_chunks(data_directory)
+
+    restored = model_class.load_checkpoint(path, data_directory=data_directory, data_chunk_size=7)
+    for _ in range(25):
+        restored.step()
+    restored.close()
+
+    assert state(restored) == expected
+    data = load_chunks(data_directory)
+    assert set(data) == set(expected_data)
+    for name in expected_data:
+        np.testing.assert_array_equal(data[name], expected_data[name])
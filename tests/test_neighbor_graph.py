@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from abm_tools.models import load_model
+from abm_tools.spatial import NeighborGraph
+
+
+def neighbor_sets(graph):
+    """unique_id -> unique_ids of the neighbors, for all the agents of a (rebuilt) graph."""
+    graph.invalidate()
+    graph.build()
+    return {
+        agent.unique_id: sorted(neighbor.unique_id for neighbor in graph.neighbors(agent.unique_id))
+        for agent in graph.agents
+    }
+
+
+@pytest.mark.parametrize("model_name", ["foraging_V1", "foraging_V2"])
+def test_skin_gives_the_same_neighbors(model_name):
+    model_class = load_model(model_name)
+    # small food sources and respawns, so that agents are also added and removed between queries
+    plain = model_class(seed=2, initial_ants=150, ants_needed=2, communication_skin=0.0)
+    skinned = model_class(seed=2, initial_ants=150, ants_needed=2, communication_skin=3.0)
+
+    for _ in range(60):
+        plain.step()
+        skinned.step()
+        expected = neighbor_sets(plain.neighbor_graph)
+        assert neighbor_sets(skinned.neighbor_graph) == expected
+        # and both are what a fresh query finds
+        fresh = NeighborGraph(skinned.space, skinned.neighbor_graph.radius)
+        assert neighbor_sets(fresh) == expected
+
+    assert skinned.neighbor_graph.n_queries < plain.neighbor_graph.n_queries
+    assert skinned.food_collected == plain.food_collected
+    np.testing.assert_array_equal(skinned.space.agent_positions, plain.space.agent_positions)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from abm_tools.placement import poisson_disk_sample
+
+DIMENSIONS = [[0, 100], [0, 100]]
+# colony zone of the foraging models (colony_radius * 3 around the center)
+COLONY = ((50, 50), 15)
+
+
+def torus_distances(points, size=100):
+    delta = np.abs(points[:, None, :] - points[None, :, :])
+    delta = np.minimum(delta, size - delta)
+    return np.hypot(delta[..., 0], delta[..., 1])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_fills_crowded_map(seed):
+    points = poisson_disk_sample(np.random.default_rng(seed), DIMENSIONS, 60, 10.0, exclude=[COLONY])
+
+    assert points.shape == (60, 2)
+    distances = torus_distances(points)
+    np.fill_diagonal(distances, np.inf)
+    assert distances.min() >= 10.0
+    assert (torus_distances(np.vstack([points, COLONY[0]]))[-1, :-1] > COLONY[1]).all()
+
+
+def test_raises_when_full():
+    with pytest.raises(ValueError):
+        poisson_disk_sample(np.random.default_rng(0), DIMENSIONS, 120, 10.0)
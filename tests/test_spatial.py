@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from abm_tools.spatial import KDForest
+
+ORIGIN = np.array([-10.0, 0.0])
+SIZE = np.array([100.0, 50.0])
+
+
+def distances(points, point, torus):
+    delta = np.abs(points - point)
+    if torus:
+        delta = np.mod(delta, SIZE)
+        delta = np.minimum(delta, SIZE - delta)
+    return np.hypot(delta[:, 0], delta[:, 1])
+
+
+@pytest.mark.parametrize("torus", [True, False])
+def test_forest_matches_brute_force(torus):
+    rng = np.random.default_rng(0)
+    forest = KDForest(ORIGIN, SIZE, torus=torus, buffer_size=8)
+    points = {}  # slot -> point
+    radius = 6.0
+
+    for _ in range(600):
+        if points and rng.random() < 0.4:
+            slot = int(rng.choice(list(points)))
+            forest.delete(slot)
+            del points[slot]
+        else:
+            # the smallest free slot, so that freed slots are reused
+            slot = min(set(range(len(points) + 1)) - set(points))
+            points[slot] = ORIGIN + rng.random(2) * SIZE
+            forest.insert(slot, points[slot])
+        assert len(forest) == len(points)
+
+        slots = np.array(sorted(points), dtype=np.intp)
+        positions = np.array([points[slot] for slot in slots]).reshape(-1, 2)
+        queries = ORIGIN + rng.random((4, 2)) * SIZE
+        if torus:
+            # points outside of the space wrap around
+            queries += rng.integers(-1, 2, (4, 2)) * SIZE
+
+        counts = forest.count(queries, radius)
+        nearest = forest.nearest(queries, radius)
+        for i, query in enumerate(queries):
+            d = distances(positions, query, torus)
+            in_range = slots[d <= radius]
+            assert forest.ball(query, radius) == in_range.tolist()
+            assert counts[i] == len(in_range)
+            if len(in_range):
+                assert d[slots == nearest[i]][0] == d.min()
+            else:
+                assert nearest[i] == -1
+
+
+def test_delete_unknown_slot():
+    forest = KDForest(ORIGIN, SIZE)
+    forest.insert(0, (0.0, 0.0))
+    forest.delete(0)
+    with pytest.raises(KeyError):
+        forest.delete(0)
+    with pytest.raises(ValueError):
+        forest.insert(1, (0.0, 0.0))
+        forest.insert(1, (1.0, 1.0))
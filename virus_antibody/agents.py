@@ -2,16 +2,32 @@
 Mesa implementation of Virus/Antibody model: Agents module.
 """
 
-import copy
 import os
 import sys
-import weakref
 from collections import deque
 
 import numpy as np
 
 sys.path.insert(0, os.path.abspath("../../mesa"))
 from mesa.experimental.continuous_space import ContinuousSpaceAgent
+from mesa.experimental.devs.eventlist import SimulationEvent
+
+# The DNA of a virus is made of 3 digits, packed in an integer code: digits [a, b, c] -> 100a + 10b + c.
+# An antibody remembers the codes it knows as the set bits of an integer (a bitset of 1000 bits).
+DNA_LENGTH = 3
+
+
+def encode_dna(digits):
+    """Integer code (0-999) of a list of DNA digits."""
+    code = 0
+    for digit in digits:
+        code = 10 * code + digit
+    return code
+
+
+def dna_digits(code):
+    """Digits of a DNA code, most significant first."""
+    return [code // 10 ** (DNA_LENGTH - 1 - i) % 10 for i in range(DNA_LENGTH)]
 
 
 class AntibodyAgent(ContinuousSpaceAgent):
@@ -42,15 +58,46 @@ class AntibodyAgent(ContinuousSpaceAgent):
         self.health = 2
         self.duplication_rate = duplication_rate
 
-        # Memory
+        # Memory: DNA codes of the recent viruses (st_memory, and st_bits as a bitset),
+        # and bitset of all the DNA codes ever met or learned (lt_memory)
         self.st_memory: deque = deque()
-        self.lt_memory: list = []
+        self.st_bits = 0
+        self.lt_memory = 0
         self.memory_capacity = memory_capacity
 
-        # Target & KO state
-        self.target = None  # will hold a weakref.ref or None
+        # Target & KO state: a virus, self when KO, or None
+        # (the model notifies the antibodies chasing a virus when it is removed, see target)
+        self._target = None
         self.ko_timeout = ko_timeout
-        self.ko_steps_left = 0
+
+    @property
+    def target(self):
+        return self._target
+
+    @target.setter
+    def target(self, target):
+        # keep the reverse index of the model (virus -> antibodies chasing it) up to date
+        previous = self._target
+        if target is previous:
+            return
+        chasers = self.model.chasers
+        if previous is not None and previous is not self:
+            del chasers[previous][self]
+            if not chasers[previous]:
+                del chasers[previous]
+        if target is not None and target is not self:
+            chasers.setdefault(target, {})[self] = None
+        self._target = target
+
+    def remove(self):
+        self.target = None
+        self.model.active_agents.discard(self)
+        super().remove()
+
+    def recover(self):
+        """End of a KO: the antibody is stepped again, and looks for a new target."""
+        self.target = None
+        self.model.active_agents.add(self)
 
     def step(self):
         if self is None:
@@ -60,7 +107,7 @@ class AntibodyAgent(ContinuousSpaceAgent):
         if self.target is None:
             closest = self.find_closest_virus()
             if closest:
-                self.target = weakref.ref(closest)
+                self.target = closest
 
         # Communicate and maybe duplicate
         self.communicate()
@@ -71,31 +118,43 @@ class AntibodyAgent(ContinuousSpaceAgent):
         self.move()
 
     def find_closest_virus(self):
-        agents, _ = self.space.get_agents_in_radius(self.position, self.sight_range)
-        viruses = [a for a in agents if isinstance(a, VirusAgent)]
-        return viruses[0] if viruses else None
+        # Nearest virus within sight range, from the batched query of the model for this step
+        return self.model.virus_index.nearest(self)
 
     def communicate(self) -> bool:
-        agents, _ = self.space.get_agents_in_radius(self.position, self.sight_range)
-        peers = [
-            a
-            for a in agents
-            if isinstance(a, AntibodyAgent) and a.unique_id != self.unique_id
-        ]
+        peers = self.model.neighbor_graph.neighbors_of_type(self.unique_id, AntibodyAgent)
         if not peers:
             return False
 
         for other in peers:
-            to_share = [
-                dna for dna in self.st_memory if dna and dna not in other.lt_memory
-            ]
-            if to_share:
-                other.st_memory.extend(to_share)
-                other.lt_memory.extend(to_share)
-                while len(other.st_memory) > self.memory_capacity:
-                    other.st_memory.popleft()
+            # DNA of the short term memory that the other does not know yet
+            new = self.st_bits & ~other.lt_memory
+            if new:
+                other.remember(
+                    [dna for dna in self.st_memory if new >> dna & 1],
+                    capacity=self.memory_capacity,
+                )
         return True
 
+    def knows(self, dna) -> bool:
+        """Whether the DNA code is in the memory of the antibody."""
+        return bool(self.lt_memory >> dna & 1)
+
+    def remember(self, dnas, capacity=None):
+        """Add DNA codes (unknown to the antibody) to its short and long term memories.
+
+        Args:
+            dnas: DNA codes, in the order they are learned
+            capacity: the oldest codes of the short term memory are forgotten beyond it (default: kept)
+        """
+        for dna in dnas:
+            self.st_memory.append(dna)
+            self.st_bits |= 1 << dna
+            self.lt_memory |= 1 << dna
+        if capacity is not None:
+            while len(self.st_memory) > capacity:
+                self.st_bits &= ~(1 << self.st_memory.popleft())
+
     def duplicate(self):
         clone = AntibodyAgent(
             self.model,
@@ -108,35 +167,25 @@ class AntibodyAgent(ContinuousSpaceAgent):
             direction=self.direction,
         )
         # Copy over memory
-        clone.st_memory = deque(item for item in self.st_memory if item)
-        clone.lt_memory = [item for item in self.lt_memory if item]
+        clone.st_memory = deque(self.st_memory)
+        clone.st_bits = self.st_bits
+        clone.lt_memory = self.lt_memory
         clone.target = None
-        clone.ko_steps_left = 0
 
         self.model.antibodies_set.add(clone)
+        self.model.active_agents.add(clone)
 
     def move(self):
         # If we've been removed from the space, bail out
         if getattr(self, "space", None) is None:
             return
 
-        # Dereference weakref if needed
-        target = (
-            self.target()
-            if isinstance(self.target, weakref.ReferenceType)
-            else self.target
-        )
+        target = self.target
 
         new_pos = None
 
-        # KO state: target refers back to self
-        if target is self:
-            self.ko_steps_left -= 1
-            if self.ko_steps_left <= 0:
-                self.target = None
-
         # Random walk if no target
-        elif target is None:
+        if target is None:
             perturb = np.array(
                 [
                     self.random.uniform(-0.5, 0.5),
@@ -149,30 +198,22 @@ class AntibodyAgent(ContinuousSpaceAgent):
                 self.direction /= norm
             new_pos = self.position + self.direction * self.speed
 
-        # Chase a valid virus target
+        # Chase the target (a removed virus is no longer the target of anyone)
         else:
-            if getattr(target, "space", None) is not None:
-                vec = np.array(target.position) - np.array(self.position)
-                dist = np.linalg.norm(vec)
-                if dist > self.speed:
-                    self.direction = vec / dist
-                    new_pos = self.position + self.direction * self.speed
-                else:
-                    self.engage_virus(target)
+            vec = np.array(target.position) - np.array(self.position)
+            dist = np.linalg.norm(vec)
+            if dist > self.speed:
+                self.direction = vec / dist
+                new_pos = self.position + self.direction * self.speed
             else:
-                self.target = None
+                self.engage_virus(target)
 
         if new_pos is not None:
             self.position = new_pos
 
     def engage_virus(self, virus) -> str:
-        # If it's already gone
-        if virus not in self.model.agents:
-            self.target = None
-            return "no_target"
-
-        dna = copy.deepcopy(virus.dna)
-        if dna in self.st_memory or dna in self.lt_memory:
+        # the long term memory holds the short term one
+        if self.knows(virus.dna):
             virus.remove()
             self.target = None
             return "win"
@@ -183,11 +224,11 @@ class AntibodyAgent(ContinuousSpaceAgent):
                 self.remove()
                 return "dead"
 
-            self.st_memory.append(dna)
-            self.lt_memory.append(dna)
-            self.ko_steps_left = self.ko_timeout
-            # mark KO state by weak-ref back to self
-            self.target = weakref.ref(self)
+            self.remember([virus.dna])
+            # mark KO state by targeting self, the antibody is not stepped until it recovers
+            self.target = self
+            self.model.active_agents.discard(self)
+            self.model.ko_events.add_event(SimulationEvent(self.model.steps + self.ko_timeout, self.recover))
             return "ko"
 
 
@@ -212,6 +253,13 @@ class VirusAgent(ContinuousSpaceAgent):
         self.direction = np.array((1, 1), dtype=float)
         self.dna = dna if dna is not None else self.generate_dna()
 
+    def remove(self):
+        # the antibodies chasing the virus look for another target
+        for antibody in list(self.model.chasers.get(self, ())):
+            antibody.target = None
+        self.model.active_agents.discard(self)
+        super().remove()
+
     def step(self):
         # If already removed from the space, don't do anything
         if getattr(self, "space", None) is None:
@@ -230,17 +278,20 @@ class VirusAgent(ContinuousSpaceAgent):
             dna=self.generate_dna(self.dna),
         )
         self.model.viruses_set.add(clone)
+        self.model.active_agents.add(clone)
 
     def generate_dna(self, dna=None):
+        """A random DNA code, or the code of the clone of a virus with DNA dna (maybe mutated)."""
         if dna is None:
-            return [self.random.randint(0, 9) for _ in range(3)]
-        idx = self.random.randint(0, 2)
+            return encode_dna([self.random.randint(0, 9) for _ in range(DNA_LENGTH)])
+        idx = self.random.randint(0, DNA_LENGTH - 1)
         chance = self.random.random()
+        digits = dna_digits(dna)
         if chance < self.mutation_rate / 2:
-            dna[idx] = (dna[idx] + 1) % 10
+            digits[idx] = (digits[idx] + 1) % 10
         elif chance < self.mutation_rate:
-            dna[idx] = (dna[idx] - 1) % 10
-        return dna
+            digits[idx] = (digits[idx] - 1) % 10
+        return encode_dna(digits)
 
     def move(self):
         if getattr(self, "space", None) is None:
@@ -1,6 +1,10 @@
 import os
 import sys
-import weakref
+
+# the repository root, for abm_tools when run from this directory (solara run app.py)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
 
 from agents import AntibodyAgent, VirusAgent
 from matplotlib.markers import MarkerStyle
@@ -16,6 +20,11 @@ from mesa.visualization import (
     make_space_component,
 )
 
+from abm_tools.trajectory import ReplayAgent, ReplayModel, TrajectoryReader
+
+# Directory of a trajectory recording to replay instead of simulating (REPLAY=path solara run app.py)
+REPLAY_DIRECTORY = os.environ.get("REPLAY")
+
 # Style and portrayals
 MARKER_CACHE = {}
 MARKER_CACHE["antibody"] = MarkerStyle("o")
@@ -26,21 +35,31 @@ def agent_portrayal(agent):
     """Portray an agent for visualization."""
     portrayal = {}
 
-    if isinstance(agent, AntibodyAgent):
-        portrayal["marker"] = MARKER_CACHE["antibody"]
-        portrayal["size"] = 30
+    if isinstance(agent, ReplayAgent):
+        # Agent of a recording, with its recorded type and state
+        kind, state = agent.kind, agent.state
+    elif isinstance(agent, AntibodyAgent):
+        target_obj = agent.target
 
-        if isinstance(agent.target, weakref.ReferenceType):
-            target_obj = agent.target()  # dereference the weakref
+        if target_obj == agent:
+            kind, state = "antibody", "ko"
+        elif target_obj is None:
+            kind, state = "antibody", "moving"
         else:
-            target_obj = agent.target
+            kind, state = "antibody", "targeting"
+    else:
+        kind, state = "virus", None
 
-        if target_obj == agent:
+    if kind == "antibody":
+        portrayal["marker"] = MARKER_CACHE["antibody"]
+        portrayal["size"] = 30
+
+        if state == "ko":
             # gray if ko
             portrayal["color"] = "gray"
             portrayal["layer"] = 2
 
-        elif target_obj is None:
+        elif state == "moving":
             # Blue if moving
             portrayal["color"] = "blue"
             portrayal["layer"] = 1
@@ -50,7 +69,7 @@ def agent_portrayal(agent):
             portrayal["color"] = "purple"
             portrayal["layer"] = 1
 
-    elif isinstance(agent, VirusAgent):
+    elif kind == "virus":
         portrayal["marker"] = MARKER_CACHE["virus"]
         portrayal["size"] = 50
         portrayal["color"] = "red"
@@ -120,6 +139,26 @@ agents_lineplot_component = make_plot_component(
     post_process=post_process_lines,
 )
 
+if REPLAY_DIRECTORY:
+    # Play the recording, the slider chooses the step shown first
+    recording = TrajectoryReader(REPLAY_DIRECTORY)
+    model_params = {
+        "directory": REPLAY_DIRECTORY,
+        "start_step": Slider(
+            label="Start at step",
+            value=int(recording.steps[0]),
+            min=int(recording.steps[0]),
+            max=int(recording.steps[-1]),
+            step=recording.every,
+        ),
+    }
+    model = ReplayModel(REPLAY_DIRECTORY)
+    # the replay counts the agents of each recorded type
+    agents_lineplot_component = make_plot_component(
+        {"antibody": "tab:blue", "virus": "tab:red"},
+        post_process=post_process_lines,
+    )
+
 agent_portrayal_component = make_space_component(
     agent_portrayal=agent_portrayal, backend="matplotlib"
 )
@@ -8,12 +8,33 @@ import os
 import sys
 
 sys.path.insert(0, os.path.abspath("../../mesa"))
+# the repository root, for abm_tools when run from this directory (solara run app.py)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.append(ROOT)
 
 import numpy as np
-from agents import AntibodyAgent, VirusAgent
+from agents import DNA_LENGTH, AntibodyAgent, VirusAgent, encode_dna
 from mesa import Model
+from mesa.agent import AgentSet
 from mesa.datacollection import DataCollector
 from mesa.experimental.continuous_space import ContinuousSpace
+from mesa.experimental.devs.eventlist import EventList
+
+from abm_tools.spatial import NearestIndex, NeighborGraph
+from abm_tools.trajectory import TrajectoryRecorder
+
+# Agent types and states of the trajectory recordings
+TRAJECTORY_TYPES = ("antibody", "virus")
+TRAJECTORY_STATES = ("moving", "targeting", "ko")
+
+
+def count_antibodies(model):
+    return len(model.agents_by_type[AntibodyAgent])
+
+
+def count_viruses(model):
+    return len(model.agents_by_type[VirusAgent])
 
 
 class VirusAntibodyModel(Model):
@@ -39,6 +60,9 @@ class VirusAntibodyModel(Model):
         # Virus parameters
         virus_duplication_rate=0.01,
         virus_mutation_rate=0.01,
+        # Recording
+        trajectory_directory=None,
+        trajectory_every=1,
     ):
         """Create a new Virus/Antibody  model.
 
@@ -51,6 +75,10 @@ class VirusAntibodyModel(Model):
             antibody_duplication_rate: Probability of duplication for antibodies
             virus_duplication_rate: Probability of duplication for viruses
             virus_mutation_rate: Probability of mutation for viruses
+            trajectory_directory: Directory where the positions, types and states of all the agents
+                are recorded every trajectory_every steps, to be replayed later without the model
+                (default: None, no recording, see abm_tools.trajectory)
+            trajectory_every: Recording period of the trajectory, in steps
 
         Indirect Args (not chosen in the graphic interface for clarity reasons):
             antibody_memory_capacity: Number of virus DNA an antibody can remember
@@ -83,9 +111,10 @@ class VirusAntibodyModel(Model):
         self.running = True
 
         # Set up data collection
+        # module-level reporters, so that the model can be pickled (see abm_tools.warmstart)
         model_reporters = {
-            "Antibodies": lambda m: len(m.agents_by_type[AntibodyAgent]),
-            "Viruses": lambda m: len(m.agents_by_type[VirusAgent]),
+            "Antibodies": count_antibodies,
+            "Viruses": count_viruses,
         }
 
         self.datacollector = DataCollector(model_reporters=model_reporters)
@@ -98,6 +127,18 @@ class VirusAntibodyModel(Model):
             # n_agents=initial_antibody + initial_viruses,
         )
 
+        # Antibodies chasing each virus (virus -> {antibody: None}), kept by AntibodyAgent.target
+        self.chasers = {}
+
+        # Knocked-out antibodies are not stepped: they leave the active agents, and an event of
+        # ko_events puts them back at the end of their KO
+        self.ko_events = EventList()
+
+        # Agents within sight range of each antibody, computed with one KD-tree query per step
+        self.neighbor_graph = NeighborGraph(self.space, self.antibody_sight_range)
+        # Nearest virus within sight range of the antibodies without a target, looked up once per step
+        self.virus_index = NearestIndex(self.space, self.antibody_sight_range)
+
         # Create and place the Antibody agents
         antibodies_positions = self.rng.random(
             size=(self.initial_antibody, 2)
@@ -116,7 +157,7 @@ class VirusAntibodyModel(Model):
         )
 
         # Create and place the Virus agents
-        dna = [self.random.randint(0, 9) for _ in range(3)]
+        dna = encode_dna([self.random.randint(0, 9) for _ in range(DNA_LENGTH)])
         viruses_positions = self.rng.random(size=(self.initial_viruses, 2)) * np.array(
             self.space.size
         )
@@ -132,12 +173,69 @@ class VirusAntibodyModel(Model):
             dna=dna,
         )
 
+        # Agents stepped by the model (all of them, except the knocked-out antibodies)
+        self.active_agents = AgentSet(self.agents, random=self.random)
+
         self.datacollector.collect(self)
 
+        # Agents of every recorded step, written to disk by compressed chunks
+        self.trajectory = None
+        if trajectory_directory is not None:
+            self.trajectory = TrajectoryRecorder(
+                trajectory_directory,
+                lambda m: m.trajectory_frame(),
+                TRAJECTORY_TYPES,
+                TRAJECTORY_STATES,
+                self.space,
+                every=trajectory_every,
+                metadata={"model": type(self).__name__},
+            )
+            self.trajectory.collect(self)
+
+    def trajectory_frame(self):
+        """Positions, types, states and headings of the antibodies and viruses, as recorded in the trajectory."""
+        antibodies = list(self.agents_by_type.get(AntibodyAgent, []))
+        viruses = list(self.agents_by_type.get(VirusAgent, []))
+        agents = antibodies + viruses
+
+        states = []
+        for antibody in antibodies:
+            target = antibody.target
+            if target is antibody:
+                states.append(2)
+            elif target is None:
+                states.append(0)
+            else:
+                states.append(1)
+        states += [0] * len(viruses)
+
+        directions = np.array([agent.direction for agent in agents], dtype=float).reshape(-1, 2)
+        return {
+            "position": np.array([agent.position for agent in agents], dtype=float).reshape(-1, 2),
+            "type": np.repeat([0, 1], [len(antibodies), len(viruses)]),
+            "state": states,
+            "angle": np.degrees(np.arctan2(directions[:, 1], directions[:, 0])),
+        }
+
+    def close(self):
+        """Write the end of the trajectory recording."""
+        if self.trajectory is not None:
+            self.trajectory.close()
+
     def step(self):
         """Run one step of the model."""
-        self.agents.shuffle_do("step")
+        self.neighbor_graph.invalidate()
+        self.virus_index.prepare_step(
+            self.agents_by_type.get(VirusAgent, []),
+            [antibody for antibody in self.agents_by_type.get(AntibodyAgent, []) if antibody.target is None],
+        )
+        self.active_agents.shuffle_do("step")
+        # end of the KOs due at this step
+        while not self.ko_events.is_empty() and self.ko_events.peak_ahead()[0].time <= self.steps:
+            self.ko_events.pop_event().execute()
         self.datacollector.collect(self)
+        if self.trajectory is not None:
+            self.trajectory.collect(self)
 
         if (
             len(self.agents_by_type[AntibodyAgent]) > 200